@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+
+#System modules
+import sys
+import os
+import json
+import math
+import time
+import cmath
+import platform
+import multiprocessing
+from os.path import join, dirname, realpath
+
+#Argument parsing modules
+import argparse
+
+#Feynman modules
+from feynman.parsing import CFile
+from feynman.integration import GslMonteCarloFunctionIntegrator, \
+                                OpenClMonteCarloFunctionIntegrator
+
+#The directory holding the integrand sources
+_share_path = join(dirname(realpath(__file__)), "share")
+
+#Backends and Monte Carlo types to benchmark
+_BACKENDS = ("gsl", "opencl")
+_MONTE_CARLO_TYPES = ("plain", "miser", "vegas", "quasi")
+
+class BenchmarkIntegrand(object):
+    def __init__(self, name, file_name, header_name, bounds, exact):
+        self.__name = name
+        self.__file_name = file_name
+        self.__header_name = header_name
+        self.__bounds = bounds
+        self.__exact = exact
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def file_path(self):
+        return join(_share_path, self.__file_name)
+
+    @property
+    def header_name(self):
+        return self.__header_name
+
+    @property
+    def bounds(self):
+        return self.__bounds
+
+    @property
+    def exact(self):
+        return self.__exact
+
+def _oscillatory_exact():
+    #The real part of e^(i c) times the product of
+    #(e^(i a) - 1) / (i a) for each coefficient a
+    value = cmath.exp(1.0j)
+    for a in (2.0, 3.0, 5.0):
+        value *= (cmath.exp(1.0j * a) - 1.0) / (1.0j * a)
+    return value.real
+
+#The integrands to benchmark, with their analytic results
+#(see the integrand headers for the derivations)
+BENCHMARK_INTEGRANDS = (
+    BenchmarkIntegrand("unit_cylinder",
+                       "sample_integrands.cpp",
+                       "sample_integrands.h",
+                       [(-1.0, 1.0)] * 2,
+                       math.pi),
+    BenchmarkIntegrand("random_walk",
+                       "sample_integrands.cpp",
+                       "sample_integrands.h",
+                       [(-math.pi, math.pi)] * 3,
+                       math.gamma(0.25) ** 4 / (4.0 * math.pi ** 3)),
+    BenchmarkIntegrand("gaussian_peak",
+                       "benchmark_integrands.cpp",
+                       "benchmark_integrands.h",
+                       [(0.0, 1.0)] * 2,
+                       (math.pi / 100.0) * math.erf(5.0) ** 2),
+    BenchmarkIntegrand("oscillatory",
+                       "benchmark_integrands.cpp",
+                       "benchmark_integrands.h",
+                       [(0.0, 1.0)] * 3,
+                       _oscillatory_exact()),
+    BenchmarkIntegrand("sine_product",
+                       "benchmark_integrands.cpp",
+                       "benchmark_integrands.h",
+                       [(0.0, 1.0)] * 8,
+                       1.0),
+)
+
+#Helper functions
+def parse_arguments():
+    #Create the argument parser
+    parser = argparse.ArgumentParser(description = "Feynman Integrator Benchmarks")
+    parser.add_argument("-o",
+                        "--output",
+                        dest = "output",
+                        required = False,
+                        default = None,
+                        metavar = "OUTPUT",
+                        help = "The path to write the results to, as JSON.")
+    parser.add_argument("-b",
+                        "--backend",
+                        dest = "backends",
+                        action = "append",
+                        choices = _BACKENDS,
+                        help = "A backend to benchmark (may be repeated).  Defaults " \
+                               "to all backends.")
+    parser.add_argument("-t",
+                        "--monte-carlo-type",
+                        dest = "monte_carlo_types",
+                        action = "append",
+                        choices = _MONTE_CARLO_TYPES,
+                        help = "A Monte Carlo type to benchmark (may be repeated).  " \
+                               "Defaults to all types.")
+    parser.add_argument("-i",
+                        "--integrand",
+                        dest = "integrands",
+                        action = "append",
+                        choices = [i.name for i in BENCHMARK_INTEGRANDS],
+                        help = "An integrand to benchmark (may be repeated).  " \
+                               "Defaults to all integrands.")
+    parser.add_argument("-n",
+                        "--n-calls",
+                        dest = "n_calls",
+                        default = 1000000,
+                        type = int,
+                        help = "The number of calls per integration.")
+    parser.add_argument("-r",
+                        "--repeats",
+                        dest = "repeats",
+                        default = 3,
+                        type = int,
+                        help = "The number of times to run each integration.  The " \
+                               "fastest run gives the timings, and all of them the " \
+                               "accuracy.")
+    parser.add_argument("-s",
+                        "--seed",
+                        dest = "seed",
+                        default = 0,
+                        type = int,
+                        help = "The random number seed for the GSL backend " \
+                               "(GSL_RNG_SEED).  The OpenCL backend seeds from the " \
+                               "time, so only its timings are reproducible.")
+    parser.add_argument("-I",
+                        "--include-directory",
+                        dest = "include_directories",
+                        action = "append",
+                        default = [],
+                        help = "An extra include directory for building the " \
+                               "integrators (may be repeated).")
+    parser.add_argument("-L",
+                        "--library-directory",
+                        dest = "library_directories",
+                        action = "append",
+                        default = [],
+                        help = "An extra library directory for building the " \
+                               "integrators (may be repeated).")
+    parser.add_argument("-f",
+                        "--flag",
+                        dest = "flags",
+                        action = "append",
+                        default = None,
+                        help = "A compiler flag for building the integrators (may " \
+                               "be repeated).  Defaults to -O2.")
+    parser.add_argument("--compiler",
+                        dest = "compiler",
+                        default = None,
+                        help = "The compiler to build the integrators with.  " \
+                               "Defaults to $CXX, or c++.")
+    parser.add_argument("-c",
+                        "--compare",
+                        dest = "compare",
+                        nargs = 2,
+                        default = None,
+                        metavar = ("OLD", "NEW"),
+                        help = "Instead of running the benchmarks, compare two sets " \
+                               "of results and report regressions, exiting with a " \
+                               "non-zero status if there are any.")
+    parser.add_argument("--tolerance",
+                        dest = "tolerance",
+                        default = 0.1,
+                        type = float,
+                        help = "The fraction by which a run may slow down before " \
+                               "it is reported as a regression.")
+    return parser.parse_args()
+
+def _run_in_child(connection, function, arguments):
+    #Send back the result of the function, or the error
+    try:
+        connection.send((None, function(*arguments)))
+    except Exception as e:
+        connection.send(("%s: %s" % (type(e).__name__, e), None))
+    connection.close()
+
+def _run_isolated(function, *arguments):
+    #Run a function in a child process, since the generated
+    #integrators exit on OpenCL errors, and each process can
+    #only load a given library once
+    receiver, sender = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target = _run_in_child,
+                                      args = (sender, function, arguments))
+    process.start()
+    sender.close()
+    try:
+        error, result = receiver.recv()
+    except EOFError:
+        error, result = None, None
+    process.join()
+    if error is not None:
+        raise RuntimeError(error)
+    if result is None:
+        raise RuntimeError("The benchmark process exited with status %s." % \
+                           process.exitcode)
+    return result
+
+def _benchmark_integrand(backend, benchmark_integrand, monte_carlo_types,
+                         n_calls, repeats, build_options):
+    #Generate and build the integrator
+    start = time.time()
+    integrand = CFile(benchmark_integrand.file_path)[benchmark_integrand.name]
+    integrand.add_include_dependency(benchmark_integrand.header_name)
+    if backend == "gsl":
+        integrator = GslMonteCarloFunctionIntegrator(integrand)
+    else:
+        integrator = OpenClMonteCarloFunctionIntegrator(integrand)
+    compiled = integrator.compile(**build_options)
+    build_time = time.time() - start
+
+    #Time each type, keeping the fastest run, and measure
+    #the accuracy over all of them
+    runs = []
+    compiled.n_calls = n_calls
+    for monte_carlo_type in monte_carlo_types:
+        compiled.monte_carlo_type = monte_carlo_type
+        times = []
+        results = []
+        for r in xrange(repeats):
+            start = time.time()
+            result, error = compiled.integrate(benchmark_integrand.bounds)
+            times.append(time.time() - start)
+            results.append((result, error))
+        exact = benchmark_integrand.exact
+        result, error = results[-1]
+        rms_error = math.sqrt(sum((r - exact) ** 2 for r, e in results) / len(results))
+        mean_estimated_error = sum(e for r, e in results) / len(results)
+        runs.append({
+            "backend": backend,
+            "integrand": benchmark_integrand.name,
+            "n_dimensions": len(benchmark_integrand.bounds),
+            "monte_carlo_type": monte_carlo_type,
+            "n_calls": n_calls,
+            "repeats": repeats,
+            "build_time": build_time,
+            "wall_time": min(times),
+            "mean_wall_time": sum(times) / len(times),
+            "evaluations_per_second": n_calls / max(min(times), 1e-9),
+            "exact": exact,
+            "result": result,
+            "estimated_error": error,
+            "mean_estimated_error": mean_estimated_error,
+            "rms_error": rms_error,
+            "relative_rms_error": rms_error / abs(exact),
+            "error_ratio": rms_error / mean_estimated_error if mean_estimated_error > 0.0 else None
+        })
+    return runs
+
+def run_benchmarks(backends = _BACKENDS,
+                   monte_carlo_types = _MONTE_CARLO_TYPES,
+                   integrands = None,
+                   n_calls = 1000000,
+                   repeats = 3,
+                   seed = 0,
+                   build_options = None,
+                   verbose = False):
+    #Benchmark every combination, recording failures
+    #rather than stopping at them
+    if integrands is None:
+        integrands = [i.name for i in BENCHMARK_INTEGRANDS]
+    if build_options is None:
+        build_options = {}
+    os.environ["GSL_RNG_SEED"] = str(seed)
+    runs = []
+    failures = []
+    for backend in backends:
+        for benchmark_integrand in BENCHMARK_INTEGRANDS:
+            if benchmark_integrand.name not in integrands:
+                continue
+            try:
+                integrand_runs = _run_isolated(_benchmark_integrand,
+                                               backend,
+                                               benchmark_integrand,
+                                               monte_carlo_types,
+                                               n_calls,
+                                               repeats,
+                                               build_options)
+            except RuntimeError as e:
+                failures.append({"backend": backend,
+                                 "integrand": benchmark_integrand.name,
+                                 "error": str(e)})
+                if verbose:
+                    sys.stderr.write("%s %s failed: %s\n" % \
+                                     (backend, benchmark_integrand.name, e))
+                continue
+            for run in integrand_runs:
+                if verbose:
+                    print("%-6s %-13s %-5s %12.6g +/- %-10.3g (exact %.6g) " \
+                          "%8.4fs %10.3g calls/s" % \
+                          (run["backend"],
+                           run["integrand"],
+                           run["monte_carlo_type"],
+                           run["result"],
+                           run["estimated_error"],
+                           run["exact"],
+                           run["wall_time"],
+                           run["evaluations_per_second"]))
+            runs.extend(integrand_runs)
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "settings": {
+            "n_calls": n_calls,
+            "repeats": repeats,
+            "seed": seed,
+        },
+        "runs": runs,
+        "failures": failures,
+    }
+
+def _run_key(run):
+    return (run["backend"], run["integrand"], run["monte_carlo_type"])
+
+def compare_benchmarks(old, new, tolerance = 0.1):
+    #List the regressions from one set of results to another:
+    #runs which failed or disappeared, which slowed down by
+    #more than the tolerance, or whose error has grown well
+    #past what they estimate
+    regressions = []
+    new_runs = dict((_run_key(run), run) for run in new["runs"])
+    for old_run in old["runs"]:
+        key = _run_key(old_run)
+        name = " ".join(key)
+        new_run = new_runs.get(key, None)
+        if new_run is None:
+            regressions.append("%s: no longer runs" % name)
+            continue
+        if new_run["wall_time"] > old_run["wall_time"] * (1.0 + tolerance):
+            regressions.append("%s: slower (%.4gs, was %.4gs)" % \
+                               (name, new_run["wall_time"], old_run["wall_time"]))
+        new_ratio = new_run.get("error_ratio", None)
+        old_ratio = old_run.get("error_ratio", None)
+        if new_ratio is not None and new_ratio > 5.0 and \
+           (old_ratio is None or new_ratio > 2.0 * old_ratio):
+            regressions.append("%s: error is %.3g times the estimate (was %s)" % \
+                               (name, new_ratio,
+                                "%.3g" % old_ratio if old_ratio is not None else "n/a"))
+    return regressions
+
+if __name__ == "__main__":
+    #Parse command line arguments
+    args = parse_arguments()
+
+    #Compare results, if requested
+    if args.compare != None:
+        with open(args.compare[0], "r") as f:
+            old = json.load(f)
+        with open(args.compare[1], "r") as f:
+            new = json.load(f)
+        regressions = compare_benchmarks(old, new, args.tolerance)
+        for regression in regressions:
+            print(regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions in %i runs." % len(old["runs"]))
+        sys.exit(0)
+
+    #Run the benchmarks
+    build_options = {
+        "include_directories": args.include_directories,
+        "library_directories": args.library_directories,
+        "flags": args.flags,
+        "compiler": args.compiler
+    }
+    results = run_benchmarks(args.backends or _BACKENDS,
+                             args.monte_carlo_types or _MONTE_CARLO_TYPES,
+                             args.integrands,
+                             args.n_calls,
+                             args.repeats,
+                             args.seed,
+                             build_options,
+                             verbose = True)
+
+    #Write the results, sorted so that they diff cleanly
+    if args.output != None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 4, sort_keys = True)
+            f.write("\n")
+    if results["failures"]:
+        sys.exit(1)
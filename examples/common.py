@@ -6,10 +6,10 @@ import sys
 _distribution_path = dirname(dirname(realpath(__file__)))
 
 #Figure out the path for the modules
-_module_path = join(_distribution_path, "packages")
+_module_path = _distribution_path
 
 #Figure out the path for the example resources
-example_share_path = join(_distribution_path, "examples/share")
+example_share_path = join(_distribution_path, "share")
 
 #Try to import the feynman module from the system,
 #and if it isn't there, add the distribution path
@@ -110,10 +110,18 @@ int main()
         unit_cylinder_gsl_integrator::MonteCarloMiser);
     run_unit_cylinder_integrator<unit_cylinder_gsl_integrator>("GSL Vegas Unit Cylinder", 
         unit_cylinder_gsl_integrator::MonteCarloVegas);
+    run_unit_cylinder_integrator<unit_cylinder_gsl_integrator>("GSL Quasi Unit Cylinder", 
+        unit_cylinder_gsl_integrator::MonteCarloQuasi);
     #endif
     #ifdef HAVE_OPENCL
     run_unit_cylinder_integrator<unit_cylinder_opencl_integrator>("OpenCL Plain Unit Cylinder", 
         unit_cylinder_opencl_integrator::MonteCarloPlain);
+    run_unit_cylinder_integrator<unit_cylinder_opencl_integrator>("OpenCL Miser Unit Cylinder", 
+        unit_cylinder_opencl_integrator::MonteCarloMiser);
+    run_unit_cylinder_integrator<unit_cylinder_opencl_integrator>("OpenCL Vegas Unit Cylinder", 
+        unit_cylinder_opencl_integrator::MonteCarloVegas);
+    run_unit_cylinder_integrator<unit_cylinder_opencl_integrator>("OpenCL Quasi Unit Cylinder", 
+        unit_cylinder_opencl_integrator::MonteCarloQuasi);
     #endif
 
     //Run the random walk integrations
@@ -124,10 +132,18 @@ int main()
         random_walk_gsl_integrator::MonteCarloMiser);
     run_random_walk_integrator<random_walk_gsl_integrator>("GSL Vegas Random Walk", 
         random_walk_gsl_integrator::MonteCarloVegas);
+    run_random_walk_integrator<random_walk_gsl_integrator>("GSL Quasi Random Walk", 
+        random_walk_gsl_integrator::MonteCarloQuasi);
     #endif
     #ifdef HAVE_OPENCL
     run_random_walk_integrator<random_walk_opencl_integrator>("OpenCL Plain Random Walk",
         random_walk_opencl_integrator::MonteCarloPlain);
+    run_random_walk_integrator<random_walk_opencl_integrator>("OpenCL Miser Random Walk",
+        random_walk_opencl_integrator::MonteCarloMiser);
+    run_random_walk_integrator<random_walk_opencl_integrator>("OpenCL Vegas Random Walk",
+        random_walk_opencl_integrator::MonteCarloVegas);
+    run_random_walk_integrator<random_walk_opencl_integrator>("OpenCL Quasi Random Walk",
+        random_walk_opencl_integrator::MonteCarloQuasi);
     #endif
 
     return 0;
@@ -6,11 +6,10 @@ from common import example_share_path
 
 #Feynman modules
 from feynman.parsing import CFile
-from feynman.integration import FunctionIntegral, \
-                                GslMonteCarloFunctionIntegrator
+from feynman.integration import GslMonteCarloFunctionIntegrator
 
 #Grab the source code
-integrand_header_path = join(example_share_path, "integrand.h")
+integrand_header_path = join(example_share_path, "sample_integrands.h")
 
 #Parse the source code
 integrand_header = CFile(integrand_header_path)
@@ -19,13 +18,12 @@ integrand_header = CFile(integrand_header_path)
 integrand = integrand_header["unit_cylinder"]
 print("The integrand function is: %s" % integrand.signature)
 
-#Create an integral for it
-integral = FunctionIntegral(integrand)
-print("The integral function is: %s" % integral.signature)
+#Add the header dependency for the integrand
+integrand.add_include_dependency("sample_integrands.h")
 
-#Add the header dependency for the interal
-integral.add_include_dependency("integrand.h")
+#Create an integrator for it
+integrator = GslMonteCarloFunctionIntegrator(integrand)
+print("The integral function is: %s" % integrator.evaluation_function.signature)
 
 #Generate code for the function
-integrator = GslMonteCarloFunctionIntegrator(integral)
 integrator.generate_code()
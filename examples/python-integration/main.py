@@ -0,0 +1,45 @@
+#System modules
+import sys
+from os.path import join, dirname, realpath
+
+#Figure out the path to the distribution source code,
+#and run from it if the feynman module isn't installed
+_distribution_path = dirname(dirname(dirname(realpath(__file__))))
+try:
+    import feynman
+except ImportError:
+    sys.path.append(_distribution_path)
+
+#Feynman modules
+from feynman.parsing import CFile
+from feynman.integration import GslMonteCarloFunctionIntegrator, \
+                                OpenClMonteCarloFunctionIntegrator
+
+#Grab the integrand
+integrands = CFile(join(_distribution_path, "share", "sample_integrands.cpp"))
+integrand = integrands["unit_cylinder"]
+integrand.add_include_dependency("sample_integrands.h")
+
+#Pick the backend
+if len(sys.argv) > 1 and sys.argv[1] == "opencl":
+    integrator = OpenClMonteCarloFunctionIntegrator(integrand)
+else:
+    integrator = GslMonteCarloFunctionIntegrator(integrand)
+
+#Compile the integrator and load it into this process.  The
+#library is cached, so later runs skip the compiler.
+compiled = integrator.compile()
+
+#Integrate over the square [-1, 1] x [-1, 1], which should
+#give the volume of the cylinder (pi)
+bounds = [(-1.0, 1.0), (-1.0, 1.0)]
+for monte_carlo_type in ("plain", "miser", "vegas", "quasi"):
+    compiled.monte_carlo_type = monte_carlo_type
+    result, error = compiled.integrate(bounds)
+    print("%s: %f +/- %f" % (monte_carlo_type, result, error))
+
+#Integrate a batch of quadrants in one go
+compiled.monte_carlo_type = "plain"
+quadrants = [[(x, x + 1.0), (y, y + 1.0)] for x in (-1.0, 0.0) for y in (-1.0, 0.0)]
+for quadrant, (result, error) in zip(quadrants, compiled.integrate_batch(quadrants)):
+    print("%s: %f +/- %f" % (quadrant, result, error))
@@ -1,2 +1,3 @@
 import integration
+import compilation
 import parsing
@@ -1,3 +1,4 @@
+import os
 import re
 
 def validate_code_string(s):
@@ -46,3 +47,44 @@ def c_string_literal_with_c_code(s):
 
     #Create the result
     return "\n".join(["\"%s\\n\" \\" % l.encode("string_escape").replace("\"", "\\\"") for l in lines]).strip(" \\")
+
+def write_if_changed(path, content):
+    #Write content to a file, unless the file already holds
+    #exactly that content, so that the file's modification
+    #time (which build systems use to decide what to rebuild)
+    #only changes along with its content.  Returns whether
+    #the file was written.
+    try:
+        if os.path.getsize(path) == len(content):
+            with open(path, "r") as f:
+                if f.read() == content:
+                    return False
+    except (IOError, OSError):
+        pass
+    with open(path, "w") as f:
+        f.write(content)
+    return True
+
+def write_depfile(path, targets, dependencies):
+    #Write a Makefile-style dependency file (as understood by
+    #Make and Ninja) stating that the targets depend on the
+    #dependencies
+    def escape(p):
+        return p.replace("\\", "\\\\") \
+                .replace(" ", "\\ ") \
+                .replace("#", "\\#") \
+                .replace("$", "$$")
+    lines = [" ".join([escape(t) for t in targets]) + ":"]
+    lines.extend([" " + escape(d) for d in dependencies])
+    return write_if_changed(path, " \\\n".join(lines) + "\n")
+
+def first_primes(n):
+    #Find the first n primes by trial division (this is
+    #only used for small n, e.g. one prime per dimension)
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % p != 0 for p in primes if p * p <= candidate):
+            primes.append(candidate)
+        candidate += 1
+    return primes
@@ -0,0 +1,529 @@
+#System modules
+import os
+import json
+import ctypes
+import hashlib
+import shutil
+import tempfile
+import subprocess
+from os.path import join, exists, dirname, abspath, expanduser
+from StringIO import StringIO
+
+#Feynman modules
+from .parsing import CFile
+
+#Directory for compiled integrator libraries.  It may be
+#overridden with the FEYNMAN_COMPILE_CACHE_DIR environment
+#variable, and setting that variable to an empty string
+#compiles into a fresh temporary directory every time,
+#which is removed once the library is loaded.
+_COMPILE_CACHE_DIR_VARIABLE = "FEYNMAN_COMPILE_CACHE_DIR"
+_DEFAULT_COMPILE_CACHE_DIR = join("~", ".feynman", "compile-cache")
+
+#The temporary directories holding libraries which haven't
+#been loaded yet (see CompiledIntegrator)
+_temporary_library_dirs = set()
+
+#Monte Carlo types, in the order of the MonteCarloType enum
+#of the generated integrators
+_MONTE_CARLO_TYPES = ("plain", "miser", "vegas", "quasi")
+
+#The ProgressCallback type of the generated integrators
+_PROGRESS_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_int,
+                                      ctypes.c_void_p,
+                                      ctypes.c_long,
+                                      ctypes.c_double,
+                                      ctypes.c_double,
+                                      ctypes.c_double,
+                                      ctypes.c_double)
+
+def _compile_cache_dir():
+    #Figure out where compiled libraries should go, and
+    #whether the directory is a temporary one
+    cache_dir = os.environ.get(_COMPILE_CACHE_DIR_VARIABLE, None)
+    if cache_dir is None:
+        cache_dir = expanduser(_DEFAULT_COMPILE_CACHE_DIR)
+    elif cache_dir == "":
+        return tempfile.mkdtemp(prefix = "feynman-"), True
+    if not exists(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir, False
+
+def _hash_file(library_hash, path):
+    #Add the contents of a file to a hash, with missing or
+    #unreadable files hashing as empty
+    try:
+        with open(path, "rb") as f:
+            library_hash.update(f.read())
+    except IOError:
+        pass
+    library_hash.update("\0")
+
+def compile_integrator(integrator,
+                       sources = None,
+                       include_directories = None,
+                       library_directories = None,
+                       libraries = None,
+                       flags = None,
+                       compiler = None):
+    #Avoid a circular import, since the integrators call
+    #into this module
+    from .integration import GslMonteCarloFunctionIntegrator
+
+    #Figure out what we're building with.  The integrand
+    #source is compiled in for the GSL backend if it has
+    #a body, whereas the OpenCL backend embeds it in the
+    #generated code.  Either way, the integrand's directory
+    #is searched for its include dependencies.
+    is_gsl = isinstance(integrator, GslMonteCarloFunctionIntegrator)
+    integrand_path = integrator.integrand.file_path
+    if sources is None:
+        sources = []
+        if is_gsl and integrator.integrand.has_body and integrand_path:
+            sources.append(integrand_path)
+    sources = [abspath(s) for s in sources]
+    include_directories = list(include_directories or [])
+    if integrand_path:
+        include_directories.append(dirname(abspath(integrand_path)))
+    if library_directories is None:
+        library_directories = []
+    if libraries is None:
+        if is_gsl:
+            libraries = ["gsl", "gslcblas", "pthread"]
+        else:
+            libraries = ["OpenCL", "pthread"]
+    if flags is None:
+        flags = ["-O2"]
+    if compiler is None:
+        compiler = os.environ.get("CXX", "c++")
+
+    #Generate the code
+    header_name = "%s.h" % integrator.name
+    header = StringIO()
+    source = StringIO()
+    integrator.generate_code(header, source, header_name)
+    header = header.getvalue()
+    source = source.getvalue()
+
+    #Build the compiler command, minus the paths which
+    #depend on the output directory
+    arguments = list(flags) + ["-shared", "-fPIC"]
+    arguments += ["-I%s" % d for d in include_directories]
+    arguments += ["-L%s" % d for d in library_directories]
+    link_arguments = ["-l%s" % l for l in libraries]
+
+    #Identify the library by everything that goes into it,
+    #including the files the integrand includes (which the
+    #generated code includes in turn), so that an unchanged
+    #integrator is only built once
+    library_hash = hashlib.sha1()
+    for data in [header, source, compiler] + arguments + link_arguments:
+        library_hash.update(data)
+        library_hash.update("\0")
+    for path in sources:
+        _hash_file(library_hash, path)
+    if integrand_path and exists(integrand_path):
+        for path in CFile(integrand_path).includes:
+            library_hash.update(path)
+            library_hash.update("\0")
+            _hash_file(library_hash, path)
+    library_hash = library_hash.hexdigest()
+
+    #Check for a cached library
+    cache_dir, temporary = _compile_cache_dir()
+    library_path = join(cache_dir, "%s-%s.so" % (integrator.name, library_hash))
+    if exists(library_path):
+        return library_path
+
+    #Write out the code and compile it.  The library is
+    #built under a temporary name and then renamed, so
+    #concurrent builds never see a partial library.
+    build_dir = tempfile.mkdtemp(prefix = "build-", dir = cache_dir)
+    try:
+        with open(join(build_dir, header_name), "w") as f:
+            f.write(header)
+        source_path = join(build_dir, "%s.cpp" % integrator.name)
+        with open(source_path, "w") as f:
+            f.write(source)
+        temporary_library_path = join(build_dir, "lib%s.so" % integrator.name)
+        command = [compiler] + arguments + ["-I%s" % build_dir] + \
+                  ["-o", temporary_library_path, source_path] + \
+                  sources + link_arguments
+        try:
+            process = subprocess.Popen(command,
+                                       stdout = subprocess.PIPE,
+                                       stderr = subprocess.STDOUT)
+        except OSError as e:
+            raise RuntimeError("Unable to run the compiler (%s): %s" % \
+                               (compiler, e))
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            raise RuntimeError("Compiling the integrator failed:\n%s\n%s" % \
+                               (" ".join(command), output))
+        os.rename(temporary_library_path, library_path)
+    finally:
+        shutil.rmtree(build_dir, True)
+        if temporary and not exists(library_path):
+            shutil.rmtree(cache_dir, True)
+
+    if temporary:
+        _temporary_library_dirs.add(cache_dir)
+    return library_path
+
+class PendingIntegration(object):
+    def __init__(self, compiled_integrator, handle, n_integrals, single):
+        self.__compiled_integrator = compiled_integrator
+        self.__handle = handle
+        self.__n_integrals = n_integrals
+        self.__single = single
+        self.__result = None
+
+    def ready(self):
+        #Once waited on, the handle belongs to the integrator
+        #again, so don't query it
+        if self.__result is not None:
+            return True
+        return self.__compiled_integrator._ready(self.__handle)
+
+    def wait(self):
+        #Grab the results the first time around, and hold
+        #on to them for later calls
+        if self.__result is None:
+            self.__result = self.__compiled_integrator._wait_batch(self.__handle,
+                                                                   self.__n_integrals)
+        if self.__single:
+            return self.__result[0]
+        return self.__result
+
+class Progress(object):
+    def __init__(self, calls, result, error, chisq, elapsed):
+        self.__calls = calls
+        self.__result = result
+        self.__error = error
+        self.__chisq = chisq
+        self.__elapsed = elapsed
+
+    @property
+    def calls(self):
+        return self.__calls
+
+    @property
+    def result(self):
+        return self.__result
+
+    @property
+    def error(self):
+        return self.__error
+
+    @property
+    def chisq(self):
+        return self.__chisq
+
+    @property
+    def elapsed(self):
+        return self.__elapsed
+
+class CompiledIntegrator(object):
+    def __init__(self, 
+                 library_path, 
+                 integrator, 
+                 device_selection = "single", 
+                 profiling = False, 
+                 shared_runtime = False):
+        #Avoid a circular import, since the integrators call
+        #into this module
+        from .integration import GslMonteCarloFunctionIntegrator
+
+        #Load the library.  A library compiled into a
+        #temporary directory (see _compile_cache_dir) isn't
+        #needed on disk once it's loaded, so the directory is
+        #removed.
+        self.__library_path = library_path
+        try:
+            self.__library = ctypes.CDLL(library_path)
+        finally:
+            library_dir = dirname(library_path)
+            if library_dir in _temporary_library_dirs:
+                _temporary_library_dirs.discard(library_dir)
+                shutil.rmtree(library_dir, True)
+        self.__n_dimensions = integrator.n_dimensions
+        self.__is_gsl = isinstance(integrator, GslMonteCarloFunctionIntegrator)
+
+        #Look up the C interface
+        def function(name, restype, argtypes):
+            f = getattr(self.__library, "%s_%s" % (integrator.name, name))
+            f.restype = restype
+            f.argtypes = argtypes
+            return f
+        p = ctypes.c_void_p
+        i = ctypes.c_int
+        d = ctypes.c_double
+        dp = ctypes.POINTER(ctypes.c_double)
+        self.__destroy = function("destroy", None, [p])
+        self.__set_monte_carlo_type = function("set_monte_carlo_type", None, [p, i])
+        self.__monte_carlo_type = function("monte_carlo_type", i, [p])
+        self.__set_n_calls = function("set_n_calls", None, [p, i])
+        self.__n_calls = function("n_calls", i, [p])
+        self.__chisq = function("chisq", d, [p])
+        self.__set_target_relative_error = function("set_target_relative_error", None, [p, d])
+        self.__target_relative_error = function("target_relative_error", d, [p])
+        self.__set_max_calls = function("set_max_calls", None, [p, i])
+        self.__max_calls = function("max_calls", i, [p])
+        self.__set_time_budget = function("set_time_budget", None, [p, d])
+        self.__time_budget = function("time_budget", d, [p])
+        self.__integrate_batch = function("integrate_batch", None, [p, i, dp, dp, dp])
+        self.__set_progress_callback = function("set_progress_callback", 
+                                                None, 
+                                                [p, _PROGRESS_CALLBACK, p])
+        self.__progress_callback = None
+        self.__c_progress_callback = None
+        self.__progress_error = None
+        if self.__is_gsl:
+            self.__set_n_threads = function("set_n_threads", None, [p, i])
+            self.__n_threads = function("n_threads", i, [p])
+            create = function("create", p, [])
+            self.__integrator = create()
+        else:
+            self.__n_devices = function("n_devices", i, [p])
+            self.__autotune = function("autotune", None, [p])
+            self.__profile_json = function("profile_json", i, [p, ctypes.c_char_p, i])
+            self.__reset_profile = function("reset_profile", None, [p])
+            self.__integrate_batch_async = function("integrate_batch_async", i, [p, i, dp])
+            self.__ready = function("ready", i, [p, i])
+            self.__wait_batch = function("wait_batch", None, [p, i, i, dp, dp])
+            if device_selection not in ("single", "all"):
+                raise ValueError("The device selection must be " \
+                                 "either \"single\" or \"all\".")
+            create = function("create", p, [i, i, i])
+            self.__integrator = create(0 if device_selection == "single" else 1,
+                                       1 if profiling else 0,
+                                       1 if shared_runtime else 0)
+        if not self.__integrator:
+            raise RuntimeError("Unable to create the integrator.")
+
+    def __del__(self):
+        integrator = getattr(self, "_CompiledIntegrator__integrator", None)
+        if integrator:
+            self.__destroy(integrator)
+            self.__integrator = None
+
+    @property
+    def library_path(self):
+        return self.__library_path
+
+    @property
+    def n_dimensions(self):
+        return self.__n_dimensions
+
+    @property
+    def monte_carlo_type(self):
+        return _MONTE_CARLO_TYPES[self.__monte_carlo_type(self.__integrator)]
+
+    @monte_carlo_type.setter
+    def monte_carlo_type(self, value):
+        if value not in _MONTE_CARLO_TYPES:
+            raise ValueError("The Monte Carlo type must be one of: %s." % \
+                             ", ".join(_MONTE_CARLO_TYPES))
+        self.__set_monte_carlo_type(self.__integrator, _MONTE_CARLO_TYPES.index(value))
+
+    @property
+    def n_calls(self):
+        return self.__n_calls(self.__integrator)
+
+    @n_calls.setter
+    def n_calls(self, value):
+        if value <= 0:
+            raise ValueError("The number of calls must be positive.")
+        self.__set_n_calls(self.__integrator, value)
+
+    @property
+    def target_relative_error(self):
+        return self.__target_relative_error(self.__integrator)
+
+    @target_relative_error.setter
+    def target_relative_error(self, value):
+        #Zero disables the target
+        if value < 0:
+            raise ValueError("The target relative error can't be negative.")
+        self.__set_target_relative_error(self.__integrator, value)
+
+    @property
+    def max_calls(self):
+        return self.__max_calls(self.__integrator)
+
+    @max_calls.setter
+    def max_calls(self, value):
+        #Zero removes the limit
+        if value < 0:
+            raise ValueError("The maximum number of calls can't be negative.")
+        self.__set_max_calls(self.__integrator, value)
+
+    @property
+    def time_budget(self):
+        return self.__time_budget(self.__integrator)
+
+    @time_budget.setter
+    def time_budget(self, value):
+        #Zero disables the budget
+        if value < 0:
+            raise ValueError("The time budget can't be negative.")
+        self.__set_time_budget(self.__integrator, value)
+
+    @property
+    def chisq(self):
+        return self.__chisq(self.__integrator)
+
+    @property
+    def progress_callback(self):
+        return self.__progress_callback
+
+    @progress_callback.setter
+    def progress_callback(self, value):
+        #The callback is called with a Progress after each
+        #batch and Vegas iteration, and at least once for
+        #each integral, and returning True stops the
+        #integration early (OpenCL plain integrations without
+        #a target run in a single launch, and are reported
+        #once they have finished).  Exceptions it raises are
+        #raised again once the integration returns.  None
+        #turns it off.
+        if value is not None and not callable(value):
+            raise ValueError("The progress callback must be callable.")
+        self.__progress_callback = value
+        if value is None:
+            self.__c_progress_callback = None
+            self.__set_progress_callback(self.__integrator, _PROGRESS_CALLBACK(), None)
+            return
+
+        def progress(data, calls, result, error, chisq, elapsed):
+            #Exceptions can't cross the library, so hold on to
+            #them, stop the integration and raise them after
+            try:
+                return 1 if value(Progress(calls, result, error, chisq, elapsed)) else 0
+            except Exception as e:
+                self.__progress_error = e
+                return 1
+        #Keep a reference to the C callback for as long as the
+        #library has it
+        self.__c_progress_callback = _PROGRESS_CALLBACK(progress)
+        self.__set_progress_callback(self.__integrator, self.__c_progress_callback, None)
+
+    def _raise_progress_error(self):
+        if self.__progress_error is not None:
+            error = self.__progress_error
+            self.__progress_error = None
+            raise error
+
+    @property
+    def n_threads(self):
+        if not self.__is_gsl:
+            raise RuntimeError("Only GSL integrators use threads.")
+        return self.__n_threads(self.__integrator)
+
+    @n_threads.setter
+    def n_threads(self, value):
+        if not self.__is_gsl:
+            raise RuntimeError("Only GSL integrators use threads.")
+        if value < 1:
+            raise ValueError("There must be at least one thread.")
+        self.__set_n_threads(self.__integrator, value)
+
+    @property
+    def n_devices(self):
+        if self.__is_gsl:
+            return 0
+        return self.__n_devices(self.__integrator)
+
+    def autotune(self):
+        #Benchmark work group configurations on each device,
+        #switching to (and caching) the fastest
+        if self.__is_gsl:
+            raise RuntimeError("Only OpenCL integrators can be autotuned.")
+        self.__autotune(self.__integrator)
+
+    @property
+    def profile(self):
+        #The device profile, as a dictionary with the device
+        #names, the kernel work sizes and the time and 
+        #evaluations per second of each stage
+        if self.__is_gsl:
+            raise RuntimeError("Only OpenCL integrators can be profiled.")
+        length = self.__profile_json(self.__integrator, None, 0)
+        buffer = ctypes.create_string_buffer(length + 1)
+        self.__profile_json(self.__integrator, buffer, length + 1)
+        return json.loads(buffer.value)
+
+    def reset_profile(self):
+        if self.__is_gsl:
+            raise RuntimeError("Only OpenCL integrators can be profiled.")
+        self.__reset_profile(self.__integrator)
+
+    def _bounds_array(self, batch):
+        #Flatten a list of integrals, each a sequence of
+        #(lower, upper) pairs, one per dimension, into the
+        #layout used by integrate_batch
+        bounds = []
+        for integral in batch:
+            if len(integral) != self.__n_dimensions:
+                raise ValueError("Each integral needs bounds for " \
+                                 "%i dimensions." % self.__n_dimensions)
+            for lower, upper in integral:
+                bounds.append(lower)
+                bounds.append(upper)
+        return (ctypes.c_double * max(len(bounds), 1))(*bounds)
+
+    def integrate_batch(self, batch, n_calls = None):
+        #Integrate over each set of bounds, returning a list
+        #of (result, error) pairs.  If given, n_calls replaces
+        #the integrator's number of calls per integral.
+        if n_calls is not None:
+            self.n_calls = n_calls
+        batch = list(batch)
+        n_integrals = len(batch)
+        if n_integrals == 0:
+            return []
+        bounds = self._bounds_array(batch)
+        results = (ctypes.c_double * n_integrals)()
+        errors = (ctypes.c_double * n_integrals)()
+        self.__integrate_batch(self.__integrator, n_integrals, bounds, results, errors)
+        self._raise_progress_error()
+        return zip(results, errors)
+
+    def integrate(self, bounds, n_calls = None):
+        return self.integrate_batch([bounds], n_calls)[0]
+
+    def __call__(self, bounds, n_calls = None):
+        return self.integrate(bounds, n_calls)
+
+    def _start(self, batch, single):
+        #Start integrating over each set of bounds, returning
+        #a PendingIntegration
+        if self.__is_gsl:
+            raise RuntimeError("Only OpenCL integrators support " \
+                               "asynchronous integration.")
+        batch = list(batch)
+        if len(batch) == 0:
+            raise ValueError("There must be at least one integral.")
+        handle = self.__integrate_batch_async(self.__integrator,
+                                              len(batch),
+                                              self._bounds_array(batch))
+        self._raise_progress_error()
+        if handle < 0:
+            raise RuntimeError("Unable to start the integration.")
+        return PendingIntegration(self, handle, len(batch), single)
+
+    def integrate_batch_async(self, batch):
+        return self._start(batch, False)
+
+    def integrate_async(self, bounds):
+        return self._start([bounds], True)
+
+    def _ready(self, handle):
+        return bool(self.__ready(self.__integrator, handle))
+
+    def _wait_batch(self, handle, n_integrals):
+        results = (ctypes.c_double * n_integrals)()
+        errors = (ctypes.c_double * n_integrals)()
+        self.__wait_batch(self.__integrator, handle, n_integrals, results, errors)
+        self._raise_progress_error()
+        return zip(results, errors)
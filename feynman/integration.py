@@ -1,18 +1,156 @@
 #System modules
+import os
 import sys
+import types
+import hashlib
+import tempfile
 from itertools import chain
-from pkg_resources import resource_string
-from os.path import basename
+from pkg_resources import resource_string, resource_filename
+from os.path import basename, join, exists, expanduser
 
 #Feynman modules
 from .parsing import CFunctionDeclaration
+from .compilation import compile_integrator, CompiledIntegrator
 from .common import validate_code_string, \
                     underscore_to_camel_case, \
-                    c_string_literal_with_c_code
+                    c_string_literal_with_c_code, \
+                    write_if_changed, \
+                    first_primes
 
 #Cheetah modules
+import Cheetah
 from Cheetah.Template import Template
 
+#Directory for compiled templates.  It may be overridden
+#with the FEYNMAN_TEMPLATE_CACHE_DIR environment variable,
+#and setting that variable to an empty string compiles the
+#templates in each process.
+_TEMPLATE_CACHE_DIR_VARIABLE = "FEYNMAN_TEMPLATE_CACHE_DIR"
+_DEFAULT_TEMPLATE_CACHE_DIR = join("~", ".feynman", "template-cache")
+_TEMPLATE_PATH = "templates"
+
+#Template sources, compiled template classes and C string
+#literals of templates without placeholders, by template
+#name.  Each is only loaded once per process.
+_template_sources = {}
+_template_classes = {}
+_template_literals = {}
+
+def _template_source(template_name):
+    #Load the template using the pkg_resources API.
+    #NOTE: We use "/" as the path separator here, this
+    #is because these are not actually file system paths,
+    #and the pkg_resources API will convert them to the 
+    #appropriate separators in a cross-platform manner.
+    if template_name not in _template_sources:
+        _template_sources[template_name] = resource_string(__name__, 
+                                                           "/".join([
+                                                           _TEMPLATE_PATH, 
+                                                           template_name
+                                                           ])
+                                                          )
+    return _template_sources[template_name]
+
+def _template_literal(template_name):
+    #Grab a template which is embedded as-is in generated
+    #code as a C string literal
+    if template_name not in _template_literals:
+        _template_literals[template_name] = \
+            c_string_literal_with_c_code(_template_source(template_name))
+    return _template_literals[template_name]
+
+def _template_paths(template_names):
+    #Find the files of templates, e.g. so that build systems
+    #can regenerate code when they change
+    return tuple([resource_filename(__name__, "/".join([_TEMPLATE_PATH, t])) 
+                  for t 
+                  in template_names])
+
+def _write_output(output, content):
+    #Spit out generated code.  We first check if the output
+    #has a 'write' method and then call that, or we treat it
+    #as a file path.  I considered checking for
+    #isinstance(output, io.IOBase), but this wouldn't work
+    #for a lot of things (sys.stdout, StringIO), so I'm just
+    #doing this for now.  Files which already hold the code
+    #are left alone, so that build systems don't rebuild
+    #them.
+    if hasattr(output, "write"):
+        output.write(content)
+    else:
+        write_if_changed(output, content)
+
+def _compile_template(template_name, class_name):
+    #Compile a template to the source of a Python module,
+    #reusing the module from the cache if it has already been
+    #compiled.  Failures to use the cache are ignored, since
+    #it is only an optimization.
+    source = _template_source(template_name)
+    cache_dir = os.environ.get(_TEMPLATE_CACHE_DIR_VARIABLE, None)
+    if cache_dir is None:
+        cache_dir = expanduser(_DEFAULT_TEMPLATE_CACHE_DIR)
+    cache_path = None
+    if cache_dir != "":
+        key = hashlib.sha1()
+        for data in [Cheetah.Version, class_name, source]:
+            key.update(data)
+            key.update("\0")
+        cache_path = join(cache_dir, "%s.py" % key.hexdigest())
+        try:
+            with open(cache_path, "r") as f:
+                return f.read()
+        except IOError:
+            pass
+
+    #Compile the template, and store it under a temporary
+    #name which is renamed into place, so readers never see
+    #a partial module
+    module_code = Template.compile(source = source, 
+                                   className = class_name,
+                                   returnAClass = False)
+    if cache_path is not None:
+        try:
+            if not exists(cache_dir):
+                os.makedirs(cache_dir)
+            handle, temporary_path = tempfile.mkstemp(dir = cache_dir)
+            with os.fdopen(handle, "w") as f:
+                f.write(module_code)
+            os.rename(temporary_path, cache_path)
+        except (IOError, OSError):
+            pass
+    return module_code
+
+def _template_class(template_name):
+    #Grab the compiled class for a template, loading it into
+    #its own module the first time around.  The module is
+    #registered, as Cheetah does for the templates it compiles,
+    #since the template's methods use the module's globals.
+    if template_name not in _template_classes:
+        class_name = "".join([c if c.isalnum() else "_" for c in template_name])
+        module = types.ModuleType("feynman_template_%s" % class_name)
+        module.__file__ = template_name
+        exec compile(_compile_template(template_name, class_name), 
+                     template_name, 
+                     "exec") in module.__dict__
+        sys.modules[module.__name__] = module
+        _template_classes[template_name] = getattr(module, class_name)
+    return _template_classes[template_name]
+
+def _render_template(template_name, template_data):
+    #Fill a template with data
+    return str(_template_class(template_name)(searchList = [template_data]))
+
+def precompile_templates():
+    #Compile all of the integrators' templates, e.g. before
+    #forking processes which generate code, so that they
+    #don't each compile them
+    for template_name in _GSL_MONTE_CARLO_TEMPLATES + _OPENCL_MONTE_CARLO_TEMPLATES:
+        _template_class(template_name)
+    for template_name in _OPENCL_LITERAL_TEMPLATES:
+        _template_literal(template_name)
+    for template_name in _OPENCL_VERBATIM_TEMPLATES:
+        _template_source(template_name)
+
 class FunctionIntegrator(object):
     def __init__(self, integrand, name = None):
         #Validate the integrand
@@ -86,6 +224,12 @@ class FunctionIntegrator(object):
     def evaluation_function(self):
         return self.__evaluation_function
 
+    @property
+    def template_paths(self):
+        #The paths of the templates which generated code is
+        #created from
+        return ()
+
     def generate_code(self, 
                       header_output = sys.stdout, 
                       source_output = sys.stdout,
@@ -94,34 +238,39 @@ class FunctionIntegrator(object):
                            "You must call generate_code from one of its " \
                            "concrete subclasses.")
 
+    def compile(self,
+                sources = None,
+                include_directories = None,
+                library_directories = None,
+                libraries = None,
+                flags = None,
+                compiler = None):
+        #Build the generated code into a shared library (or
+        #reuse a cached one) and load it into this process
+        library_path = compile_integrator(self,
+                                          sources,
+                                          include_directories,
+                                          library_directories,
+                                          libraries,
+                                          flags,
+                                          compiler)
+        return CompiledIntegrator(library_path, self)
+
 #Integrator types for integral code generation
 _GSL_MONTE_CARLO_HEADER = "GslMonteCarlo.h"
 _GSL_MONTE_CARLO_SOURCE = "GslMonteCarlo.cpp"
-_GSL_MONTE_CARLO_TEMPLATE_PATH = "templates"
+_GSL_MONTE_CARLO_TEMPLATES = (_GSL_MONTE_CARLO_HEADER, 
+                              _GSL_MONTE_CARLO_SOURCE)
 
 class GslMonteCarloFunctionIntegrator(FunctionIntegrator):
+    @property
+    def template_paths(self):
+        return _template_paths(_GSL_MONTE_CARLO_TEMPLATES)
+
     def generate_code(self, 
                       header_output = sys.stdout, 
                       source_output = sys.stdout,
                       primary_header_include = None):
-        #Compute template paths using the pkg_resources API.
-        #NOTE: We use "/" as the path separator here, this
-        #is because these are not actually file system paths,
-        #and the pkg_resources API will convert them to the 
-        #appropriate separators in a cross-platform manner.
-        header_template = resource_string(__name__, 
-                                          "/".join([
-                                          _GSL_MONTE_CARLO_TEMPLATE_PATH, 
-                                          _GSL_MONTE_CARLO_HEADER
-                                          ])
-                                         )
-        source_template = resource_string(__name__, 
-                                          "/".join([
-                                          _GSL_MONTE_CARLO_TEMPLATE_PATH, 
-                                          _GSL_MONTE_CARLO_SOURCE
-                                          ])
-                                         )
-
         #Compute what the primary include header and include
         #guard should be.
         if not primary_header_include:
@@ -138,101 +287,143 @@ class GslMonteCarloFunctionIntegrator(FunctionIntegrator):
         template_data = {
             "integrator": self,
             "primary_header_include": primary_header_include,
-            "include_guard": include_guard
+            "include_guard": include_guard,
+            "quasi_bases": first_primes(self.n_dimensions)
         }
 
-        #Load the templates and fill with data
-        header_template = Template(header_template, searchList = [template_data])
-        source_template = Template(source_template, searchList = [template_data])
-
-        #Spit out the templates.  For each we first
-        #check if the output has a 'write' method 
-        #and then call that, or we treat it as a file
-        #path.  I considered checking for 
-        #isinstance(output, io.IOBase), but this wouldn't
-        #work for a lot of things (sys.stdout, StringIO),
-        #so I'm just doing this for now.
-        if hasattr(header_output, "write"):
-            header_output.write(str(header_template))
-        else:
-            with open(header_output, "w") as f:
-                f.write(str(header_template))
-        if hasattr(source_output, "write"):
-            source_output.write(str(source_template))
-        else:
-            with open(source_output, "w") as f:
-                f.write(str(source_template))
+        #Fill the templates with data
+        header_template = _render_template(_GSL_MONTE_CARLO_HEADER, template_data)
+        source_template = _render_template(_GSL_MONTE_CARLO_SOURCE, template_data)
+
+        #Spit out the templates
+        _write_output(header_output, header_template)
+        _write_output(source_output, source_template)
 
 #Integrator types for integral code generation
 _OPENCL_BASE_MONTE_CARLO_HEADER = "OpenClMonteCarlo.h"
 _OPENCL_BASE_MONTE_CARLO_SOURCE = "OpenClMonteCarlo.cpp"
+_OPENCL_RUNTIME_HEADER = "OpenClRuntime.h"
 _OPENCL_FIXES_SOURCE = "OpenClMonteCarloFixes.cl"
+_OPENCL_ACCUMULATION_SOURCE = "OpenClMonteCarloAccumulation.cl"
 _OPENCL_RANLUX_SOURCE = "ranluxcl.cl"
 _OPENCL_INITIALIZATION_SOURCE = "OpenClMonteCarloInitialization.cl"
+_OPENCL_RANDOM_SOURCE = "OpenClMonteCarloRandom.cl"
 _OPENCL_MONTE_CARLO_PLAIN_SOURCE = "OpenClPlainMonteCarlo.cl"
 _OPENCL_MONTE_CARLO_MISER_SOURCE = "OpenClMiserMonteCarlo.cl"
 _OPENCL_MONTE_CARLO_VEGAS_SOURCE = "OpenClVegasMonteCarlo.cl"
-_OPENCL_CARLO_TEMPLATE_PATH = "templates"
+_OPENCL_MONTE_CARLO_QUASI_SOURCE = "OpenClQuasiMonteCarlo.cl"
+_OPENCL_MONTE_CARLO_TEMPLATES = (_OPENCL_BASE_MONTE_CARLO_HEADER,
+                                 _OPENCL_BASE_MONTE_CARLO_SOURCE,
+                                 _OPENCL_ACCUMULATION_SOURCE,
+                                 _OPENCL_RANDOM_SOURCE,
+                                 _OPENCL_MONTE_CARLO_PLAIN_SOURCE,
+                                 _OPENCL_MONTE_CARLO_MISER_SOURCE,
+                                 _OPENCL_MONTE_CARLO_VEGAS_SOURCE,
+                                 _OPENCL_MONTE_CARLO_QUASI_SOURCE)
+
+#Program sources which are embedded without filling in
+#any data
+_OPENCL_LITERAL_TEMPLATES = (_OPENCL_FIXES_SOURCE,
+                             _OPENCL_RANLUX_SOURCE,
+                             _OPENCL_INITIALIZATION_SOURCE)
+
+#Host code which is embedded as-is in generated headers
+_OPENCL_VERBATIM_TEMPLATES = (_OPENCL_RUNTIME_HEADER,)
+
+#Accumulation modes for OpenCL integration sums.  "float"
+#accumulates in single precision, "double" accumulates in
+#double precision (which requires device support for 
+#cl_khr_fp64), and "kahan" accumulates in single precision
+#with Kahan compensated summation.
+_OPENCL_ACCUMULATION_MODES = ("float", "double", "kahan")
+
+#Random number generators for OpenCL integration.  "ranlux"
+#is RANLUXCL, which keeps a state for each work item in
+#global memory (seeded by an initialization kernel), and
+#"philox" is Philox4x32-10, a counter-based generator which
+#needs no states at all.
+_OPENCL_RNGS = ("ranlux", "philox")
 
 class OpenClMonteCarloFunctionIntegrator(FunctionIntegrator):
+    def __init__(self, integrand, name = None, accumulation = "float", rng = "ranlux"):
+        #Initialize the super-class
+        super(OpenClMonteCarloFunctionIntegrator, self).__init__(integrand, name)
+
+        #Validate the accumulation mode
+        if accumulation not in _OPENCL_ACCUMULATION_MODES:
+            raise ValueError("The accumulation mode must be one of: %s." % \
+                             ", ".join(_OPENCL_ACCUMULATION_MODES))
+        self.__accumulation = accumulation
+
+        #Validate the random number generator
+        if rng not in _OPENCL_RNGS:
+            raise ValueError("The random number generator must be one of: %s." % \
+                             ", ".join(_OPENCL_RNGS))
+        self.__rng = rng
+
+    @property
+    def accumulation(self):
+        return self.__accumulation
+
+    @property
+    def rng(self):
+        return self.__rng
+
+    @property
+    def accumulator_type(self):
+        #The OpenCL type used for integration sums
+        if self.__accumulation == "double":
+            return "double"
+        return "float"
+
+    @property
+    def bound_type(self):
+        #The OpenCL type used for integration bounds, which
+        #is double if any argument of the integrand is, so
+        #that its bounds keep their precision
+        for argument_type in self.integrand.argument_types:
+            if "double" in argument_type.split():
+                return "double"
+        return "float"
+
+    @property
+    def template_paths(self):
+        return _template_paths(_OPENCL_MONTE_CARLO_TEMPLATES + 
+                               _OPENCL_LITERAL_TEMPLATES + 
+                               _OPENCL_VERBATIM_TEMPLATES)
+
+    def compile(self,
+                sources = None,
+                include_directories = None,
+                library_directories = None,
+                libraries = None,
+                flags = None,
+                compiler = None,
+                device_selection = "single",
+                profiling = False,
+                shared_runtime = False):
+        #Build the generated code into a shared library (or
+        #reuse a cached one) and load it into this process,
+        #using either a single device or all devices, and
+        #optionally profiling the device commands and sharing
+        #OpenCL resources with the library's other integrators
+        library_path = compile_integrator(self,
+                                          sources,
+                                          include_directories,
+                                          library_directories,
+                                          libraries,
+                                          flags,
+                                          compiler)
+        return CompiledIntegrator(library_path, 
+                                  self, 
+                                  device_selection, 
+                                  profiling, 
+                                  shared_runtime)
+
     def generate_code(self, 
                       header_output = sys.stdout, 
                       source_output = sys.stdout,
                       primary_header_include = None):
-        #Compute template paths using the pkg_resources API.
-        #NOTE: We use "/" as the path separator here, this
-        #is because these are not actually file system paths,
-        #and the pkg_resources API will convert them to the 
-        #appropriate separators in a cross-platform manner.
-        header_template = resource_string(__name__, 
-                                          "/".join([
-                                          _OPENCL_CARLO_TEMPLATE_PATH, 
-                                          _OPENCL_BASE_MONTE_CARLO_HEADER
-                                          ])
-                                         )
-        source_template = resource_string(__name__, 
-                                          "/".join([
-                                          _OPENCL_CARLO_TEMPLATE_PATH, 
-                                          _OPENCL_BASE_MONTE_CARLO_SOURCE
-                                          ])
-                                         )
-        fixes_template = resource_string(__name__, 
-                                         "/".join([
-                                         _OPENCL_CARLO_TEMPLATE_PATH, 
-                                         _OPENCL_FIXES_SOURCE
-                                         ])
-                                        )
-        ranlux_template = resource_string(__name__, 
-                                          "/".join([
-                                          _OPENCL_CARLO_TEMPLATE_PATH, 
-                                          _OPENCL_RANLUX_SOURCE
-                                          ])
-                                         )
-        initialization_template = resource_string(__name__, 
-                                                  "/".join([
-                                                  _OPENCL_CARLO_TEMPLATE_PATH, 
-                                                  _OPENCL_INITIALIZATION_SOURCE
-                                                  ])
-                                                 )
-        plain_template = resource_string(__name__, 
-                                         "/".join([
-                                         _OPENCL_CARLO_TEMPLATE_PATH, 
-                                         _OPENCL_MONTE_CARLO_PLAIN_SOURCE
-                                         ])
-                                        )
-        miser_template = resource_string(__name__, 
-                                         "/".join([
-                                         _OPENCL_CARLO_TEMPLATE_PATH, 
-                                         _OPENCL_MONTE_CARLO_MISER_SOURCE
-                                         ])
-                                        )
-        vegas_template = resource_string(__name__, 
-                                         "/".join([
-                                         _OPENCL_CARLO_TEMPLATE_PATH, 
-                                         _OPENCL_MONTE_CARLO_VEGAS_SOURCE
-                                         ])
-                                        )
-
         #Compute what the primary include header and include
         #guard should be.
         if not primary_header_include:
@@ -250,36 +441,47 @@ class OpenClMonteCarloFunctionIntegrator(FunctionIntegrator):
             "integrator": self,
             "primary_header_include": primary_header_include,
             "include_guard": include_guard,
+            "quasi_bases": first_primes(self.n_dimensions),
         }
 
-        #Load the templates and fill with data
-        plain_template = str(Template(plain_template, searchList = [template_data]))
-        miser_template = str(Template(miser_template, searchList = [template_data]))
-        vegas_template = str(Template(vegas_template, searchList = [template_data]))
-        template_data["fixes_template"] = c_string_literal_with_c_code(fixes_template)
-        template_data["ranlux_template"] = c_string_literal_with_c_code(ranlux_template)
-        template_data["initialization_template"] = c_string_literal_with_c_code(initialization_template)
+        #Fill the program templates with data
+        accumulation_template = _render_template(_OPENCL_ACCUMULATION_SOURCE, template_data)
+        random_template = _render_template(_OPENCL_RANDOM_SOURCE, template_data)
+        plain_template = _render_template(_OPENCL_MONTE_CARLO_PLAIN_SOURCE, template_data)
+        miser_template = _render_template(_OPENCL_MONTE_CARLO_MISER_SOURCE, template_data)
+        vegas_template = _render_template(_OPENCL_MONTE_CARLO_VEGAS_SOURCE, template_data)
+        quasi_template = _render_template(_OPENCL_MONTE_CARLO_QUASI_SOURCE, template_data)
+
+        #Hash the program sources, which (along with the device
+        #and driver) identify cached program binaries
+        source_hash = hashlib.sha1()
+        for source in (_template_source(_OPENCL_FIXES_SOURCE),
+                       accumulation_template,
+                       _template_source(_OPENCL_RANLUX_SOURCE),
+                       _template_source(_OPENCL_INITIALIZATION_SOURCE),
+                       random_template,
+                       self.integrand.text,
+                       plain_template,
+                       miser_template,
+                       vegas_template,
+                       quasi_template):
+            source_hash.update(source)
+        template_data["source_hash"] = source_hash.hexdigest()
+
+        template_data["fixes_template"] = _template_literal(_OPENCL_FIXES_SOURCE)
+        template_data["accumulation_template"] = c_string_literal_with_c_code(accumulation_template)
+        template_data["ranlux_template"] = _template_literal(_OPENCL_RANLUX_SOURCE)
+        template_data["initialization_template"] = _template_literal(_OPENCL_INITIALIZATION_SOURCE)
+        template_data["random_template"] = c_string_literal_with_c_code(random_template)
         template_data["integrand_template"] = c_string_literal_with_c_code(self.integrand.text)
         template_data["plain_template"] = c_string_literal_with_c_code(plain_template)
         template_data["miser_template"] = c_string_literal_with_c_code(miser_template)
         template_data["vegas_template"] = c_string_literal_with_c_code(vegas_template)
-        header_template = Template(header_template, searchList = [template_data])
-        source_template = Template(source_template, searchList = [template_data])
-
-        #Spit out the templates.  For each we first
-        #check if the output has a 'write' method 
-        #and then call that, or we treat it as a file
-        #path.  I considered checking for 
-        #isinstance(output, io.IOBase), but this wouldn't
-        #work for a lot of things (sys.stdout, StringIO),
-        #so I'm just doing this for now.
-        if hasattr(header_output, "write"):
-            header_output.write(str(header_template))
-        else:
-            with open(header_output, "w") as f:
-                f.write(str(header_template))
-        if hasattr(source_output, "write"):
-            source_output.write(str(source_template))
-        else:
-            with open(source_output, "w") as f:
-                f.write(str(source_template))
+        template_data["quasi_template"] = c_string_literal_with_c_code(quasi_template)
+        template_data["runtime_template"] = _template_source(_OPENCL_RUNTIME_HEADER)
+        header_template = _render_template(_OPENCL_BASE_MONTE_CARLO_HEADER, template_data)
+        source_template = _render_template(_OPENCL_BASE_MONTE_CARLO_SOURCE, template_data)
+
+        #Spit out the templates
+        _write_output(header_output, header_template)
+        _write_output(source_output, source_template)
@@ -1,6 +1,11 @@
 #System modules
-from os.path import exists, isfile, split, join
+import os
+import json
+import hashlib
+import tempfile
+from os.path import exists, isfile, split, join, abspath, expanduser
 from itertools import chain
+from bisect import bisect_right
 
 #C parsing modules
 from clang import cindex
@@ -45,6 +50,10 @@ class CFunctionDeclaration(object):
     def argument_names(self):
         return self.__argument_names
 
+    @property
+    def argument_default_values(self):
+        return self.__argument_default_values
+
     @property
     def file_path(self):
         return self.__file_path
@@ -198,62 +207,247 @@ def _name_for_type(t):
     #Otherwise just give the literal string
     return canonical_kind.name.lower()
     
-def _function_declaration_finder(node, results, file_path):
-    if node.kind == cindex.CursorKind.FUNCTION_DECL:
-        #Grab the function information
-        function_name = node.spelling
-        return_type = _name_for_type(node.type.get_result())
-        argument_types = tuple([_name_for_type(a_t)
-                                for a_t 
-                                in node.type.argument_types()])
-        argument_names = tuple([n.spelling
-                                for n 
-                                in node.get_children()
-                                if n.kind == cindex.CursorKind.PARM_DECL])
-        #TODO: See if we can get this info via Clang
-        argument_default_values = ("",) * len(argument_names)
-
-        #Grab the function location
-        start = node.extent.start
-        end = node.extent.end
-        extent = (start.line, start.column, end.line, end.column)
-
-        #Record the function
-        results.append(CFunctionDeclaration(function_name, 
-                                            return_type, 
-                                            argument_types,
-                                            argument_names,
-                                            argument_default_values,
-                                            file_path,
-                                            extent))
-
-    else:
-        #Continue down
-        for c in node.get_children():
-            _function_declaration_finder(c, results, file_path)
+#Arguments and options for parsing with clang (see
+#_find_c_function_declarations)
+_PARSE_ARGUMENTS = ["-ObjC++"]
+_PARSE_OPTIONS = cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES \
+                 | cindex.TranslationUnit.PARSE_INCOMPLETE
+
+#Declarations which may contain function declarations, and
+#so are searched by _find_c_function_declarations (extern "C"
+#blocks show up as either of the last two, depending on the
+#version of clang)
+_container_kinds = (
+    cindex.CursorKind.NAMESPACE,
+    cindex.CursorKind.LINKAGE_SPEC,
+    cindex.CursorKind.UNEXPOSED_DECL
+)
+
+def _skip_space_and_comments(source, i):
+    #Advance past any whitespace and comments starting at i
+    n = len(source)
+    while i < n:
+        if source[i].isspace():
+            i += 1
+        elif source.startswith("//", i):
+            end = source.find("\n", i)
+            i = n if end < 0 else end + 1
+        elif source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+        else:
+            break
+    return i
+
+def _find_body_end(source, i):
+    #Find the end of the body of a function whose declarator
+    #ends at i, returning the offset just past its closing
+    #brace, or None if the declaration has no body.  Braces
+    #in comments and literals are ignored.
+    depth = 0
+    n = len(source)
+    i = _skip_space_and_comments(source, i)
+    while i < n:
+        c = source[i]
+        if c == "\"" or c == "'":
+            i += 1
+            while i < n and source[i] != c:
+                if source[i] == "\\":
+                    i += 1
+                i += 1
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        elif c == ";" and depth == 0:
+            return None
+        i = _skip_space_and_comments(source, i + 1)
+    return None
+
+def _function_declaration(node, file_path, source, line_offsets):
+    #Grab the function information
+    function_name = node.spelling
+    return_type = _name_for_type(node.type.get_result())
+    argument_types = tuple([_name_for_type(a_t)
+                            for a_t 
+                            in node.type.argument_types()])
+    argument_names = tuple([n.spelling
+                            for n 
+                            in node.get_children()
+                            if n.kind == cindex.CursorKind.PARM_DECL])
+    #TODO: See if we can get this info via Clang
+    argument_default_values = ("",) * len(argument_names)
+
+    #Grab the function location.  Clang skips function 
+    #bodies, so extents stop at the end of the declarator,
+    #and we find the end of the body (if any) ourselves.
+    start = node.extent.start
+    end = node.extent.end
+    extent = (start.line, start.column, end.line, end.column)
+    if not node.is_definition() and end.line <= len(line_offsets):
+        body_end = _find_body_end(source, line_offsets[end.line - 1] + end.column - 1)
+        if body_end is not None:
+            end_line = bisect_right(line_offsets, body_end - 1)
+            end_column = body_end - line_offsets[end_line - 1] + 1
+            extent = (start.line, start.column, end_line, end_column)
+
+    return CFunctionDeclaration(function_name, 
+                                return_type, 
+                                argument_types,
+                                argument_names,
+                                argument_default_values,
+                                file_path,
+                                extent)
 
 def _find_c_function_declarations(source_file_path):
     #Create an index
     index = cindex.Index.create()
 
-    #Parse the source file
+    #Parse the source file.  We only need declarations, so
+    #function bodies are skipped, and the end-of-file
+    #checks for a complete translation unit are disabled.
     #HACK: Tell clang to treat the file as Objective-C++,
     #otherwise it translates C++ types (e.g. bool) to their
     #POD equivalents when parsing header files (or maybe it's
     #when it's parsing function prototypes, I can't tell).
     #Anyway, there's no way to force it to use C++, so ObjC++
     #will have to suffice for now.
-    translation_unit = index.parse(source_file_path, ["-ObjC++"])
-
-    #Create results
+    options = _PARSE_OPTIONS
+    translation_unit = index.parse(source_file_path, _PARSE_ARGUMENTS, options = options)
+
+    #Read the source, which is used to find function bodies,
+    #and note where each line starts
+    with open(source_file_path, "r") as source_file:
+        source = source_file.read()
+    line_offsets = [0]
+    for i, c in enumerate(source):
+        if c == "\n":
+            line_offsets.append(i + 1)
+
+    #Traverse the top-level declarations of the file (and
+    #those of any namespaces or extern "C" blocks in it),
+    #ignoring anything that comes from included files.  This
+    #uses an explicit stack, rather than recursion, so deep
+    #nesting can't exceed the recursion limit.
     results = []
-
-    #Traverse the AST
-    _function_declaration_finder(translation_unit.cursor, 
-                                 results,
-                                 source_file_path)
-
-    return results
+    main_file_name = translation_unit.spelling
+    stack = list(reversed(list(translation_unit.cursor.get_children())))
+    while stack:
+        node = stack.pop()
+        location_file = node.location.file
+        if location_file is None or location_file.name != main_file_name:
+            continue
+        if node.kind == cindex.CursorKind.FUNCTION_DECL:
+            results.append(_function_declaration(node, 
+                                                 source_file_path, 
+                                                 source, 
+                                                 line_offsets))
+        elif node.kind in _container_kinds:
+            stack.extend(reversed(list(node.get_children())))
+
+    #Grab the paths of all included files (which the parse 
+    #cache checks for changes)
+    includes = sorted(set([abspath(i.include.name) 
+                           for i 
+                           in translation_unit.get_includes()]))
+
+    return results, includes
+
+#Parse cache configuration.  The cache directory may be
+#overridden with the FEYNMAN_PARSE_CACHE_DIR environment
+#variable, and setting that variable to an empty string
+#disables the cache.  The version must be bumped whenever
+#the parsing or the cache format changes.
+_PARSE_CACHE_DIR_VARIABLE = "FEYNMAN_PARSE_CACHE_DIR"
+_DEFAULT_PARSE_CACHE_DIR = join("~", ".feynman", "parse-cache")
+_PARSE_CACHE_VERSION = 1
+
+def _hash_file(path):
+    #Hash the contents of a file, or return None if it can't
+    #be read
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except IOError:
+        return None
+
+def _parse_cache_path(source_file_path):
+    #Figure out where the cache entry for a file goes, based
+    #on everything that affects the parse except the
+    #included files (which are checked when loading),
+    #returning None if there is no usable cache
+    cache_dir = os.environ.get(_PARSE_CACHE_DIR_VARIABLE, None)
+    if cache_dir is None:
+        cache_dir = expanduser(_DEFAULT_PARSE_CACHE_DIR)
+    elif cache_dir == "":
+        return None
+    try:
+        if not exists(cache_dir):
+            os.makedirs(cache_dir)
+    except OSError:
+        return None
+    content_hash = _hash_file(source_file_path)
+    if content_hash is None:
+        return None
+    key = hashlib.sha1()
+    for data in [str(_PARSE_CACHE_VERSION), 
+                 abspath(source_file_path), 
+                 content_hash, 
+                 str(_PARSE_OPTIONS)] + _PARSE_ARGUMENTS:
+        key.update(data)
+        key.update("\0")
+    return join(cache_dir, "%s.json" % key.hexdigest())
+
+def _load_cached_declarations(cache_path, source_file_path):
+    #Load the declarations and includes from a cache entry,
+    #returning None if the entry is missing, invalid or out
+    #of date
+    try:
+        with open(cache_path, "r") as f:
+            entry = json.load(f)
+        for path, include_hash in entry["includes"]:
+            if _hash_file(path) != include_hash:
+                return None
+        declarations = [CFunctionDeclaration(str(d["name"]),
+                                     str(d["return_type"]),
+                                     tuple([str(t) for t in d["argument_types"]]),
+                                     tuple([str(n) for n in d["argument_names"]]),
+                                     tuple([str(v) for v in d["argument_default_values"]]),
+                                     source_file_path,
+                                     tuple(d["extent"]),
+                                     d["text"].encode("utf-8"))
+                        for d 
+                        in entry["declarations"]]
+        return declarations, [str(path) for path, include_hash in entry["includes"]]
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+def _store_cached_declarations(cache_path, declarations, includes):
+    #Store declarations in a cache entry.  The entry is
+    #written to a temporary file and renamed into place, so
+    #readers never see a partial entry, and failures are
+    #ignored, since the cache is only an optimization.
+    entry = {
+        "includes": [(path, _hash_file(path)) for path in includes],
+        "declarations": [{
+            "name": d.name,
+            "return_type": d.return_type,
+            "argument_types": d.argument_types,
+            "argument_names": d.argument_names,
+            "argument_default_values": d.argument_default_values,
+            "extent": d.extent,
+            "text": (d.text or "").decode("utf-8", "replace")
+        } for d in declarations]
+    }
+    try:
+        handle, temporary_path = tempfile.mkstemp(dir = os.path.dirname(cache_path))
+        with os.fdopen(handle, "w") as f:
+            json.dump(entry, f)
+        os.rename(temporary_path, cache_path)
+    except (IOError, OSError):
+        pass
 
 class CFile(object):
     def __init__(self, file_path):
@@ -266,8 +460,30 @@ class CFile(object):
             raise ValueError("The file_path argument must point to a file.")
         self.__file_path = file_path
 
-        #Scan the file for function declarations
-        self.__function_declarations = _find_c_function_declarations(file_path)
+        #Scan the file for function declarations, using the
+        #parse cache if possible (see _parse_cache_path)
+        cache_path = _parse_cache_path(file_path)
+        cached = None
+        if cache_path is not None:
+            cached = _load_cached_declarations(cache_path, file_path)
+        if cached is None:
+            declarations, includes = _find_c_function_declarations(file_path)
+            if cache_path is not None:
+                _store_cached_declarations(cache_path, declarations, includes)
+        else:
+            declarations, includes = cached
+        self.__function_declarations = declarations
+        self.__includes = tuple(includes)
+
+        #Index the declarations by name.  There may be both a
+        #prototype and a definition for a function, in which
+        #case we keep the one which has more information, i.e.
+        #the body, which is necessary for OpenCL.
+        self.__function_declarations_by_name = {}
+        for decl in self.__function_declarations:
+            result = self.__function_declarations_by_name.get(decl.name, None)
+            if result == None or decl.has_body > result.has_body:
+                self.__function_declarations_by_name[decl.name] = decl
 
     @property
     def file_path(self):
@@ -277,21 +493,16 @@ class CFile(object):
     def function_declarations(self):
         return self.__function_declarations
 
+    @property
+    def includes(self):
+        #The absolute paths of all files included by the file
+        #(directly or indirectly)
+        return self.__includes
+
     def __getitem__(self, key):
-        #Scan through the file.  
-        #HACK: There may be prototypes for the 
-        #functions because clang processes include 
-        #directives, which is nice, but a bit of a 
-        #pain.  We try to find the result which 
-        #has more information, in this case, the 
-        #body, which is necessary for OpenCL.
-        result = None
-        for decl in self.__function_declarations:
-            if decl.name == key:
-                if result == None:
-                    result = decl
-                elif decl.has_body > result.has_body:
-                    result = decl
-        
-        #No matching declaration found
-        return result
+        #Look up the declaration, treating keys which can't
+        #be names (e.g. unhashable ones) as missing
+        try:
+            return self.__function_declarations_by_name.get(key, None)
+        except TypeError:
+            return None
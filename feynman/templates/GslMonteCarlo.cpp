@@ -1,6 +1,19 @@
 //Self-includes
 \#include "${primary_header_include}"
 
+//Standard includes
+\#include <algorithm>
+\#include <cstdio>
+
+//The number of digits of the scrambled Halton sequence,
+//which (in base 2, and fewer in larger bases) is enough to
+//reach double precision
+\#define QUASI_DIGITS 53
+
+//The most Vegas iterations run while waiting for the
+//chi-squared to settle
+\#define VEGAS_MAX_ITERATIONS 25
+
 #if len($integrator.integrand.include_dependencies) > 0
 //Depedency includes
 #for $include_dependency in $integrator.integrand.include_dependencies
@@ -11,22 +24,32 @@
 ${integrator.name}::${integrator.name}() :
 _monte_carlo_type(${integrator.name}::MonteCarloPlain),
 _n_calls(500000),
-_plain_state(gsl_monte_plain_alloc($integrator.n_dimensions)),
-_miser_state(gsl_monte_miser_alloc($integrator.n_dimensions)),
-_vegas_state(gsl_monte_vegas_alloc($integrator.n_dimensions))
+_target_relative_error(0.0),
+_max_calls(50000000),
+_time_budget(0.0),
+_vegas_warmup_calls(10000),
+_vegas_chisq(0.0),
+_quasi_randomizations(8),
+_quasi_seeds(),
+_quasi_tails(),
+_progress_callback(NULL),
+_progress_data(NULL),
+_progress_calls(0),
+_active_workers(0),
+_stop_requested(false),
+_workers()
 {
     gsl_rng_env_setup();
     _random_number_generator_type = gsl_rng_default;
-    _random_number_generator = gsl_rng_alloc(_random_number_generator_type);
+    pthread_mutex_init(&_stop_mutex, NULL);
+    _resize_workers(1);
 }
 
 ${integrator.name}::~${integrator.name}()
 {
     //Cleanup
-    gsl_rng_free(_random_number_generator);
-    gsl_monte_vegas_free(_vegas_state);
-    gsl_monte_miser_free(_miser_state);
-    gsl_monte_plain_free(_plain_state);
+    _resize_workers(0);
+    pthread_mutex_destroy(&_stop_mutex);
 }
 
 void ${integrator.name}::set_monte_carlo_type(${integrator.name}::MonteCarloType t)
@@ -49,30 +72,449 @@ int ${integrator.name}::n_calls()
     return _n_calls;
 }
 
-$integrator.evaluation_function.return_type ${integrator.name}::operator()($integrator.evaluation_function.argument_signature, $integrator.evaluation_function.return_type *error)
+void ${integrator.name}::set_target_relative_error(double e)
 {
-    //Boiler plate GSL variables
-    double result, _error;
+    _target_relative_error = e;
+}
+
+double ${integrator.name}::target_relative_error()
+{
+    return _target_relative_error;
+}
+
+void ${integrator.name}::set_max_calls(int n)
+{
+    _max_calls = n;
+}
+
+int ${integrator.name}::max_calls()
+{
+    return _max_calls;
+}
+
+void ${integrator.name}::set_time_budget(double seconds)
+{
+    _time_budget = seconds;
+}
+
+double ${integrator.name}::time_budget()
+{
+    return _time_budget;
+}
+
+void ${integrator.name}::set_n_threads(int n)
+{
+    //Every integration type needs at least one worker
+    if(n < 1)
+    {
+        fprintf(stderr, "ERROR: The number of threads must be at least 1 (got %d)\n", n);
+        return;
+    }
+    _resize_workers(n);
+}
+
+void ${integrator.name}::_resize_workers(size_t n)
+{
+    //Free any extra workers
+    while(_workers.size() > n)
+    {
+        Worker &worker = _workers.back();
+        gsl_rng_free(worker.random_number_generator);
+        gsl_monte_vegas_free(worker.vegas_state);
+        gsl_monte_miser_free(worker.miser_state);
+        gsl_monte_plain_free(worker.plain_state);
+        _workers.pop_back();
+    }
+
+    //Create any new workers.  The first uses the default
+    //GSL seed (GSL_RNG_SEED), and the others follow it, so
+    //that each worker has a reproducible, independent
+    //stream.
+    while(_workers.size() < n)
+    {
+        Worker worker;
+        worker.plain_state = gsl_monte_plain_alloc($integrator.n_dimensions);
+        worker.miser_state = gsl_monte_miser_alloc($integrator.n_dimensions);
+        worker.vegas_state = gsl_monte_vegas_alloc($integrator.n_dimensions);
+        worker.random_number_generator = gsl_rng_alloc(_random_number_generator_type);
+        gsl_rng_set(worker.random_number_generator, gsl_rng_default_seed + _workers.size());
+        worker.integrator = this;
+        _workers.push_back(worker);
+    }
+}
+
+int ${integrator.name}::n_threads()
+{
+    return _workers.size();
+}
 
+double ${integrator.name}::chisq()
+{
+    return _vegas_chisq;
+}
+
+void ${integrator.name}::set_progress_callback(ProgressCallback callback, void *data)
+{
+    _progress_callback = callback;
+    _progress_data = data;
+}
+
+$integrator.evaluation_function.return_type ${integrator.name}::operator()($integrator.evaluation_function.argument_signature, $integrator.evaluation_function.return_type *error)
+{
     //Determine upper/lower bounds
     double lower_bounds[$integrator.n_dimensions] = {${", ".join($integrator.evaluation_function.argument_names[:-1:2])}};
     double upper_bounds[$integrator.n_dimensions] = {${", ".join($integrator.evaluation_function.argument_names[1::2])}};
 
+    //Integrate!
+    double _error;
+    double result = _integrate(lower_bounds, upper_bounds, &_error);
+
+    //Store results
+    if(error != NULL)
+    {
+        *error = _error;
+    }
+
+    return result;
+}
+
+void ${integrator.name}::integrate_batch(int n_integrals, 
+                                         const double *bounds, 
+                                         $integrator.evaluation_function.return_type *results, 
+                                         $integrator.evaluation_function.return_type *errors)
+{
+    for(int i = 0; i < n_integrals; i++)
+    {
+        //Determine upper/lower bounds
+        const double *integral_bounds = bounds + i * ${2 * $integrator.n_dimensions};
+        double lower_bounds[$integrator.n_dimensions];
+        double upper_bounds[$integrator.n_dimensions];
+        for(int d = 0; d < $integrator.n_dimensions; d++)
+        {
+            lower_bounds[d] = integral_bounds[2 * d];
+            upper_bounds[d] = integral_bounds[2 * d + 1];
+        }
+
+        //Integrate!
+        double _error;
+        results[i] = _integrate(lower_bounds, upper_bounds, &_error);
+        if(errors != NULL)
+        {
+            errors[i] = _error;
+        }
+    }
+}
+
+double ${integrator.name}::_integrate(double *lower_bounds, double *upper_bounds, double *error)
+{
+    gettimeofday(&_progress_start, NULL);
+    _progress_calls = 0;
+    _set_stop_requested(false);
+
+    //Without a target, just integrate once
+    if(_target_relative_error <= 0.0 && _time_budget <= 0.0)
+    {
+        double result = _integrate_once(lower_bounds, upper_bounds, error);
+        _report_progress(_progress_calls, result, *error, _vegas_chisq);
+        return result;
+    }
+
+    //Otherwise run batches, pooling them, until the target
+    //is met, a limit is hit or the progress callback stops
+    //the integration.  Every batch has the same number of
+    //calls, so the pooled result is the mean of the batch
+    //results, and its variance is the mean of the batch
+    //variances over the number of batches.  Weighting the
+    //batches by their inverse variances instead would be
+    //biased towards batches which happened to see little
+    //variation, and would lose batches which saw none.
+    struct timeval now;
+    double result_sum = 0.0;
+    double square_result_sum = 0.0;
+    double variance_sum = 0.0;
+    double result = 0.0;
+    long total_calls = 0;
+    for(int batch = 1; ; batch++)
+    {
+        double batch_error;
+        double batch_result = _integrate_once(lower_bounds, upper_bounds, &batch_error);
+        total_calls += _n_calls;
+        if(batch_error <= 0.0 && batch == 1)
+        {
+            //The first batch is exact (e.g. the integrand is
+            //constant), so there's nothing to add
+            *error = 0.0;
+            _report_progress(_progress_calls, batch_result, 0.0, 0.0);
+            return batch_result;
+        }
+        result_sum += batch_result;
+        square_result_sum += batch_result * batch_result;
+        variance_sum += batch_error * batch_error;
+        result = result_sum / batch;
+        *error = sqrt(variance_sum) / batch;
+
+        //Report the combined batches, whose chi-squared
+        //checks that their spread agrees with their errors
+        //(a single batch reports its own, as without a
+        //target)
+        double chisq = _vegas_chisq;
+        if(batch > 1)
+        {
+            chisq = (square_result_sum - result_sum * result) / (batch - 1) 
+                    / (variance_sum / batch);
+        }
+        if(_report_progress(_progress_calls, result, *error, chisq > 0.0 ? chisq : 0.0))
+        {
+            break;
+        }
+
+        //Stop at the target, or before another batch would
+        //exceed a limit
+        if(_target_relative_error > 0.0 && *error <= _target_relative_error * fabs(result))
+        {
+            break;
+        }
+        if(_max_calls > 0 && total_calls + _n_calls > _max_calls)
+        {
+            break;
+        }
+        gettimeofday(&now, NULL);
+        double elapsed = (now.tv_sec - _progress_start.tv_sec) 
+                         + 1e-6 * (now.tv_usec - _progress_start.tv_usec);
+        if(_time_budget > 0.0 && elapsed * (batch + 1) / batch > _time_budget)
+        {
+            break;
+        }
+    }
+
+    return result;
+}
+
+bool ${integrator.name}::_report_progress(long calls, double result, double error, double chisq)
+{
+    if(_progress_callback != NULL)
+    {
+        struct timeval now;
+        gettimeofday(&now, NULL);
+        double elapsed = (now.tv_sec - _progress_start.tv_sec) 
+                         + 1e-6 * (now.tv_usec - _progress_start.tv_usec);
+        if(_progress_callback(_progress_data, calls, result, error, chisq, elapsed) != 0)
+        {
+            _set_stop_requested(true);
+        }
+    }
+    return _stopping();
+}
+
+void ${integrator.name}::_set_stop_requested(bool stop)
+{
+    pthread_mutex_lock(&_stop_mutex);
+    _stop_requested = stop;
+    pthread_mutex_unlock(&_stop_mutex);
+}
+
+bool ${integrator.name}::_stopping()
+{
+    pthread_mutex_lock(&_stop_mutex);
+    bool stop = _stop_requested;
+    pthread_mutex_unlock(&_stop_mutex);
+    return stop;
+}
+
+double ${integrator.name}::_integrate_once(double *lower_bounds, double *upper_bounds, double *error)
+{
+    //Quasi integrations split the calls between the 
+    //randomizations, and then each randomization's calls
+    //between the workers
+    size_t n_calls = _n_calls;
+    if(_monte_carlo_type == MonteCarloQuasi)
+    {
+        n_calls = _n_calls / _quasi_randomizations;
+        if(n_calls == 0)
+        {
+            n_calls = 1;
+        }
+        _quasi_scramble();
+    }
+
+    //Split the calls between the workers, making sure
+    //each has at least one call, and giving each a
+    //block of the sequence for quasi integrations
+    size_t n_workers = _workers.size();
+    if(n_workers > n_calls && n_calls > 0)
+    {
+        n_workers = n_calls;
+    }
+    size_t first_index = 0;
+    for(size_t i = 0; i < n_workers; i++)
+    {
+        _workers[i].lower_bounds = lower_bounds;
+        _workers[i].upper_bounds = upper_bounds;
+        _workers[i].n_calls = n_calls / n_workers + (i < n_calls % n_workers ? 1 : 0);
+        _workers[i].first_index = first_index;
+        _workers[i].quasi_sums.resize(_quasi_randomizations);
+        first_index += _workers[i].n_calls;
+    }
+    _active_workers = n_workers;
+
+    //Adapt the Vegas grid once, with the first worker, and
+    //start every worker from it (the warm-up results are
+    //discarded)
+    if(_monte_carlo_type == MonteCarloVegas)
+    {
+        gsl_monte_function G = {&${integrator.name}::_wrapper, 
+                                $integrator.n_dimensions,
+                                NULL};
+        double warmup_result, warmup_error;
+        gsl_monte_vegas_integrate(&G, 
+                                  lower_bounds, 
+                                  upper_bounds, 
+                                  $integrator.n_dimensions, 
+                                  _vegas_warmup_calls, 
+                                  _workers[0].random_number_generator, 
+                                  _workers[0].vegas_state,
+                                  &warmup_result,
+                                  &warmup_error);
+        for(size_t i = 1; i < n_workers; i++)
+        {
+            _copy_vegas_grid(_workers[0].vegas_state, _workers[i].vegas_state);
+        }
+    }
+
+    //Run the workers, with the first one (and any which
+    //can't get a thread) in this thread
+    std::vector<pthread_t> threads(n_workers);
+    std::vector<bool> threaded(n_workers, false);
+    for(size_t i = 1; i < n_workers; i++)
+    {
+        threaded[i] = pthread_create(&threads[i], 
+                                     NULL, 
+                                     &${integrator.name}::_worker_thread, 
+                                     &_workers[i]) == 0;
+    }
+    for(size_t i = 0; i < n_workers; i++)
+    {
+        if(!threaded[i])
+        {
+            _run_worker(_workers[i]);
+        }
+    }
+    for(size_t i = 1; i < n_workers; i++)
+    {
+        if(threaded[i])
+        {
+            pthread_join(threads[i], NULL);
+        }
+    }
+
+    //Combine the results
+    double result = 0.0;
+    double variance = 0.0;
+    for(size_t i = 0; i < n_workers; i++)
+    {
+        _progress_calls += _workers[i].calls_made;
+    }
+    if(_monte_carlo_type == MonteCarloQuasi)
+    {
+        //Each randomization gives an independent, unbiased
+        //estimate, so the spread of the estimates gives the
+        //error of their mean
+        double volume = 1.0;
+        for(int d = 0; d < $integrator.n_dimensions; d++)
+        {
+            volume *= upper_bounds[d] - lower_bounds[d];
+        }
+        std::vector<double> estimates(_quasi_randomizations, 0.0);
+        for(int r = 0; r < _quasi_randomizations; r++)
+        {
+            for(size_t i = 0; i < n_workers; i++)
+            {
+                estimates[r] += _workers[i].quasi_sums[r];
+            }
+            estimates[r] *= volume / n_calls;
+            result += estimates[r] / _quasi_randomizations;
+        }
+        if(_quasi_randomizations > 1)
+        {
+            for(int r = 0; r < _quasi_randomizations; r++)
+            {
+                variance += (estimates[r] - result) * (estimates[r] - result);
+            }
+            variance /= _quasi_randomizations * (_quasi_randomizations - 1.0);
+        }
+        _vegas_chisq = 0.0;
+    }
+    else if(n_workers == 1)
+    {
+        result = _workers[0].result;
+        variance = _workers[0].error * _workers[0].error;
+        _vegas_chisq = _workers[0].chisq;
+    }
+    else if(_monte_carlo_type == MonteCarloVegas)
+    {
+        //Each worker has adapted its own grid, so weight
+        //their results by their inverse variances, as Vegas
+        //does with its iterations
+        double weight_sum = 0.0;
+        double weighted_sum = 0.0;
+        _vegas_chisq = 0.0;
+        for(size_t i = 0; i < n_workers; i++)
+        {
+            double weight = 1.0 / (_workers[i].error * _workers[i].error);
+            weighted_sum += weight * _workers[i].result;
+            weight_sum += weight;
+            _vegas_chisq += _workers[i].chisq / n_workers;
+        }
+        result = weighted_sum / weight_sum;
+        variance = 1.0 / weight_sum;
+    }
+    else
+    {
+        //Plain and Miser results are pooled as though all
+        //of the calls had been made by a single worker
+        for(size_t i = 0; i < n_workers; i++)
+        {
+            double fraction = (double)_workers[i].n_calls / n_calls;
+            result += fraction * _workers[i].result;
+            variance += fraction * fraction * _workers[i].error * _workers[i].error;
+        }
+    }
+
+    *error = sqrt(variance);
+    return result;
+}
+
+void *${integrator.name}::_worker_thread(void *worker)
+{
+    Worker *w = (Worker *)worker;
+    w->integrator->_run_worker(*w);
+    return NULL;
+}
+
+void ${integrator.name}::_run_worker(Worker &worker)
+{
+    //Boiler plate GSL variables
+    double result, _error;
+    double *lower_bounds = worker.lower_bounds;
+    double *upper_bounds = worker.upper_bounds;
+
     //Call variables
     gsl_monte_function G = {&${integrator.name}::_wrapper, 
                             $integrator.n_dimensions,
                             NULL};
 
     //Integrate!
+    worker.chisq = 0.0;
+    worker.calls_made = worker.n_calls;
     if(_monte_carlo_type == MonteCarloPlain)
     {
         gsl_monte_plain_integrate(&G, 
                                   lower_bounds, 
                                   upper_bounds, 
                                   $integrator.n_dimensions, 
-                                  _n_calls, 
-                                  _random_number_generator, 
-                                  _plain_state, 
+                                  worker.n_calls, 
+                                  worker.random_number_generator, 
+                                  worker.plain_state, 
                                   &result, 
                                   &_error);
     }
@@ -82,54 +524,283 @@ $integrator.evaluation_function.return_type ${integrator.name}::operator()($inte
                                   lower_bounds, 
                                   upper_bounds, 
                                   $integrator.n_dimensions, 
-                                  _n_calls, 
-                                  _random_number_generator, 
-                                  _miser_state, 
+                                  worker.n_calls, 
+                                  worker.random_number_generator, 
+                                  worker.miser_state, 
                                   &result, 
                                   &_error);
     }
     else if(_monte_carlo_type == MonteCarloVegas)
     {
-        gsl_monte_vegas_integrate(&G, 
-                                  lower_bounds, 
-                                  upper_bounds, 
-                                  $integrator.n_dimensions, 
-                                  10000, 
-                                  _random_number_generator, 
-                                  _vegas_state,
-                                  &result,
-                                  &_error);
-        //Now actually converge on a result
+        //Starting from the warmed-up grid (see 
+        //_integrate_once), converge on a result, giving up on a
+        //settled chi-squared after VEGAS_MAX_ITERATIONS (or
+        //when the progress callback stops the integration)
+        int iterations = 0;
+        worker.calls_made = 0;
         do
         {
             gsl_monte_vegas_integrate(&G, 
                                       lower_bounds, 
                                       upper_bounds, 
                                       $integrator.n_dimensions, 
-                                      _n_calls/5, 
-                                      _random_number_generator, 
-                                      _vegas_state,
+                                      worker.n_calls/5, 
+                                      worker.random_number_generator, 
+                                      worker.vegas_state,
                                       &result, 
                                       &_error);
+            iterations++;
+            worker.calls_made += worker.n_calls/5;
+
+            //The first worker runs in the calling thread, so
+            //it reports for all of them
+            if(&worker == &_workers[0])
+            {
+                _report_progress(_progress_calls + worker.calls_made * _active_workers, 
+                                 result, 
+                                 _error / sqrt((double)_active_workers), 
+                                 gsl_monte_vegas_chisq(worker.vegas_state));
+            }
+        }
+        while(fabs(gsl_monte_vegas_chisq(worker.vegas_state) - 1.0) > 0.5
+              && iterations < VEGAS_MAX_ITERATIONS
+              && !_stopping());
+        worker.chisq = gsl_monte_vegas_chisq(worker.vegas_state);
+    }
+    else if(_monte_carlo_type == MonteCarloQuasi)
+    {
+        //Sum the integrand over the worker's block of the
+        //sequence under each randomization (the results are
+        //combined by _integrate)
+        double x[$integrator.n_dimensions];
+        for(int r = 0; r < _quasi_randomizations; r++)
+        {
+            double sum = 0.0;
+            for(size_t i = 0; i < worker.n_calls; i++)
+            {
+                unsigned long index = worker.first_index + i;
+                for(int d = 0; d < $integrator.n_dimensions; d++)
+                {
+                    x[d] = lower_bounds[d] + _quasi_coordinate(index, r, d) * (upper_bounds[d] - lower_bounds[d]);
+                }
+                sum += _wrapper(x, $integrator.n_dimensions, NULL);
+            }
+            worker.quasi_sums[r] = sum;
         }
-        while(fabs(gsl_monte_vegas_chisq(_vegas_state) - 1.0) > 0.5);
+        worker.calls_made = worker.n_calls * _quasi_randomizations;
+        result = 0.0;
+        _error = 0.0;
     }
     else
     {
         result = 0.0;
         _error = 0.0;
     }
-    
-    //Store results
-    if(error != NULL)
+
+    worker.result = result;
+    worker.error = _error;
+}
+
+void ${integrator.name}::_copy_vegas_grid(const gsl_monte_vegas_state *source, 
+                                          gsl_monte_vegas_state *destination)
+{
+    //The grid is the bin boundaries along each dimension
+    //(bins_max + 1 per dimension), the bin count and the
+    //region's widths and volume.  Setting the stage to 1 
+    //keeps the grid, but discards the (warm-up) results.
+    std::copy(source->xi, 
+              source->xi + (source->bins_max + 1) * source->dim, 
+              destination->xi);
+    std::copy(source->delx, source->delx + source->dim, destination->delx);
+    destination->bins = source->bins;
+    destination->vol = source->vol;
+    destination->stage = 1;
+}
+
+void ${integrator.name}::_quasi_scramble()
+{
+    static const unsigned int bases[$integrator.n_dimensions] = {${", ".join([str(b) for b in $quasi_bases])}};
+
+    //Draw the seeds
+    _quasi_seeds.resize(_quasi_randomizations);
+    for(int r = 0; r < _quasi_randomizations; r++)
     {
-        *error = _error;
+        _quasi_seeds[r] = gsl_rng_get(_workers[0].random_number_generator);
     }
 
-    return result;
+    //Every digit past the end of an index is zero, so the
+    //scrambled digits past each index length can be summed
+    //up front, working back from the last digit
+    _quasi_tails.assign(_quasi_randomizations * $integrator.n_dimensions * (QUASI_DIGITS + 1), 0.0);
+    for(int r = 0; r < _quasi_randomizations; r++)
+    {
+        for(int d = 0; d < $integrator.n_dimensions; d++)
+        {
+            double *tails = &_quasi_tails[(r * $integrator.n_dimensions + d) * (QUASI_DIGITS + 1)];
+            int n_digits = 0;
+            for(double scale = 1.0 / bases[d]; scale > 1.0e-16 && n_digits < QUASI_DIGITS; scale /= bases[d])
+            {
+                n_digits++;
+            }
+            for(int k = n_digits - 1; k >= 0; k--)
+            {
+                tails[k] = (_quasi_permute(0, bases[d], _quasi_seeds[r], d, k) + tails[k + 1]) / bases[d];
+            }
+        }
+    }
+}
+
+double ${integrator.name}::_quasi_coordinate(unsigned long index, int randomization, int dimension)
+{
+    static const unsigned int bases[$integrator.n_dimensions] = {${", ".join([str(b) for b in $quasi_bases])}};
+    unsigned int base = bases[dimension];
+    unsigned int seed = _quasi_seeds[randomization];
+
+    //Scramble the digits of the index, and then add on the
+    //scrambled zeros which follow them
+    double inverse_base = 1.0 / base;
+    double scale = inverse_base;
+    double coordinate = 0.0;
+    int k = 0;
+    for(; index > 0 && k < QUASI_DIGITS; k++)
+    {
+        coordinate += _quasi_permute(index % base, base, seed, dimension, k) * scale;
+        index /= base;
+        scale *= inverse_base;
+    }
+    return coordinate + scale * base * _quasi_tails[(randomization * $integrator.n_dimensions + dimension) * (QUASI_DIGITS + 1) + k];
+}
+
+unsigned int ${integrator.name}::_quasi_permute(unsigned int digit, 
+                                                unsigned int base, 
+                                                unsigned int seed, 
+                                                unsigned int dimension, 
+                                                unsigned int position)
+{
+    //Hash the seed, dimension and position into a random
+    //multiplier (which is non-zero, so that the permutation
+    //is one-to-one in the prime base) and shift
+    unsigned int h = _quasi_hash(seed ^ _quasi_hash((dimension << 8) | position));
+    unsigned int multiplier = 1 + h % (base - 1);
+    unsigned int shift = (h / base) % base;
+    return (multiplier * digit + shift) % base;
+}
+
+unsigned int ${integrator.name}::_quasi_hash(unsigned int x)
+{
+    x ^= x >> 16;
+    x *= 0x7feb352dU;
+    x ^= x >> 15;
+    x *= 0x846ca68bU;
+    x ^= x >> 16;
+    return x;
 }
 
 double ${integrator.name}::_wrapper(double *x, size_t dim, void *params)
 {
     return ${integrator.integrand.name}(${", ".join(["x[%i]" % i for i in xrange(0, len($integrator.integrand.argument_types))])});
 }
+
+void *${integrator.name}_create()
+{
+    return new ${integrator.name}();
+}
+
+void ${integrator.name}_destroy(void *integrator)
+{
+    delete (${integrator.name} *)integrator;
+}
+
+void ${integrator.name}_set_monte_carlo_type(void *integrator, int t)
+{
+    ((${integrator.name} *)integrator)->set_monte_carlo_type((${integrator.name}::MonteCarloType)t);
+}
+
+int ${integrator.name}_monte_carlo_type(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->monte_carlo_type();
+}
+
+void ${integrator.name}_set_n_calls(void *integrator, int n)
+{
+    ((${integrator.name} *)integrator)->set_n_calls(n);
+}
+
+int ${integrator.name}_n_calls(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->n_calls();
+}
+
+double ${integrator.name}_chisq(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->chisq();
+}
+
+void ${integrator.name}_set_target_relative_error(void *integrator, double e)
+{
+    ((${integrator.name} *)integrator)->set_target_relative_error(e);
+}
+
+double ${integrator.name}_target_relative_error(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->target_relative_error();
+}
+
+void ${integrator.name}_set_max_calls(void *integrator, int n)
+{
+    ((${integrator.name} *)integrator)->set_max_calls(n);
+}
+
+int ${integrator.name}_max_calls(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->max_calls();
+}
+
+void ${integrator.name}_set_time_budget(void *integrator, double seconds)
+{
+    ((${integrator.name} *)integrator)->set_time_budget(seconds);
+}
+
+double ${integrator.name}_time_budget(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->time_budget();
+}
+
+void ${integrator.name}_integrate_batch(void *integrator, 
+                                        int n_integrals, 
+                                        const double *bounds, 
+                                        double *results, 
+                                        double *errors)
+{
+    std::vector<$integrator.evaluation_function.return_type> batch_results(n_integrals > 0 ? n_integrals : 1);
+    std::vector<$integrator.evaluation_function.return_type> batch_errors(n_integrals > 0 ? n_integrals : 1);
+    ((${integrator.name} *)integrator)->integrate_batch(n_integrals, 
+                                                       bounds, 
+                                                       &batch_results[0], 
+                                                       &batch_errors[0]);
+    for(int i = 0; i < n_integrals; i++)
+    {
+        results[i] = batch_results[i];
+        if(errors != NULL)
+        {
+            errors[i] = batch_errors[i];
+        }
+    }
+}
+
+void ${integrator.name}_set_n_threads(void *integrator, int n)
+{
+    ((${integrator.name} *)integrator)->set_n_threads(n);
+}
+
+int ${integrator.name}_n_threads(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->n_threads();
+}
+
+void ${integrator.name}_set_progress_callback(void *integrator, 
+                                              ${integrator.name}::ProgressCallback callback, 
+                                              void *data)
+{
+    ((${integrator.name} *)integrator)->set_progress_callback(callback, data);
+}
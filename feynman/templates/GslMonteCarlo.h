@@ -3,6 +3,12 @@
 
 //Standard includes
 \#include <cstdlib>
+\#include <vector>
+
+//POSIX includes (for timing integrations and the worker
+//threads)
+\#include <sys/time.h>
+\#include <pthread.h>
 
 //GSL includes
 \#include <gsl/gsl_math.h>
@@ -18,7 +24,9 @@ class $integrator.name
         {
             MonteCarloPlain,
             MonteCarloMiser,
-            MonteCarloVegas
+            MonteCarloVegas,
+            MonteCarloQuasi //Randomized quasi-Monte Carlo, with a scrambled 
+                            //Halton sequence in place of random points
         };
 
         ${integrator.name}();
@@ -30,17 +38,207 @@ class $integrator.name
         void set_n_calls(int n);
         int n_calls();
 
+        //Integrate to a target precision.  With a target
+        //relative error or a time budget (in seconds) set,
+        //integrations run batches of n_calls calls, pooled
+        //into a single estimate (as if all of their calls had
+        //been made at once, so batches without a variance,
+        //e.g. where every point missed the non-zero part of
+        //the integrand, still count), until the combined
+        //error is within the target, another batch would take
+        //the calls past max_calls (50000000 by default, with
+        //zero for no limit), or another batch would overrun
+        //the time budget.  At least one batch is always run
+        //(and if it is exact, it is the result), and zero 
+        //(the default) disables a target or budget.
+        void set_target_relative_error(double e);
+        double target_relative_error();
+        void set_max_calls(int n);
+        int max_calls();
+        void set_time_budget(double seconds);
+        double time_budget();
+
+        //The number of worker threads to split the calls of each
+        //integration between (1 by default).  Each worker has
+        //its own integration states and random number generator,
+        //seeded from GSL_RNG_SEED plus the worker number.  With
+        //more than one worker the integrand must be thread-safe.
+        //There must be at least one worker (other values are
+        //rejected with an error message).
+        void set_n_threads(int n);
+        int n_threads();
+
+        //The chi-squared per degree of freedom of the
+        //iterations of the last Vegas integration
+        double chisq();
+
+        //Reports the progress of integrations.  The callback
+        //gets data, the number of calls made so far (not 
+        //counting Vegas warm-up calls), the running estimate
+        //and its error, the chi-squared per degree of freedom 
+        //of the iterations (for Vegas) or batches combined so
+        //far (or zero) and the seconds since the integration
+        //started.  Returning non-zero stops the integration
+        //early, with the estimate so far.  It is called after
+        //each batch of n_calls calls (see
+        //set_target_relative_error) and each Vegas iteration,
+        //always from the calling thread (with more than one
+        //thread, Vegas iterations are reported from the first
+        //worker, with its estimate standing in for the rest).
+        //A NULL callback (the default) turns reporting off.
+        typedef int (*ProgressCallback)(void *data, 
+                                        long calls, 
+                                        double result, 
+                                        double error, 
+                                        double chisq, 
+                                        double elapsed);
+        void set_progress_callback(ProgressCallback callback, void *data);
+
         $integrator.evaluation_function.return_type operator()($integrator.evaluation_function.argument_signature, $integrator.evaluation_function.return_type *error);
 
+        //Integrates a batch of n_integrals integrals.  The bounds
+        //hold 2 * $integrator.n_dimensions values for each integral, in the
+        //same order as the arguments of operator(), and results
+        //and errors (which may be NULL) receive n_integrals values.
+        void integrate_batch(int n_integrals, 
+                             const double *bounds, 
+                             $integrator.evaluation_function.return_type *results, 
+                             $integrator.evaluation_function.return_type *errors);
+
     private:
+        //Don't allow copying due to the worker states
+        ${integrator.name}( const ${integrator.name}& );
+        const ${integrator.name}& operator=( const ${integrator.name}& );
+
+        //A worker, with its own integration states and random
+        //number generator, and the share of the current
+        //integration it is running
+        struct Worker
+        {
+            gsl_monte_plain_state *plain_state;
+            gsl_monte_miser_state *miser_state;
+            gsl_monte_vegas_state *vegas_state;
+            gsl_rng *random_number_generator;
+            ${integrator.name} *integrator; //The integrator which owns the worker
+            double *lower_bounds; //The bounds of the current integration
+            double *upper_bounds;
+            size_t n_calls; //The worker's share of the calls
+            size_t first_index; //The first point of the worker's block of the 
+                                //sequence (for quasi integrations)
+            std::vector<double> quasi_sums; //The worker's sum for each randomization 
+                                            //of the sequence (for quasi integrations)
+            size_t calls_made; //The calls made by the worker (not counting warm-up)
+            double result; //The worker's result, error and (for Vegas) chi-squared
+            double error;
+            double chisq;
+        };
+
         MonteCarloType _monte_carlo_type;
         int _n_calls;
-        gsl_monte_plain_state *_plain_state;
-        gsl_monte_miser_state *_miser_state;
-        gsl_monte_vegas_state *_vegas_state;
+        double _target_relative_error; //The target relative error, or 0 for none
+        int _max_calls; //The limit on the calls made to reach a target
+        double _time_budget; //The time allowed to reach a target, or 0 for no limit
+        int _vegas_warmup_calls; //The number of calls used to adapt the grid before
+                                 //results are accumulated
+        double _vegas_chisq;
+        int _quasi_randomizations; //The number of independent scramblings of the sequence
+                                   //to split the calls between, whose spread gives the error
+        std::vector<unsigned int> _quasi_seeds; //The scrambling seed of each randomization
+        std::vector<double> _quasi_tails; //The scrambled zero digits past the end of an index,
+                                          //for each randomization, dimension and index length
         const gsl_rng_type *_random_number_generator_type;
-        gsl_rng *_random_number_generator;
+        ProgressCallback _progress_callback; //The progress callback, or NULL
+        void *_progress_data; //The data passed to the progress callback
+        struct timeval _progress_start; //The start of the current integration
+        long _progress_calls; //The calls made by the finished batches of the integration
+        size_t _active_workers; //The number of workers running the current batch
+        bool _stop_requested; //Whether the callback asked for the integration to 
+                              //stop (read by the worker threads)
+        pthread_mutex_t _stop_mutex; //Guards _stop_requested
+        std::vector<Worker> _workers;
         static double _wrapper(double *x, size_t dim, void *params);
+
+        //Runs an integration, in batches if there is a target
+        //precision (see set_target_relative_error)
+        double _integrate(double *lower_bounds, double *upper_bounds, double *error);
+
+        //Runs the workers' shares of an integration with
+        //_n_calls calls and combines their results
+        double _integrate_once(double *lower_bounds, double *upper_bounds, double *error);
+
+        //Calls the progress callback, if there is one,
+        //returning whether the integration should stop
+        bool _report_progress(long calls, double result, double error, double chisq);
+
+        //Sets and reads _stop_requested (from any thread)
+        void _set_stop_requested(bool stop);
+        bool _stopping();
+
+        //Creates or frees workers until there are n
+        void _resize_workers(size_t n);
+
+        //Copies the adapted grid of a Vegas state to another,
+        //so that the workers all start from a single warm-up
+        static void _copy_vegas_grid(const gsl_monte_vegas_state *source, 
+                                     gsl_monte_vegas_state *destination);
+
+        //Runs a worker's share of an integration, either
+        //directly or as the entry point of a worker thread
+        void _run_worker(Worker &worker);
+        static void *_worker_thread(void *worker);
+
+        //Draws fresh scrambling seeds for a quasi integration
+        //and computes the resulting _quasi_tails
+        void _quasi_scramble();
+
+        //Computes a coordinate of a point of the scrambled
+        //Halton sequence under one of the randomizations
+        double _quasi_coordinate(unsigned long index, int randomization, int dimension);
+
+        //Applies the random permutation of a digit position
+        //of the sequence, which is (multiplier * digit + shift)
+        //mod base for a multiplier and shift drawn from the
+        //seed (the OpenCL backend uses the same scrambling)
+        static unsigned int _quasi_permute(unsigned int digit, 
+                                           unsigned int base, 
+                                           unsigned int seed, 
+                                           unsigned int dimension, 
+                                           unsigned int position);
+
+        //Mixes the bits of a 32-bit integer, so that nearby
+        //inputs give unrelated outputs
+        static unsigned int _quasi_hash(unsigned int x);
 };
 
+//C interface, used to load the integrator from a shared
+//library (see feynman.compilation).  Integrators are passed
+//as opaque pointers, and results and errors are returned in
+//double precision.
+extern "C"
+{
+    void *${integrator.name}_create();
+    void ${integrator.name}_destroy(void *integrator);
+    void ${integrator.name}_set_monte_carlo_type(void *integrator, int t);
+    int ${integrator.name}_monte_carlo_type(void *integrator);
+    void ${integrator.name}_set_n_calls(void *integrator, int n);
+    int ${integrator.name}_n_calls(void *integrator);
+    double ${integrator.name}_chisq(void *integrator);
+    void ${integrator.name}_set_target_relative_error(void *integrator, double e);
+    double ${integrator.name}_target_relative_error(void *integrator);
+    void ${integrator.name}_set_max_calls(void *integrator, int n);
+    int ${integrator.name}_max_calls(void *integrator);
+    void ${integrator.name}_set_time_budget(void *integrator, double seconds);
+    double ${integrator.name}_time_budget(void *integrator);
+    void ${integrator.name}_integrate_batch(void *integrator, 
+                                            int n_integrals, 
+                                            const double *bounds, 
+                                            double *results, 
+                                            double *errors);
+    void ${integrator.name}_set_n_threads(void *integrator, int n);
+    int ${integrator.name}_n_threads(void *integrator);
+    void ${integrator.name}_set_progress_callback(void *integrator, 
+                                                  ${integrator.name}::ProgressCallback callback, 
+                                                  void *data);
+}
+
 \#endif //$include_guard
@@ -1,9 +1,162 @@
+#define MAX_MISER_MONTE_CARLO_WORK_GROUP_SIZE 1024
+
+#set $n_args = len($integrator.integrand.argument_types)
+#set $n_blocks = ($n_args + 3) / 4
+#set $struct_accessors = ["s%i" % i for i in xrange(0, 4)]
+#set $sum_size = 2 + 2 * $n_args
+#set $count_size = 1 + $n_args
 __kernel void miser_integrate(
-    unsigned int points_per_worker,
-    __global ranluxcl_state_t *ranluxcl_states,
-    __global float *result,
+    unsigned int n_regions,
+    RANDOM_SOURCE_ARGUMENT,
+    __global const float *regions,
+    __global const unsigned int *region_calls,
+    __global accumulator_t *region_sums,
+    __global unsigned int *region_counts,
     $integrator.evaluation_function.argument_signature
     )
 {
-    
+    //The results for each region are split between
+    //region_sums, with the layout:
+    //
+    //  accumulator_t sum;
+    //  accumulator_t square_sum;
+    //
+    //followed, for each of the $n_args dimensions, by the
+    //sums of the points which fell in the lower half of the
+    //region along that dimension:
+    //
+    //  accumulator_t lower_sum;
+    //  accumulator_t lower_square_sum;
+    //
+    //and region_counts, with the layout:
+    //
+    //  unsigned int n_points;
+    //
+    //followed by the number of points which fell in the
+    //lower half along each dimension:
+    //
+    //  unsigned int n_lower_points;
+    //
+    //The statistics for the upper halves are recovered by
+    //the host by subtracting these from the totals.  The
+    //counts are kept as integers so that they stay exact
+    //however many points a region gets.
+    __local accumulator_t local_sums[MAX_MISER_MONTE_CARLO_WORK_GROUP_SIZE];
+    __local accumulator_t local_square_sums[MAX_MISER_MONTE_CARLO_WORK_GROUP_SIZE];
+    __local unsigned int local_counts[$count_size];
+
+    //Thread-local variables
+    unsigned int local_id = get_local_id(0);
+    unsigned int local_size = get_local_size(0);
+
+    //Start the random number generator
+    random_state_t random_state;
+    random_start(&random_state, random_source);
+
+    //Each work group takes every n_groups'th region.  The
+    //loop bounds are the same for every work item in the
+    //group, so the barriers below are safe.
+    for(unsigned int r = get_group_id(0); r < n_regions; r += get_num_groups(0))
+    {
+        //Clear the local counts
+        for(unsigned int i = local_id; i < $count_size; i += local_size)
+        {
+            local_counts[i] = 0;
+        }
+        barrier(CLK_LOCAL_MEM_FENCE);
+
+        //Grab the region bounds (in the unit hypercube)
+        __global const float *lower = regions + r * ${2 * $n_args};
+        __global const float *upper = lower + $n_args;
+
+        //Private accumulators
+        unsigned int private_count = 0;
+        accumulator_t private_sum = 0.0;
+        accumulator_t private_square_sum = 0.0;
+        accumulator_t private_sum_compensation = 0.0;
+        accumulator_t private_square_sum_compensation = 0.0;
+        unsigned int lower_count[$n_args];
+        accumulator_t lower_sum[$n_args];
+        accumulator_t lower_square_sum[$n_args];
+        accumulator_t lower_sum_compensation[$n_args];
+        accumulator_t lower_square_sum_compensation[$n_args];
+        for(unsigned int d = 0; d < $n_args; d++)
+        {
+            lower_count[d] = 0;
+            lower_sum[d] = 0.0;
+            lower_square_sum[d] = 0.0;
+            lower_sum_compensation[d] = 0.0;
+            lower_square_sum_compensation[d] = 0.0;
+        }
+
+        //Loop over and evaluate random points in the region
+        for(unsigned int i = local_id; i < region_calls[r]; i += local_size)
+        {
+            //Generate a random point in the region
+            float4 phase_space[$n_blocks];
+            for(unsigned int p = 0; p < $n_blocks; p++)
+            {
+                phase_space[p] = random_float4(&random_state);
+            }
+            float x[$n_args];
+            #for $d in xrange(0, $n_args)
+            x[$d] = lower[$d] + phase_space[${$d / 4}].${struct_accessors[$d % 4]} * (upper[$d] - lower[$d]);
+            #end for
+
+            //Evaluate the point
+            #set $variable_specs = ["x[%i] * (%s - %s) + %s" % (i, $integrator.evaluation_function.argument_names[2*i + 1], $integrator.evaluation_function.argument_names[2*i], $integrator.evaluation_function.argument_names[2*i]) for i in xrange(0, $n_args)]
+            accumulator_t value = ${integrator.integrand.name}(
+                ${",\n".join($variable_specs)}
+            );
+            accumulator_t square_value = value * value;
+            private_count++;
+            accumulate(&private_sum, &private_sum_compensation, value);
+            accumulate(&private_square_sum, &private_square_sum_compensation, square_value);
+
+            //Record the value in the lower half statistics
+            //of each dimension where it applies
+            for(unsigned int d = 0; d < $n_args; d++)
+            {
+                if(x[d] < 0.5 * (lower[d] + upper[d]))
+                {
+                    lower_count[d]++;
+                    accumulate(&lower_sum[d], &lower_sum_compensation[d], value);
+                    accumulate(&lower_square_sum[d], &lower_square_sum_compensation[d], square_value);
+                }
+            }
+        }
+
+        //Combine the private counts
+        atomic_add(local_counts, private_count);
+        for(unsigned int d = 0; d < $n_args; d++)
+        {
+            atomic_add(local_counts + 1 + d, lower_count[d]);
+        }
+
+        //Combine the private sums, one pair at a time, in
+        //the same way as the other kernels
+        for(unsigned int s = 0; s < $count_size; s++)
+        {
+            local_sums[local_id] = s == 0 ? private_sum : lower_sum[s - 1];
+            local_square_sums[local_id] = s == 0 ? private_square_sum : lower_square_sum[s - 1];
+            barrier(CLK_LOCAL_MEM_FENCE);
+            reduce_local_sums(local_sums, local_square_sums);
+            if(local_id == 0)
+            {
+                region_sums[r * $sum_size + 2 * s] = local_sums[0];
+                region_sums[r * $sum_size + 2 * s + 1] = local_square_sums[0];
+            }
+            barrier(CLK_LOCAL_MEM_FENCE);
+        }
+
+        //Store the region's counts
+        for(unsigned int i = local_id; i < $count_size; i += local_size)
+        {
+            region_counts[r * $count_size + i] = local_counts[i];
+        }
+        barrier(CLK_LOCAL_MEM_FENCE);
+    }
+
+    //Finish with the random number generator
+    random_finish(&random_state, random_source);
 }
@@ -7,6 +7,14 @@
 \#include <cstdio>
 \#include <ctime>
 \#include <cmath>
+\#include <string>
+\#include <cerrno>
+
+//POSIX includes (for the program cache and autotuning)
+\#include <sys/types.h>
+\#include <sys/stat.h>
+\#include <sys/time.h>
+\#include <unistd.h>
 
 #if len($integrator.integrand.include_dependencies) > 0
 //Depedency includes
@@ -76,74 +84,114 @@ using namespace std;
 
 #define RANLUXCL_STATE_SIZE 112
 
-${integrator.name}::${integrator.name}() :
+//The number of work groups launched per compute unit on
+//devices without a profile, and the numbers tried by
+//autotune
+#define DEFAULT_CONCURRENT_WORK_GROUPS 2
+#define MAX_CONCURRENT_WORK_GROUPS 16
+
+//These must match the values used in the OpenCL kernels
+#define MAX_WORK_GROUP_SIZE 1024
+#define VEGAS_BINS 50
+
+//The fewest calls in a Vegas iteration, which needs two to
+//estimate its variance
+#define VEGAS_MIN_ITERATION_CALLS 2
+
+//The maximum number of Miser regions sampled per launch,
+//and the number of sums and counts of results for each
+#define MISER_MAX_REGIONS 4096
+#define MISER_SUM_SIZE (2 + 2 * $integrator.n_dimensions)
+#define MISER_COUNT_SIZE (1 + $integrator.n_dimensions)
+
+${integrator.name}::${integrator.name}(DeviceSelection device_selection, 
+                                     bool profiling, 
+                                     FeynmanOpenClRuntime *runtime) :
 _monte_carlo_type(${integrator.name}::MonteCarloPlain),
 _n_calls(500000),
+_target_relative_error(0.0),
+_max_calls(50000000),
+_time_budget(0.0),
+_progress_callback(NULL),
+_progress_data(NULL),
+_progress_calls(0),
+_batch_calls(0),
+_stop_requested(false),
 _platform(NULL),
 _device(NULL),
 _compute_units(0),
-_max_concurrent_work_groups(0),
 _context(NULL),
 _command_queue(NULL),
 _program(NULL),
-_mem_set(NULL),
+_profiling(profiling),
 _rng_init(NULL),
 _rng_init_work_group_size(0),
-_plain(NULL),
-_plain_work_group_size(0),
-_plain_work_item_count(0),
-_plain_rng_states(NULL),
+_random_seed((cl_uint)time(NULL)),
+#if $integrator.rng == "philox"
+_random_launches(0),
+#else
+_random_seeds_used(0),
+#end if
+_devices(),
 _miser(NULL),
 _miser_work_group_size(0),
 _miser_work_item_count(0),
-_miser_rng_states(NULL),
+_miser_regions(NULL),
+_miser_region_calls(NULL),
+_miser_region_sums(NULL),
+_miser_region_counts(NULL),
+_miser_estimate_fraction(0.1),
+_miser_min_calls(16 * $integrator.n_dimensions),
+_miser_min_calls_per_bisection(32 * 16 * $integrator.n_dimensions),
+_miser_alpha(2.0),
 _vegas(NULL),
 _vegas_work_group_size(0),
 _vegas_work_item_count(0),
-_vegas_rng_states(NULL),
-_output(NULL)
+_vegas_grid(NULL),
+_vegas_histograms(NULL),
+_vegas_host_grid(),
+_vegas_host_histograms(),
+_vegas_iterations(5),
+_vegas_warmup_calls(10000),
+_vegas_chisq(0.0),
+_quasi(NULL),
+_quasi_work_group_size(0),
+_quasi_work_item_count(0),
+_quasi_randomizations(8),
+_quasi_seed(_random_seed | 1),
+_output(NULL),
+_host_output(),
+_pending(),
+_profile_events(),
+_profile_stages()
 {
+    //Profiling can also be turned on from the environment,
+    //without changing the program
+    const char *profile_variable = getenv("FEYNMAN_OPENCL_PROFILE");
+    if(profile_variable != NULL && profile_variable[0] != '\0' && string(profile_variable) != "0")
+    {
+        _profiling = true;
+    }
+
+    //Without a runtime to attach to, use a private one,
+    //which lives until the resources have been grabbed (the
+    //integrator holds its own references to them)
+    FeynmanOpenClRuntime private_runtime;
+    FeynmanOpenClRuntime &resources = runtime != NULL ? *runtime : private_runtime;
+
     //Grab all available platforms
-    cl_uint num_platforms;
-    CHECK_CL_OPERATION(clGetPlatformIDs(0, NULL, &num_platforms),
-                       "Unable to get platform count");
-    if(num_platforms == 0)
+    vector<cl_platform_id> platforms;
+    CHECK_CL_OPERATION(resources.platforms(platforms), "Unable to find a valid platform");
+    if(platforms.empty())
     {
         fprintf(stderr, "ERROR: Unable to find any OpenCL platform\n");
         exit(EXIT_FAILURE);
     }
-    vector<cl_platform_id> platforms(num_platforms, NULL);
-    CHECK_CL_OPERATION(clGetPlatformIDs(num_platforms, &platforms[0], NULL),
-                       "Unable to find a valid platform");
-
-    //Try to find a device by type preference
-    cl_device_type preferred_device_types[] = {
-        CL_DEVICE_TYPE_GPU,
-        CL_DEVICE_TYPE_CPU,
-        CL_DEVICE_TYPE_ACCELERATOR,
-        CL_DEVICE_TYPE_DEFAULT,
-        CL_DEVICE_TYPE_ALL
-    };
-    int i = 0;
-    int n_device_types = sizeof(preferred_device_types)/sizeof(cl_device_type);
-    cl_int error = CL_DEVICE_NOT_FOUND;
-    while(error == CL_DEVICE_NOT_FOUND
-          && i < n_device_types)
-    {
-        vector<cl_platform_id>::iterator plat_it;
-        for(plat_it = platforms.begin();
-            plat_it != platforms.end();
-            plat_it++)
-        {
-            error = clGetDeviceIDs(*plat_it, preferred_device_types[i], 1, &_device, NULL);
-            if(error != CL_DEVICE_NOT_FOUND)
-            {
-                _platform = *plat_it;
-                break;
-            }
-        }
-    }
-    CHECK_CL_OPERATION(error, "Unable to find a valid compute device");
+
+    //Find the best device
+    CHECK_CL_OPERATION(resources.best_device(&_platform, &_device), 
+                       "Unable to find a valid compute device");
+    cl_int error;
 
     //Query the device's compute units
     CHECK_CL_OPERATION(clGetDeviceInfo(_device,
@@ -152,68 +200,41 @@ _output(NULL)
                                        &_compute_units,
                                        NULL),
                        "Unable to query device compute unit count");
-    _max_concurrent_work_groups = 2; //TODO: Find a way to query this
-
-    //Create a compute context
-    _context = clCreateContext(0, 1, &_device, NULL, NULL, &error);
-    CHECK_CL_OPERATION(error, "Unable to create a compute context");
 
-    //Create a command queue
-    _command_queue = clCreateCommandQueue(_context, _device, 0, &error);
-    CHECK_CL_OPERATION(error, "Unable to create a command queue");
-
-    //Compile the OpenCL code
-    const char *strings[] = {
-        $integrator.name::_fixes_source,
-        $integrator.name::_ranlux_source,
-        $integrator.name::_initialization_source,
-        $integrator.name::_integrand_source,
-        $integrator.name::_plain_source,
-        $integrator.name::_miser_source,
-        $integrator.name::_vegas_source
-    };
-    cl_uint n_sources = sizeof(strings)/sizeof(const char *);
-    _program = clCreateProgramWithSource(_context,
-                                         n_sources,
-                                         strings,
-                                         NULL,
-                                         &error);
-    CHECK_CL_OPERATION(error, "Unable to create the OpenCL program");
-    error = clBuildProgram(_program, 
-                           0,
-                           NULL,
-                           NULL,
-                           NULL,
-                           NULL);
-    if(error != CL_SUCCESS)
+#if $integrator.accumulation == "double"
+    //Make sure the device can accumulate in double precision
+    if(!_supports_accumulation(_device))
     {
-        //Unable to build (compile) the OpenCL program
-        size_t length;
-        char buffer[2048];
+        fprintf(stderr, "ERROR: The compute device does not support double precision " \
+                        "accumulation (cl_khr_fp64)\n");
+        exit(EXIT_FAILURE);
+    }
+#end if
 
-        CHECK_CL_OPERATION(clGetProgramBuildInfo(_program, 
-                                                 _device, 
-                                                 CL_PROGRAM_BUILD_LOG, 
-                                                 sizeof(buffer), 
-                                                 buffer, 
-                                                 &length),
-                           "Build failure.  Unable to get build failure information");
+    //Grab a compute context
+    _context = resources.context(_device, &error);
+    CHECK_CL_OPERATION(error, "Unable to create a compute context");
 
-        printf("ERROR: Unable to build (compile) the OpenCL program (%i):\n%s\n", error, buffer);
+    //Create a command queue.  When work is split between
+    //devices, kernels are timed to measure the throughput
+    //of each device.
+    cl_command_queue_properties queue_properties = 0;
+    if(device_selection == AllDevices || _profiling)
+    {
+        queue_properties = CL_QUEUE_PROFILING_ENABLE;
     }
-    CHECK_CL_OPERATION(error, "Unable to compile OpenCL source");
+    _command_queue = resources.command_queue(_device, queue_properties, &error);
+    CHECK_CL_OPERATION(error, "Unable to create a command queue");
+
+    //Compile (or load) the OpenCL code
+    _program = _runtime_program(resources, _platform, _device, _context);
 
-    //Grab out all kernels from the program
+#if $integrator.rng == "ranlux"
+    //Grab the random number generator initialization
+    //kernel (the integration kernels are created by
+    //_prepare, when their types are first used)
     _rng_init = clCreateKernel(_program, "random_initialize", &error);
     CHECK_CL_OPERATION(error, "Unable to create initialization kernel");
-    _mem_set = clCreateKernel(_program, "mem_set", &error);
-    CHECK_CL_OPERATION(error, "Unable to create memory setting kernel");
-    _plain = clCreateKernel(_program, "plain_integrate", &error);
-    CHECK_CL_OPERATION(error, "Unable to create plain Monte Carlo integration kernel");
-    _miser = clCreateKernel(_program, "miser_integrate", &error);
-    CHECK_CL_OPERATION(error, "Unable to create miser Monte Carlo integration kernel");
-    _vegas = clCreateKernel(_program, "vegas_integrate", &error);
-    CHECK_CL_OPERATION(error, "Unable to create vegas Monte Carlo integration kernel");
 
     //Configure the random number generation intialization
     //kernel.
@@ -225,29 +246,104 @@ _output(NULL)
                                                 NULL),
                        "Unable to determine preferred kernel work group size multiple for " \
                        "random number generator initialization.");
+#end if
 
-    //Configure kernel execution parameters
-    _configure_kernels();
+    //Set up the devices for plain integration, starting
+    //with this one
+    _add_device(resources, _platform, _device);
+    if(device_selection == AllDevices)
+    {
+        for(size_t p = 0; p < platforms.size(); p++)
+        {
+            cl_uint n_devices = 0;
+            if(clGetDeviceIDs(platforms[p], CL_DEVICE_TYPE_ALL, 0, NULL, &n_devices) != CL_SUCCESS
+               || n_devices == 0)
+            {
+                continue;
+            }
+            vector<cl_device_id> devices(n_devices, NULL);
+            CHECK_CL_OPERATION(clGetDeviceIDs(platforms[p], 
+                                              CL_DEVICE_TYPE_ALL, 
+                                              n_devices, 
+                                              &devices[0], 
+                                              NULL),
+                               "Unable to list platform devices");
+            for(size_t d = 0; d < devices.size(); d++)
+            {
+                //Some ICD loaders list a platform more than
+                //once, so skip devices which are already used
+                bool used = false;
+                for(size_t u = 0; u < _devices.size(); u++)
+                {
+                    used = used || _devices[u].device == devices[d];
+                }
+                cl_bool available = CL_FALSE;
+                clGetDeviceInfo(devices[d], CL_DEVICE_AVAILABLE, sizeof(available), &available, NULL);
+                if(!used && available && _supports_accumulation(devices[d]))
+                {
+                    _add_device(resources, platforms[p], devices[d]);
+                }
+            }
+        }
+    }
 
-    //Create the global output buffer
-    _output = clCreateBuffer(_context, CL_MEM_WRITE_ONLY, 2 * sizeof(float), NULL, &error);
-    CHECK_CL_OPERATION(error, "Unable to create output buffer");
+    //The integration types are set up when they are first
+    //used (see _prepare), so that integrators only pay for
+    //the types they use
 }
 
 ${integrator.name}::~${integrator.name}()
 {
+    for(size_t i = 0; i < _pending.size(); i++)
+    {
+        for(size_t r = 0; r < _pending[i]->runs.size(); r++)
+        {
+            PendingRun &run = _pending[i]->runs[r];
+            if(run.read_event != NULL)
+            {
+                clWaitForEvents(1, &run.read_event);
+                clReleaseEvent(run.read_event);
+            }
+            if(run.kernel_event != NULL)
+            {
+                clReleaseEvent(run.kernel_event);
+            }
+            RELEASE_CL_MEMORY_SAFE(run.output);
+            RELEASE_CL_MEMORY_SAFE(run.bounds);
+        }
+        delete _pending[i];
+    }
+    for(size_t i = 0; i < _profile_events.size(); i++)
+    {
+        clReleaseEvent(_profile_events[i].event);
+    }
+
     RELEASE_CL_MEMORY_SAFE(_output);
 
-    RELEASE_CL_MEMORY_SAFE(_vegas_rng_states);
+    RELEASE_CL_KERNEL_SAFE(_quasi);
+
+    RELEASE_CL_MEMORY_SAFE(_vegas_histograms);
+    RELEASE_CL_MEMORY_SAFE(_vegas_grid);
     RELEASE_CL_KERNEL_SAFE(_vegas);
 
-    RELEASE_CL_MEMORY_SAFE(_miser_rng_states);
+    RELEASE_CL_MEMORY_SAFE(_miser_region_counts);
+    RELEASE_CL_MEMORY_SAFE(_miser_region_sums);
+    RELEASE_CL_MEMORY_SAFE(_miser_region_calls);
+    RELEASE_CL_MEMORY_SAFE(_miser_regions);
     RELEASE_CL_KERNEL_SAFE(_miser);
 
-    RELEASE_CL_MEMORY_SAFE(_plain_rng_states);
-    RELEASE_CL_KERNEL_SAFE(_plain);
+    for(size_t i = 0; i < _devices.size(); i++)
+    {
+        //The first device shares the resources below, but
+        //holds its own references to them
+        RELEASE_CL_KERNEL_SAFE(_devices[i].plain);
+        RELEASE_CL_MEMORY_SAFE(_devices[i].rng_states);
+        RELEASE_CL_KERNEL_SAFE(_devices[i].rng_init);
+        RELEASE_CL_PROGRAM_SAFE(_devices[i].program);
+        RELEASE_CL_COMMAND_QUEUE_SAFE(_devices[i].command_queue);
+        RELEASE_CL_CONTEXT_SAFE(_devices[i].context);
+    }
     
-    RELEASE_CL_KERNEL_SAFE(_mem_set);
     RELEASE_CL_KERNEL_SAFE(_rng_init);
     
     RELEASE_CL_PROGRAM_SAFE(_program);
@@ -267,6 +363,11 @@ ${integrator.name}::MonteCarloType ${integrator.name}::monte_carlo_type()
 
 void ${integrator.name}::set_n_calls(int n)
 {
+    if(n < 1)
+    {
+        fprintf(stderr, "ERROR: The number of calls must be positive (got %d)\n", n);
+        return;
+    }
     _n_calls = n;
 }
 
@@ -275,231 +376,2395 @@ int ${integrator.name}::n_calls()
     return _n_calls;
 }
 
-$integrator.evaluation_function.return_type ${integrator.name}::operator()($integrator.evaluation_function.argument_signature, $integrator.evaluation_function.return_type *error)
+void ${integrator.name}::set_target_relative_error(double e)
 {
-    //Boilerplate variables
-    cl_int _error;
-    cl_uint points_per_work_item;
-    cl_uint total_n_calls;
-    
-    //Queue the memset kernel
-    _enqueue_output_buffer_clear();
+    _target_relative_error = e;
+}
 
-    //Enqueue the appropriate kernel
-    if(_monte_carlo_type == MonteCarloPlain)
+double ${integrator.name}::target_relative_error()
+{
+    return _target_relative_error;
+}
+
+void ${integrator.name}::set_max_calls(int n)
+{
+    _max_calls = n;
+}
+
+int ${integrator.name}::max_calls()
+{
+    return _max_calls;
+}
+
+void ${integrator.name}::set_time_budget(double seconds)
+{
+    _time_budget = seconds;
+}
+
+double ${integrator.name}::time_budget()
+{
+    return _time_budget;
+}
+
+int ${integrator.name}::n_devices()
+{
+    return _devices.size();
+}
+
+void ${integrator.name}::set_progress_callback(ProgressCallback callback, void *data)
+{
+    _progress_callback = callback;
+    _progress_data = data;
+}
+
+double ${integrator.name}::chisq()
+{
+    return _vegas_chisq;
+}
+
+bool ${integrator.name}::profiling()
+{
+    return _profiling;
+}
+
+vector<${integrator.name}::ProfileStage> ${integrator.name}::profile()
+{
+    _collect_profile_events();
+    return _profile_stages;
+}
+
+string ${integrator.name}::profile_json()
+{
+    _collect_profile_events();
+    char buffer[256];
+    string json = "{\"device\": ";
+    char device_name[256];
+    device_name[0] = '\0';
+    clGetDeviceInfo(_device, CL_DEVICE_NAME, sizeof(device_name), device_name, NULL);
+    device_name[sizeof(device_name) - 1] = '\0';
+    _append_json_string(json, device_name);
+    snprintf(buffer, 
+             sizeof(buffer), 
+             ", \"profiling\": %s, \"n_calls\": %d, \"devices\": [", 
+             _profiling ? "true" : "false", 
+             _n_calls);
+    json += buffer;
+
+    //The devices used for plain integrations, with their
+    //work sizes
+    for(size_t i = 0; i < _devices.size(); i++)
     {
-        points_per_work_item = _n_calls / _plain_work_item_count;
-        if(_n_calls % _plain_work_item_count)
-        {
-            points_per_work_item++;
-        }
-        total_n_calls = points_per_work_item * _plain_work_item_count;
-        CHECK_CL_OPERATION(clSetKernelArg(_plain, 0, sizeof(cl_uint), &points_per_work_item), 
-                           "Unable to set number of integration points");
-        CHECK_CL_OPERATION(clSetKernelArg(_plain, 1, sizeof(cl_mem), &_plain_rng_states), 
-                           "Couldn't set random number state buffer");
-        CHECK_CL_OPERATION(clSetKernelArg(_plain, 2, sizeof(cl_mem), &_output), 
-                           "Couldn't set output buffer");
-        #for $i, ($a_t, $a_n) in enumerate(zip($integrator.evaluation_function.argument_types, $integrator.evaluation_function.argument_names))
-        CHECK_CL_OPERATION(clSetKernelArg(_plain, ${$i + 3}, sizeof($a_t), &$a_n), 
-                           "Couldn't set output buffer");
-        #end for
-        CHECK_CL_OPERATION(clEnqueueNDRangeKernel(_command_queue, 
-                                                  _plain, 
-                                                  1, 
-                                                  NULL, 
-                                                  &_plain_work_item_count,
-                                                  &_plain_work_group_size,
-                                                  0, 
-                                                  NULL, 
-                                                  NULL),
-                           "Unable to queue random number initialization kernel");
+        const ComputeDevice &device = _devices[i];
+        device_name[0] = '\0';
+        clGetDeviceInfo(device.device, CL_DEVICE_NAME, sizeof(device_name), device_name, NULL);
+        device_name[sizeof(device_name) - 1] = '\0';
+        json += i > 0 ? ", {\"name\": " : "{\"name\": ";
+        _append_json_string(json, device_name);
+        snprintf(buffer, 
+                 sizeof(buffer), 
+                 ", \"compute_units\": %lu, \"work_group_size\": %lu, " \
+                 "\"work_item_count\": %lu, \"concurrent_work_groups\": %lu}", 
+                 (unsigned long)device.compute_units, 
+                 (unsigned long)device.plain_work_group_size, 
+                 (unsigned long)device.plain_work_item_count, 
+                 (unsigned long)device.concurrent_work_groups);
+        json += buffer;
     }
-    else if(_monte_carlo_type == MonteCarloMiser)
+
+    //The work sizes of the other kernels, which run on the
+    //first device
+    snprintf(buffer, 
+             sizeof(buffer), 
+             "], \"kernels\": {\"miser\": [%lu, %lu], \"vegas\": [%lu, %lu], \"quasi\": [%lu, %lu]}", 
+             (unsigned long)_miser_work_group_size, 
+             (unsigned long)_miser_work_item_count, 
+             (unsigned long)_vegas_work_group_size, 
+             (unsigned long)_vegas_work_item_count, 
+             (unsigned long)_quasi_work_group_size, 
+             (unsigned long)_quasi_work_item_count);
+    json += buffer;
+
+    //The stages
+    json += ", \"stages\": [";
+    for(size_t i = 0; i < _profile_stages.size(); i++)
     {
-        printf("ERROR: Miser integration not yet implemented.\n");
-        return 0.0;
+        const ProfileStage &stage = _profile_stages[i];
+        json += i > 0 ? ", {\"name\": " : "{\"name\": ";
+        _append_json_string(json, stage.name);
+        snprintf(buffer, 
+                 sizeof(buffer), 
+                 ", \"count\": %lu, \"seconds\": %.9g, \"evaluations\": %.17g, " \
+                 "\"evaluations_per_second\": %.9g}", 
+                 stage.count, 
+                 stage.seconds, 
+                 stage.evaluations, 
+                 stage.seconds > 0.0 ? stage.evaluations / stage.seconds : 0.0);
+        json += buffer;
     }
-    else if(_monte_carlo_type == MonteCarloVegas)
+    json += "]}";
+
+    return json;
+}
+
+void ${integrator.name}::reset_profile()
+{
+    _collect_profile_events();
+    _profile_stages.clear();
+}
+
+void ${integrator.name}::autotune()
+{
+    //Integrate the unit hypercube while timing
+    bound_t bounds[${2 * $integrator.n_dimensions}] = {${", ".join(["0.0, 1.0"] * $integrator.n_dimensions)}};
+
+    for(size_t i = 0; i < _devices.size(); i++)
     {
-        printf("ERROR: Vegas integration not yet implemented.\n");
-        return 0.0;
+        ComputeDevice &device = _devices[i];
+
+        //Find the range of work group sizes for the kernel
+        size_t max_work_group_size;
+        CHECK_CL_OPERATION(clGetKernelWorkGroupInfo(device.plain,
+                                                    device.device,
+                                                    CL_KERNEL_WORK_GROUP_SIZE,
+                                                    sizeof(size_t),
+                                                    &max_work_group_size,
+                                                    NULL),
+                           "Unable to determine maximum kernel work group size");
+        size_t preferred_work_group_size_multiple;
+        CHECK_CL_OPERATION(clGetKernelWorkGroupInfo(device.plain,
+                                                    device.device,
+                                                    CL_KERNEL_PREFERRED_WORK_GROUP_SIZE_MULTIPLE,
+                                                    sizeof(size_t),
+                                                    &preferred_work_group_size_multiple,
+                                                    NULL),
+                           "Unable to determine preferred kernel work group size multiple");
+        if(max_work_group_size > MAX_WORK_GROUP_SIZE)
+        {
+            max_work_group_size = MAX_WORK_GROUP_SIZE;
+        }
+        if(preferred_work_group_size_multiple == 0)
+        {
+            preferred_work_group_size_multiple = 1;
+        }
+
+        //The candidates are doublings of the preferred multiple
+        //(and the largest multiple) for the work group size,
+        //and doublings of the number of concurrent work groups
+        vector<size_t> work_group_sizes;
+        for(size_t size = preferred_work_group_size_multiple; 
+            size <= max_work_group_size; 
+            size *= 2)
+        {
+            work_group_sizes.push_back(size);
+        }
+        size_t largest_work_group_size = max_work_group_size 
+                                         - max_work_group_size % preferred_work_group_size_multiple;
+        if(largest_work_group_size == 0)
+        {
+            //The preferred multiple is larger than the kernel
+            //allows, so just use the largest size it does
+            largest_work_group_size = max_work_group_size;
+        }
+        if(work_group_sizes.empty() || work_group_sizes.back() != largest_work_group_size)
+        {
+            work_group_sizes.push_back(largest_work_group_size);
+        }
+        vector<size_t> concurrent_work_groups;
+        for(size_t n = 1; n <= MAX_CONCURRENT_WORK_GROUPS; n *= 2)
+        {
+            concurrent_work_groups.push_back(n);
+        }
+
+        PendingRun run;
+        _reserve_run_buffers(device, run, ${2 * $integrator.n_dimensions}, 0);
+        CHECK_CL_OPERATION(clEnqueueWriteBuffer(device.command_queue,
+                                                run.bounds,
+                                                CL_TRUE,
+                                                0,
+                                                sizeof(bounds),
+                                                bounds,
+                                                0,
+                                                NULL,
+                                                NULL),
+                           "Unable to write integration bound buffer");
+
+        //Rather than timing every combination, search one at
+        //a time: first the number of concurrent work groups,
+        //with the largest work groups, and then the work group
+        //size, with the best number of concurrent work groups
+        double best_time = -1.0;
+        size_t best_work_group_size = largest_work_group_size;
+        size_t best_concurrent_work_groups = device.concurrent_work_groups;
+        for(int pass = 0; pass < 2; pass++)
+        {
+            size_t n_candidates = pass == 0 ? concurrent_work_groups.size() : work_group_sizes.size();
+            size_t work_group_size = best_work_group_size;
+            for(size_t c = 0; c < n_candidates; c++)
+            {
+                if(pass == 0)
+                {
+                    device.work_group_size_limit = work_group_size;
+                    device.concurrent_work_groups = concurrent_work_groups[c];
+                }
+                else
+                {
+                    device.work_group_size_limit = work_group_sizes[c];
+                    device.concurrent_work_groups = best_concurrent_work_groups;
+                }
+                _configure_kernel(device,
+                                  device.plain,
+                                  &device.plain_work_group_size,
+                                  &device.plain_work_item_count);
+                _reserve_rng_states(device, device.plain_work_item_count);
+                double time = _time_plain_kernel(device, run);
+                if(best_time < 0.0 || time < best_time)
+                {
+                    best_time = time;
+                    best_work_group_size = device.work_group_size_limit;
+                    best_concurrent_work_groups = device.concurrent_work_groups;
+                }
+            }
+        }
+        RELEASE_CL_MEMORY_SAFE(run.output);
+        RELEASE_CL_MEMORY_SAFE(run.bounds);
+
+        //Keep the winner, and drop the random number
+        //generator states sized for the candidates
+        device.work_group_size_limit = best_work_group_size;
+        device.concurrent_work_groups = best_concurrent_work_groups;
+        _save_profile(device);
+        RELEASE_CL_MEMORY_SAFE(device.rng_states);
+        device.rng_state_count = 0;
     }
-    else
+
+    //Have the types which have been used reconfigured for
+    //the winners when they are next used
+    for(size_t i = 0; i < _devices.size(); i++)
     {
-        printf("ERROR: Unknown integration type.\n");
-        return 0.0;
+        _devices[i].plain_work_item_count = 0;
     }
+    _miser_work_item_count = 0;
+    _vegas_work_item_count = 0;
+    _quasi_work_item_count = 0;
+}
+
+$integrator.evaluation_function.return_type ${integrator.name}::operator()($integrator.evaluation_function.argument_signature, $integrator.evaluation_function.return_type *error)
+{
+    gettimeofday(&_progress_start, NULL);
+    _progress_calls = 0;
+    _stop_requested = false;
 
-    //Enqueue the answer copy
-    float result[2];
-    _enqueue_output_buffer_read(result, sizeof(result) / sizeof(float));
+    //Without a target, just integrate once
+    if(_target_relative_error <= 0.0 && _time_budget <= 0.0)
+    {
+        $integrator.evaluation_function.return_type once_error;
+        $integrator.evaluation_function.return_type once_result = _integrate(${", ".join($integrator.evaluation_function.argument_names)}, &once_error);
+        _progress_calls += _batch_calls;
+        _report_progress(_progress_calls, 
+                         once_result, 
+                         once_error, 
+                         _monte_carlo_type == MonteCarloVegas ? _vegas_chisq : 0.0);
+        if(error != NULL)
+        {
+            *error = once_error;
+        }
+        return once_result;
+    }
 
-    //Wait for all operations to finish
-    CHECK_CL_OPERATION(clFinish(_command_queue), "Unable to execute integration");
+    //Otherwise run batches, pooling them, until the target
+    //is met, a limit is hit or the progress callback stops
+    //the integration.  Every batch has the same number of
+    //calls, so the pooled result is the mean of the batch
+    //results, and its variance is the mean of the batch
+    //variances over the number of batches.  Weighting the
+    //batches by their inverse variances instead would be
+    //biased towards batches which happened to see little
+    //variation, and would lose batches which saw none.
+    struct timeval now;
+    double result_sum = 0.0;
+    double square_result_sum = 0.0;
+    double variance_sum = 0.0;
+    double result = 0.0;
+    double result_error = 0.0;
+    long total_calls = 0;
+    for(int batch = 1; ; batch++)
+    {
+        $integrator.evaluation_function.return_type batch_error;
+        $integrator.evaluation_function.return_type batch_result = _integrate(${", ".join($integrator.evaluation_function.argument_names)}, &batch_error);
+        total_calls += _n_calls;
+        _progress_calls += _batch_calls;
+        if(batch_error <= 0.0 && batch == 1)
+        {
+            //The first batch is exact (e.g. the integrand is
+            //constant), so there's nothing to add
+            result = batch_result;
+            result_error = 0.0;
+            _report_progress(_progress_calls, result, 0.0, 0.0);
+            break;
+        }
+        result_sum += batch_result;
+        square_result_sum += (double)batch_result * batch_result;
+        variance_sum += (double)batch_error * batch_error;
+        result = result_sum / batch;
+        result_error = sqrt(variance_sum) / batch;
 
-    //Calculate the total number of calls and the volume
-    float volume = ${"*".join(["(%s - %s)" % ($integrator.evaluation_function.argument_names[2*i + 1], $integrator.evaluation_function.argument_names[2*i]) for i in xrange(0, len($integrator.integrand.argument_types))])};
-    
-    //The following calculations are based upon this documentation:
-    //http://mathworld.wolfram.com/MonteCarloIntegration.html
+        //Report the combined batches, whose chi-squared
+        //checks that their spread agrees with their errors
+        //(a single batch reports its own, as without a
+        //target)
+        double chisq = _monte_carlo_type == MonteCarloVegas ? _vegas_chisq : 0.0;
+        if(batch > 1)
+        {
+            chisq = (square_result_sum - result_sum * result) / (batch - 1) 
+                    / (variance_sum / batch);
+        }
+        if(_report_progress(_progress_calls, result, result_error, chisq > 0.0 ? chisq : 0.0))
+        {
+            break;
+        }
 
-    //Calculate mean
-    float mean = volume * result[0] / ((float)total_n_calls);
+        //Stop at the target, or before another batch would
+        //exceed a limit
+        if(_target_relative_error > 0.0 && result_error <= _target_relative_error * fabs(result))
+        {
+            break;
+        }
+        if(_max_calls > 0 && total_calls + _n_calls > _max_calls)
+        {
+            break;
+        }
+        gettimeofday(&now, NULL);
+        double elapsed = (now.tv_sec - _progress_start.tv_sec) 
+                         + 1e-6 * (now.tv_usec - _progress_start.tv_usec);
+        if(_time_budget > 0.0 && elapsed * (batch + 1) / batch > _time_budget)
+        {
+            break;
+        }
+    }
 
-    //Calculate variance
-    float variance = volume * sqrt((result[1] - (result[0] * result[0] / ((float)total_n_calls))) / (((float)total_n_calls) * ((float)total_n_calls)));
     if(error != NULL)
     {
-        *error = variance;
+        *error = result_error;
     }
 
-    return mean;
+    return result;
 }
 
-void ${integrator.name}::_configure_kernels()
+bool ${integrator.name}::_report_progress(long calls, double result, double error, double chisq)
 {
-    _configure_kernel(_plain,
-                      &_plain_work_group_size,
-                      &_plain_work_item_count,
-                      &_plain_rng_states);
-    _configure_kernel(_miser,
-                      &_miser_work_group_size,
-                      &_miser_work_item_count,
-                      &_miser_rng_states);
-    _configure_kernel(_vegas,
-                      &_vegas_work_group_size,
-                      &_vegas_work_item_count,
-                      &_vegas_rng_states);
+    if(_progress_callback != NULL)
+    {
+        struct timeval now;
+        gettimeofday(&now, NULL);
+        double elapsed = (now.tv_sec - _progress_start.tv_sec) 
+                         + 1e-6 * (now.tv_usec - _progress_start.tv_usec);
+        if(_progress_callback(_progress_data, calls, result, error, chisq, elapsed) != 0)
+        {
+            _stop_requested = true;
+        }
+    }
+    return _stop_requested;
 }
 
-void ${integrator.name}::_configure_kernel(cl_kernel kernel,
-                                           size_t *work_group_size,
-                                           size_t *work_item_count,
-                                           cl_mem *rng_buffer)
+$integrator.evaluation_function.return_type ${integrator.name}::_integrate($integrator.evaluation_function.argument_signature, $integrator.evaluation_function.return_type *error)
 {
-    //Clear any prior information
-    RELEASE_CL_MEMORY_SAFE(*rng_buffer);
+    //Every type but Vegas (which may be stopped early)
+    //makes all of its calls, and only Vegas has a
+    //chi-squared
+    _batch_calls = _n_calls;
+    if(_monte_carlo_type != MonteCarloVegas)
+    {
+        _vegas_chisq = 0.0;
+    }
 
-    //Calculate the maximum work group size
-    //and preferred work group size multiple
-    //for this device and kernel
-    size_t max_work_group_size;
-    CHECK_CL_OPERATION(clGetKernelWorkGroupInfo(kernel,
-                                                _device,
-                                                CL_KERNEL_WORK_GROUP_SIZE,
-                                                sizeof(size_t),
-                                                &max_work_group_size,
-                                                NULL),
-                       "Unable to determine maximum kernel work group size");
+    //Set the type up, if this is its first use
+    _prepare(_monte_carlo_type);
 
-    size_t preferred_work_group_size_multiple;
-    CHECK_CL_OPERATION(clGetKernelWorkGroupInfo(kernel,
-                                                _device,
-                                                CL_KERNEL_PREFERRED_WORK_GROUP_SIZE_MULTIPLE,
-                                                sizeof(size_t),
-                                                &preferred_work_group_size_multiple,
-                                                NULL),
-                       "Unable to determine preferred kernel work group size multiple");
+    //Calculate the volume
+    float volume = ${"*".join(["(%s - %s)" % ($integrator.evaluation_function.argument_names[2*i + 1], $integrator.evaluation_function.argument_names[2*i]) for i in xrange(0, len($integrator.integrand.argument_types))])};
 
-    //Run the work group size up until <= to the maximum
-    *work_group_size = preferred_work_group_size_multiple;
-    while(*work_group_size <= max_work_group_size)
+    //Run the appropriate integration
+    if(_monte_carlo_type == MonteCarloPlain)
     {
-        *work_group_size += preferred_work_group_size_multiple;
+        //Run the integration as a batch of one, on the
+        //devices
+        double bounds[${2 * $integrator.n_dimensions}] = {${", ".join($integrator.evaluation_function.argument_names)}};
+        $integrator.evaluation_function.return_type result;
+        wait_batch(_start_batch(1, bounds, false), &result, error);
+        return result;
     }
-    *work_group_size -= preferred_work_group_size_multiple;
+    else if(_monte_carlo_type == MonteCarloMiser)
+    {
+        //Set the integration bounds, which are shared by
+        //all regions
+        #for $i, ($a_t, $a_n) in enumerate(zip($integrator.evaluation_function.argument_types, $integrator.evaluation_function.argument_names))
+        CHECK_CL_OPERATION(clSetKernelArg(_miser, ${$i + 6}, sizeof($a_t), &$a_n), 
+                           "Couldn't set integration bound");
+        #end for
 
-    //Calculate the global work item count
-    *work_item_count = _compute_units * (*work_group_size) * _max_concurrent_work_groups;
+        //Create the work queue with the whole integration
+        //region (in unit hypercube coordinates)
+        vector<MiserRegion> queue;
+        MiserRegion whole;
+        for(int d = 0; d < $integrator.n_dimensions; d++)
+        {
+            whole.lower[d] = 0.0;
+            whole.upper[d] = 1.0;
+        }
+        whole.calls = _n_calls;
+        queue.push_back(whole);
 
-    //Create the random number buffer
-    cl_int error;
-    *rng_buffer = clCreateBuffer(_context,
-                                 CL_MEM_READ_WRITE, 
-                                 (*work_item_count) * RANLUXCL_STATE_SIZE, 
-                                 NULL, 
-                                 &error);
-    CHECK_CL_OPERATION(error, "Unable to create random number generator state buffer");
+        //The device can't recurse, so instead we sample
+        //batches of regions from the queue, bisecting the
+        //regions with enough calls (and pushing their 
+        //halves back on the queue) and summing the results
+        //of the rest.  This is the same algorithm used by
+        //GSL.
+        double beta = 2.0 / (1.0 + _miser_alpha);
+        double miser_result = 0.0;
+        double miser_variance = 0.0;
+        vector<MiserRegion> batch;
+        vector<accumulator_t> sums;
+        vector<cl_uint> counts;
+        while(!queue.empty())
+        {
+            //Grab a batch of regions
+            size_t batch_size = queue.size() < MISER_MAX_REGIONS ? queue.size() : MISER_MAX_REGIONS;
+            batch.assign(queue.end() - batch_size, queue.end());
+            queue.resize(queue.size() - batch_size);
 
-    //Print some information
-    // printf("--------\n");
-    // printf("Work Group Size: %zu\n", *work_group_size);
-    // printf("Work Item Count: %zu\n", *work_item_count);
-    // printf("RNG Buffer: %p\n", rng_buffer);
-    // printf("RNG Init Work Group Size: %zu\n", _rng_init_work_group_size);
-    // printf("--------\n");
+            //Sample them
+            _miser_sample_regions(batch, sums, counts);
 
-    //Initialize the random number buffer
-    //Run the random number initialization kernel
-    cl_uint seed;
-    time_t t;
-    time(&t);
-    seed = t;
-    
-    CHECK_CL_OPERATION(clSetKernelArg(_rng_init, 0, sizeof(seed), &seed), 
-                       "Unable to set random number seed");
-    CHECK_CL_OPERATION(clSetKernelArg(_rng_init, 1, sizeof(cl_mem), rng_buffer), 
-                       "Couldn't set random number state buffer");
-    //HACK: Technically the work item counts for the integration kernel
-    //might not jive with the random number generator initialization
-    //kernel work group size, but I'm not going to bother fixing this
-    //until it becomes a problem.
-    CHECK_CL_OPERATION(clEnqueueNDRangeKernel(_command_queue, 
-                                              _rng_init, 
-                                              1, 
-                                              NULL, 
-                                              work_item_count,
-                                              &_rng_init_work_group_size,
-                                              0, 
-                                              NULL, 
-                                              NULL),
-                       "Unable to queue random number initialization kernel");
-    CHECK_CL_OPERATION(clFinish(_command_queue), 
-                       "Unable to execute random number initialization kernel");
+            for(size_t r = 0; r < batch.size(); r++)
+            {
+                const MiserRegion &region = batch[r];
+                const accumulator_t *region_sums = &sums[r * MISER_SUM_SIZE];
+                const cl_uint *region_counts = &counts[r * MISER_COUNT_SIZE];
+                double n = region_counts[0];
+                double sum = region_sums[0];
+                double square_sum = region_sums[1];
+
+                if(region.calls < (cl_uint)_miser_min_calls_per_bisection)
+                {
+                    //The region was integrated, so record the
+                    //result, scaled by the region's volume
+                    double region_volume = 1.0;
+                    for(int d = 0; d < $integrator.n_dimensions; d++)
+                    {
+                        region_volume *= region.upper[d] - region.lower[d];
+                    }
+                    double mean = sum / n;
+                    double variance = square_sum / n - mean * mean;
+                    if(variance < 0.0)
+                    {
+                        variance = 0.0;
+                    }
+                    miser_result += region_volume * mean;
+                    miser_variance += region_volume * region_volume * variance / n;
+                    continue;
+                }
+
+                //Choose the dimension whose bisection gives the
+                //smallest sum of half-region standard deviations
+                int best_dimension = -1;
+                double best_weight = 0.0;
+                double best_sigma_lower = 0.0;
+                double best_sigma_upper = 0.0;
+                for(int d = 0; d < $integrator.n_dimensions; d++)
+                {
+                    double n_lower = region_counts[1 + d];
+                    double sum_lower = region_sums[2 + 2 * d];
+                    double square_sum_lower = region_sums[3 + 2 * d];
+                    double n_upper = n - n_lower;
+                    double sum_upper = sum - sum_lower;
+                    double square_sum_upper = square_sum - square_sum_lower;
+                    if(n_lower < 2.0 || n_upper < 2.0)
+                    {
+                        continue;
+                    }
+
+                    double mean_lower = sum_lower / n_lower;
+                    double mean_upper = sum_upper / n_upper;
+                    double variance_lower = square_sum_lower / n_lower - mean_lower * mean_lower;
+                    double variance_upper = square_sum_upper / n_upper - mean_upper * mean_upper;
+                    double sigma_lower = variance_lower > 0.0 ? sqrt(variance_lower) : 0.0;
+                    double sigma_upper = variance_upper > 0.0 ? sqrt(variance_upper) : 0.0;
+                    double weight = pow(sigma_lower, beta) + pow(sigma_upper, beta);
+                    if(best_dimension < 0 || weight <= best_weight)
+                    {
+                        best_dimension = d;
+                        best_weight = weight;
+                        best_sigma_lower = sigma_lower;
+                        best_sigma_upper = sigma_upper;
+                    }
+                }
+                if(best_dimension < 0)
+                {
+                    //Not enough points landed in each half, so
+                    //just split the widest dimension evenly
+                    best_dimension = 0;
+                    for(int d = 1; d < $integrator.n_dimensions; d++)
+                    {
+                        if(region.upper[d] - region.lower[d] 
+                           > region.upper[best_dimension] - region.lower[best_dimension])
+                        {
+                            best_dimension = d;
+                        }
+                    }
+                    best_sigma_lower = 0.0;
+                    best_sigma_upper = 0.0;
+                }
+
+                //Allocate the remaining calls between the halves
+                cl_uint remaining_calls = region.calls - _miser_sample_calls(region.calls);
+                cl_uint lower_calls;
+                double a = 0.5 * pow(best_sigma_lower, beta);
+                double b = 0.5 * pow(best_sigma_upper, beta);
+                if(a + b > 0.0)
+                {
+                    lower_calls = _miser_min_calls 
+                                  + (cl_uint)((remaining_calls - 2 * _miser_min_calls) * a / (a + b));
+                }
+                else
+                {
+                    lower_calls = remaining_calls / 2;
+                }
+
+                //Queue up the halves
+                float middle = 0.5 * (region.lower[best_dimension] + region.upper[best_dimension]);
+                MiserRegion lower = region;
+                lower.upper[best_dimension] = middle;
+                lower.calls = lower_calls;
+                queue.push_back(lower);
+                MiserRegion upper = region;
+                upper.lower[best_dimension] = middle;
+                upper.calls = remaining_calls - lower_calls;
+                queue.push_back(upper);
+            }
+        }
+
+        if(error != NULL)
+        {
+            *error = volume * sqrt(miser_variance);
+        }
+
+        return volume * miser_result;
+    }
+    else if(_monte_carlo_type == MonteCarloVegas)
+    {
+        //Set the integration bounds, which are shared by
+        //all iterations
+        #for $i, ($a_t, $a_n) in enumerate(zip($integrator.evaluation_function.argument_types, $integrator.evaluation_function.argument_names))
+        CHECK_CL_OPERATION(clSetKernelArg(_vegas, ${$i + 5}, sizeof($a_t), &$a_n), 
+                           "Couldn't set integration bound");
+        #end for
+
+        //Adapt the grid, discarding the results
+        double iteration_mean, iteration_variance;
+        _vegas_reset_grid();
+        for(int i = 0; i < _vegas_iterations; i++)
+        {
+            _vegas_iteration(_vegas_iteration_calls(_vegas_warmup_calls), 
+                             &iteration_mean, 
+                             &iteration_variance);
+        }
+
+        //Run the iterations, combining their results
+        //weighted by their inverse variances.  This
+        //is the same weighting used by GSL.  The progress
+        //callback may stop the iterations early.
+        double sum_of_weights = 0.0;
+        double weighted_sum = 0.0;
+        double chi_sum = 0.0;
+        double vegas_mean = 0.0;
+        int n_iterations = 0;
+        while(n_iterations < _vegas_iterations)
+        {
+            int i = n_iterations++;
+            _vegas_iteration(_vegas_iteration_calls(_n_calls), 
+                             &iteration_mean, 
+                             &iteration_variance);
+
+            double weight;
+            if(iteration_variance > 0.0)
+            {
+                weight = 1.0 / iteration_variance;
+            }
+            else if(sum_of_weights > 0.0)
+            {
+                weight = sum_of_weights / (i + 1);
+            }
+            else
+            {
+                weight = 1.0;
+            }
+            sum_of_weights += weight;
+            weighted_sum += iteration_mean * weight;
+            chi_sum += iteration_mean * iteration_mean * weight;
+            vegas_mean = weighted_sum / sum_of_weights;
+            _batch_calls = (long)n_iterations * _vegas_iteration_calls(_n_calls);
+            if(n_iterations > 1)
+            {
+                _vegas_chisq = (chi_sum - weighted_sum * vegas_mean) / (n_iterations - 1);
+                if(_vegas_chisq < 0.0)
+                {
+                    _vegas_chisq = 0.0;
+                }
+            }
+            else
+            {
+                _vegas_chisq = 0.0;
+            }
+
+            if(_report_progress(_progress_calls + _batch_calls, 
+                                volume * vegas_mean, 
+                                volume * sqrt(1.0 / sum_of_weights), 
+                                _vegas_chisq))
+            {
+                break;
+            }
+        }
+
+        if(error != NULL)
+        {
+            *error = volume * sqrt(1.0 / sum_of_weights);
+        }
+
+        return volume * vegas_mean;
+    }
+    else if(_monte_carlo_type == MonteCarloQuasi)
+    {
+        //Set the integration bounds, which are shared by
+        //all randomizations
+        #for $i, ($a_t, $a_n) in enumerate(zip($integrator.evaluation_function.argument_types, $integrator.evaluation_function.argument_names))
+        CHECK_CL_OPERATION(clSetKernelArg(_quasi, ${$i + 4}, sizeof($a_t), &$a_n), 
+                           "Couldn't set integration bound");
+        #end for
+
+        //Split the calls between the randomizations (with
+        //fewer randomizations if there are too few calls to
+        //go around), giving the first _n_calls % 
+        //n_randomizations of them an extra call.  Small
+        //integrations are launched on fewer work groups.
+        int n_randomizations = _n_calls < _quasi_randomizations ? 
+                               (_n_calls > 0 ? _n_calls : 1) : 
+                               _quasi_randomizations;
+        vector<cl_uint> calls(n_randomizations, _n_calls / n_randomizations);
+        for(int r = 0; r < _n_calls % n_randomizations; r++)
+        {
+            calls[r]++;
+        }
+        size_t launch_size = _launch_size(_quasi_work_item_count, _quasi_work_group_size, calls[0]);
+        size_t n_groups = launch_size / _quasi_work_group_size;
+        _reserve_output(n_randomizations * n_groups);
+
+        //Run every randomization of the sequence, each with
+        //a fresh scrambling seed, before reading back all of
+        //the results
+        CHECK_CL_OPERATION(clSetKernelArg(_quasi, 3, sizeof(cl_mem), &_output), 
+                           "Couldn't set output buffer");
+        for(cl_uint r = 0; r < (cl_uint)n_randomizations; r++)
+        {
+            CHECK_CL_OPERATION(clSetKernelArg(_quasi, 0, sizeof(cl_uint), &calls[r]), 
+                               "Unable to set number of integration points");
+            _quasi_seed ^= _quasi_seed << 13;
+            _quasi_seed ^= _quasi_seed >> 17;
+            _quasi_seed ^= _quasi_seed << 5;
+            CHECK_CL_OPERATION(clSetKernelArg(_quasi, 1, sizeof(cl_uint), &_quasi_seed), 
+                               "Unable to set scrambling seed");
+            CHECK_CL_OPERATION(clSetKernelArg(_quasi, 2, sizeof(cl_uint), &r), 
+                               "Unable to set randomization");
+            CHECK_CL_OPERATION(clEnqueueNDRangeKernel(_command_queue, 
+                                                      _quasi, 
+                                                      1, 
+                                                      NULL, 
+                                                      &launch_size,
+                                                      &_quasi_work_group_size,
+                                                      0, 
+                                                      NULL, 
+                                                      _profile_event("quasi_integrate", 
+                                                                     (double)calls[r])),
+                               "Unable to queue quasi integration kernel");
+        }
+        _enqueue_output_buffer_read(n_randomizations * n_groups);
+        CHECK_CL_OPERATION(clFinish(_command_queue), "Unable to execute quasi integration");
+        _collect_profile_events();
+
+        //Each randomization gives an independent, unbiased
+        //estimate, so the spread of the estimates gives the
+        //error of their mean
+        vector<double> means(n_randomizations);
+        double quasi_mean = 0.0;
+        for(int r = 0; r < n_randomizations; r++)
+        {
+            double sum, square_sum;
+            _sum_output(&_host_output[2 * r * n_groups], n_groups, &sum, &square_sum);
+            means[r] = calls[r] > 0 ? sum / calls[r] : 0.0;
+            quasi_mean += means[r] / n_randomizations;
+        }
+        double quasi_variance = 0.0;
+        if(n_randomizations > 1)
+        {
+            for(int r = 0; r < n_randomizations; r++)
+            {
+                quasi_variance += (means[r] - quasi_mean) * (means[r] - quasi_mean);
+            }
+            quasi_variance /= n_randomizations * (n_randomizations - 1.0);
+        }
+
+        if(error != NULL)
+        {
+            *error = volume * sqrt(quasi_variance);
+        }
+
+        return volume * quasi_mean;
+    }
+    else
+    {
+        printf("ERROR: Unknown integration type.\n");
+        return 0.0;
+    }
+}
+
+void ${integrator.name}::integrate_batch(int n_integrals, 
+                                         const double *bounds, 
+                                         $integrator.evaluation_function.return_type *results, 
+                                         $integrator.evaluation_function.return_type *errors)
+{
+    wait_batch(integrate_batch_async(n_integrals, bounds), results, errors);
+}
+
+${integrator.name}::IntegrationHandle ${integrator.name}::integrate_async($integrator.evaluation_function.argument_signature)
+{
+    double bounds[${2 * $integrator.n_dimensions}] = {${", ".join($integrator.evaluation_function.argument_names)}};
+    return integrate_batch_async(1, bounds);
+}
+
+${integrator.name}::IntegrationHandle ${integrator.name}::integrate_batch_async(int n_integrals, 
+                                                                                const double *bounds)
+{
+    //Only plain integrations are run asynchronously, since
+    //Miser and Vegas adapt to each integral separately and
+    //need the host between launches, as do integrations to
+    //a target precision, which run in batches
+    bool synchronous = _monte_carlo_type != MonteCarloPlain 
+                       || _target_relative_error > 0.0 
+                       || _time_budget > 0.0;
+    IntegrationHandle handle = _start_batch(n_integrals, bounds, synchronous);
+
+    //Plain launches don't go through operator(), so have
+    //wait_batch report them instead
+    _pending[handle]->report_progress = !_pending[handle]->synchronous;
+    return handle;
+}
+
+${integrator.name}::IntegrationHandle ${integrator.name}::_start_batch(int n_integrals, 
+                                                                       const double *bounds, 
+                                                                       bool synchronous)
+{
+    //Grab a free pending integration slot.  These are
+    //allocated individually, since the device reads from
+    //and writes to their host buffers while they are in
+    //flight.
+    IntegrationHandle handle = 0;
+    while(handle < (IntegrationHandle)_pending.size() && _pending[handle]->in_use)
+    {
+        handle++;
+    }
+    if(handle == (IntegrationHandle)_pending.size())
+    {
+        _pending.push_back(new PendingIntegration());
+    }
+    PendingIntegration &pending = *_pending[handle];
+    pending.in_use = true;
+    pending.n_integrals = n_integrals > 0 ? n_integrals : 0;
+    pending.report_progress = false;
+    gettimeofday(&pending.start, NULL);
+
+    //Synchronous integrations are run now, and their
+    //handles are ready immediately
+    pending.synchronous = synchronous || n_integrals <= 0;
+    if(pending.synchronous)
+    {
+        pending.results.resize(pending.n_integrals);
+        pending.errors.resize(pending.n_integrals);
+        for(int i = 0; i < n_integrals; i++)
+        {
+            const double *integral_bounds = bounds + i * ${2 * $integrator.n_dimensions};
+            pending.results[i] = (*this)(${", ".join(["(%s)integral_bounds[%i]" % (a_t, i) for i, a_t in enumerate($integrator.evaluation_function.argument_types)])},
+                                         &pending.errors[i]);
+        }
+        return handle;
+    }
+
+    //Set up plain integration, if this is its first use,
+    //and clear the chi-squared of any earlier Vegas
+    //integration, as _integrate does
+    _prepare(MonteCarloPlain);
+    _vegas_chisq = 0.0;
+
+    //Store the volumes and convert the bounds for the
+    //devices
+    size_t n_bounds = n_integrals * ${2 * $integrator.n_dimensions};
+    pending.volumes.resize(n_integrals);
+    for(int i = 0; i < n_integrals; i++)
+    {
+        const double *integral_bounds = bounds + i * ${2 * $integrator.n_dimensions};
+        pending.volumes[i] = 1.0;
+        for(int d = 0; d < $integrator.n_dimensions; d++)
+        {
+            pending.volumes[i] *= integral_bounds[2 * d + 1] - integral_bounds[2 * d];
+        }
+    }
+    pending.host_bounds.resize(n_bounds);
+    for(size_t i = 0; i < n_bounds; i++)
+    {
+        pending.host_bounds[i] = bounds[i];
+    }
+
+    //Split the calls between the devices in proportion to
+    //their throughput
+    double total_throughput = 0.0;
+    for(size_t i = 0; i < _devices.size(); i++)
+    {
+        total_throughput += _devices[i].throughput;
+    }
+    //(splitting the running total, so that the devices'
+    //shares add up to exactly _n_calls)
+    pending.runs.resize(_devices.size());
+    double throughput_sum = 0.0;
+    cl_uint assigned_calls = 0;
+    for(size_t i = 0; i < _devices.size(); i++)
+    {
+        ComputeDevice &device = _devices[i];
+        PendingRun &run = pending.runs[i];
+        throughput_sum += device.throughput;
+        cl_uint split_calls = i + 1 == _devices.size() ? 
+                              _n_calls : 
+                              (cl_uint)floor(_n_calls * (throughput_sum / total_throughput) + 0.5);
+        cl_uint device_calls = split_calls > assigned_calls ? split_calls - assigned_calls : 0;
+        assigned_calls += device_calls;
+        if(device_calls == 0)
+        {
+            run.total_n_calls = 0;
+            continue;
+        }
+
+        //Split the device's work groups between the
+        //integrals, with each work group taking one or more
+        //slots of one or more integrals.  Integrals with
+        //fewer calls than the device has work items take
+        //just enough work groups to give every work item a
+        //point, so that small integrations don't pay for a
+        //sweep of the whole device.
+        size_t n_groups = device.plain_work_item_count / device.plain_work_group_size;
+        size_t needed_groups = _launch_size(device.plain_work_item_count, 
+                                            device.plain_work_group_size, 
+                                            device_calls) / device.plain_work_group_size;
+        run.groups_per_integral = n_groups / n_integrals;
+        if(run.groups_per_integral > needed_groups)
+        {
+            run.groups_per_integral = needed_groups;
+        }
+        if(run.groups_per_integral == 0)
+        {
+            run.groups_per_integral = 1;
+        }
+        cl_uint n_slots = n_integrals * run.groups_per_integral;
+        size_t launch_size = (n_slots < n_groups ? n_slots : n_groups) * device.plain_work_group_size;
+        run.total_n_calls = device_calls;
+
+        //Upload the bounds
+        _reserve_run_buffers(device, run, n_bounds, n_slots);
+        CHECK_CL_OPERATION(clEnqueueWriteBuffer(device.command_queue,
+                                                run.bounds,
+                                                CL_FALSE,
+                                                0,
+                                                n_bounds * sizeof(bound_t),
+                                                &pending.host_bounds[0],
+                                                0,
+                                                NULL,
+                                                _profile_event("upload")),
+                           "Unable to write integration bound buffer");
+
+        //Enqueue the integration kernel.  The random number
+        //generator states are shared, so pending integrations
+        //are serialized by the (in-order) command queue.
+        cl_uint kernel_n_integrals = n_integrals;
+        CHECK_CL_OPERATION(clSetKernelArg(device.plain, 0, sizeof(cl_uint), &device_calls), 
+                           "Unable to set number of integration points");
+        _set_random_argument(device.plain, device);
+        CHECK_CL_OPERATION(clSetKernelArg(device.plain, 2, sizeof(cl_mem), &run.output), 
+                           "Couldn't set output buffer");
+        CHECK_CL_OPERATION(clSetKernelArg(device.plain, 3, sizeof(cl_mem), &run.bounds), 
+                           "Couldn't set integration bound buffer");
+        CHECK_CL_OPERATION(clSetKernelArg(device.plain, 4, sizeof(cl_uint), &kernel_n_integrals), 
+                           "Couldn't set number of integrals");
+        CHECK_CL_OPERATION(clSetKernelArg(device.plain, 5, sizeof(cl_uint), &run.groups_per_integral), 
+                           "Couldn't set number of work groups per integral");
+        CHECK_CL_OPERATION(clEnqueueNDRangeKernel(device.command_queue, 
+                                                  device.plain, 
+                                                  1, 
+                                                  NULL, 
+                                                  &launch_size,
+                                                  &device.plain_work_group_size,
+                                                  0, 
+                                                  NULL, 
+                                                  _devices.size() > 1 || _profiling ? &run.kernel_event : NULL),
+                           "Unable to queue plain integration kernel");
+
+        //Enqueue the answer copy, whose event marks the end
+        //of the device's share of the integration
+        CHECK_CL_OPERATION(clEnqueueReadBuffer(device.command_queue,
+                                               run.output,
+                                               CL_FALSE,
+                                               0,
+                                               2 * n_slots * sizeof(accumulator_t),
+                                               &run.host_output[0],
+                                               0,
+                                               NULL,
+                                               &run.read_event),
+                           "Unable to read output buffer");
+
+        //Make sure the device starts on the work
+        CHECK_CL_OPERATION(clFlush(device.command_queue), "Unable to flush command queue");
+    }
+
+    return handle;
+}
+
+bool ${integrator.name}::ready(IntegrationHandle handle)
+{
+    if(handle < 0 || handle >= (IntegrationHandle)_pending.size() || !_pending[handle]->in_use)
+    {
+        fprintf(stderr, "ERROR: Invalid integration handle (%d)\n", handle);
+        return false;
+    }
+    PendingIntegration &pending = *_pending[handle];
+
+    //Synchronous integrations are always finished
+    if(pending.synchronous)
+    {
+        return true;
+    }
+
+    //Errors are reported as negative statuses, which are
+    //picked up by wait
+    for(size_t i = 0; i < pending.runs.size(); i++)
+    {
+        if(pending.runs[i].read_event == NULL)
+        {
+            continue;
+        }
+        cl_int status;
+        CHECK_CL_OPERATION(clGetEventInfo(pending.runs[i].read_event,
+                                          CL_EVENT_COMMAND_EXECUTION_STATUS,
+                                          sizeof(cl_int),
+                                          &status,
+                                          NULL),
+                           "Unable to query integration status");
+        if(status != CL_COMPLETE && status >= 0)
+        {
+            return false;
+        }
+    }
+    return true;
+}
+
+$integrator.evaluation_function.return_type ${integrator.name}::wait(IntegrationHandle handle, $integrator.evaluation_function.return_type *error)
+{
+    $integrator.evaluation_function.return_type result = 0.0;
+    $integrator.evaluation_function.return_type _error = 0.0;
+    wait_batch(handle, &result, &_error);
+    if(error != NULL)
+    {
+        *error = _error;
+    }
+    return result;
+}
+
+void ${integrator.name}::wait_batch(IntegrationHandle handle, 
+                                    $integrator.evaluation_function.return_type *results, 
+                                    $integrator.evaluation_function.return_type *errors)
+{
+    if(handle < 0 || handle >= (IntegrationHandle)_pending.size() || !_pending[handle]->in_use)
+    {
+        fprintf(stderr, "ERROR: Invalid integration handle (%d)\n", handle);
+        return;
+    }
+    PendingIntegration &pending = *_pending[handle];
+
+    //Synchronous integrations just copy out their results
+    if(pending.synchronous)
+    {
+        for(int i = 0; i < pending.n_integrals; i++)
+        {
+            results[i] = pending.results[i];
+            if(errors != NULL)
+            {
+                errors[i] = pending.errors[i];
+            }
+        }
+        pending.in_use = false;
+        return;
+    }
+
+    //Wait for the answer copies to finish
+    for(size_t r = 0; r < pending.runs.size(); r++)
+    {
+        PendingRun &run = pending.runs[r];
+        if(run.read_event != NULL)
+        {
+            CHECK_CL_OPERATION(clWaitForEvents(1, &run.read_event), "Unable to execute integration");
+            if(_profiling)
+            {
+                _add_profile_time("readback", _event_seconds(run.read_event), 0.0);
+            }
+            clReleaseEvent(run.read_event);
+            run.read_event = NULL;
+        }
+
+        //Update the throughput of the device from the
+        //kernel's run time, so that the next split follows
+        //the measured speed of the devices
+        if(run.kernel_event != NULL)
+        {
+            double seconds = _event_seconds(run.kernel_event);
+            clReleaseEvent(run.kernel_event);
+            run.kernel_event = NULL;
+            double evaluations = (double)run.total_n_calls * pending.n_integrals;
+            if(_profiling)
+            {
+                _add_profile_time("plain_integrate", seconds, evaluations);
+            }
+            if(seconds > 0.0)
+            {
+                double throughput = evaluations / seconds;
+                ComputeDevice &device = _devices[r];
+                device.throughput = device.throughput_measured ? 
+                                    0.5 * (device.throughput + throughput) : 
+                                    throughput;
+                device.throughput_measured = true;
+            }
+        }
+    }
+
+    for(int i = 0; i < pending.n_integrals; i++)
+    {
+        //Sum the integral's slots on every device
+        double sum = 0.0, square_sum = 0.0, n = 0.0;
+        for(size_t r = 0; r < pending.runs.size(); r++)
+        {
+            const PendingRun &run = pending.runs[r];
+            if(run.total_n_calls == 0)
+            {
+                continue;
+            }
+            double run_sum, run_square_sum;
+            _sum_output(&run.host_output[2 * i * run.groups_per_integral], 
+                        run.groups_per_integral, 
+                        &run_sum, 
+                        &run_square_sum);
+            sum += run_sum;
+            square_sum += run_square_sum;
+            n += run.total_n_calls;
+        }
+
+        //The following calculations are based upon this documentation:
+        //http://mathworld.wolfram.com/MonteCarloIntegration.html
+        //They are done in double precision, since the difference
+        //of squares in the variance loses most of its significant
+        //digits in single precision at large call counts.
+
+        //Calculate mean
+        results[i] = pending.volumes[i] * sum / n;
+
+        //Calculate variance
+        double variance = (square_sum - (sum * sum / n)) / (n * n);
+        double error = variance > 0.0 ? pending.volumes[i] * sqrt(variance) : 0.0;
+        if(errors != NULL)
+        {
+            errors[i] = error;
+        }
+
+        //Report each integral once, as operator() does
+        //without a target
+        if(pending.report_progress)
+        {
+            _progress_start = pending.start;
+            _stop_requested = false;
+            _report_progress((long)n, results[i], error, 0.0);
+        }
+    }
+    pending.in_use = false;
+
+    //The uploads have finished too, so time them
+    _collect_profile_events();
+}
+
+cl_program ${integrator.name}::_runtime_program(FeynmanOpenClRuntime &runtime,
+                                               cl_platform_id platform, 
+                                               cl_device_id device, 
+                                               cl_context context)
+{
+    //The program is identified by the integrator, its
+    //sources and the build options
+    string key = string("$integrator.name-") + $integrator.name::_source_hash 
+                 + " " + $integrator.name::_build_options;
+    cl_program program = runtime.program(context, key);
+    if(program == NULL)
+    {
+        program = _build_program(platform, device, context);
+        runtime.add_program(context, key, program);
+    }
+    return program;
+}
+
+cl_program ${integrator.name}::_build_program(cl_platform_id platform, 
+                                             cl_device_id device, 
+                                             cl_context context)
+{
+    //Time the build (or load) on the host, since it isn't
+    //a command
+    struct timeval start, stop;
+    gettimeofday(&start, NULL);
+
+    //Try to load a previously built binary
+    string cache_path = _cache_path(platform, device, "bin");
+    cl_program program = NULL;
+    if(!cache_path.empty())
+    {
+        program = _load_program_binary(cache_path, context, device);
+        if(program != NULL)
+        {
+            if(_profiling)
+            {
+                gettimeofday(&stop, NULL);
+                _add_profile_time("program_load", 
+                                  (stop.tv_sec - start.tv_sec) + 1e-6 * (stop.tv_usec - start.tv_usec), 
+                                  0.0);
+            }
+            return program;
+        }
+    }
+
+    //Compile the OpenCL code
+    cl_int error;
+    const char *strings[] = {
+        $integrator.name::_fixes_source,
+        $integrator.name::_accumulation_source,
+#if $integrator.rng == "ranlux"
+        $integrator.name::_ranlux_source,
+        $integrator.name::_initialization_source,
+#end if
+        $integrator.name::_random_source,
+        $integrator.name::_integrand_source,
+        $integrator.name::_plain_source,
+        $integrator.name::_miser_source,
+        $integrator.name::_vegas_source,
+        $integrator.name::_quasi_source
+    };
+    cl_uint n_sources = sizeof(strings)/sizeof(const char *);
+    program = clCreateProgramWithSource(context,
+                                        n_sources,
+                                        strings,
+                                        NULL,
+                                        &error);
+    CHECK_CL_OPERATION(error, "Unable to create the OpenCL program");
+    error = clBuildProgram(program, 
+                           1,
+                           &device,
+                           $integrator.name::_build_options,
+                           NULL,
+                           NULL);
+    if(error != CL_SUCCESS)
+    {
+        //Unable to build (compile) the OpenCL program
+        size_t length;
+        char buffer[2048];
+
+        CHECK_CL_OPERATION(clGetProgramBuildInfo(program, 
+                                                 device, 
+                                                 CL_PROGRAM_BUILD_LOG, 
+                                                 sizeof(buffer), 
+                                                 buffer, 
+                                                 &length),
+                           "Build failure.  Unable to get build failure information");
+
+        printf("ERROR: Unable to build (compile) the OpenCL program (%i):\n%s\n", error, buffer);
+    }
+    CHECK_CL_OPERATION(error, "Unable to compile OpenCL source");
+
+    //Store the binary for next time
+    if(!cache_path.empty())
+    {
+        _save_program_binary(cache_path, program);
+    }
+    if(_profiling)
+    {
+        gettimeofday(&stop, NULL);
+        _add_profile_time("program_build", 
+                          (stop.tv_sec - start.tv_sec) + 1e-6 * (stop.tv_usec - start.tv_usec), 
+                          0.0);
+    }
+
+    return program;
+}
+
+string ${integrator.name}::_cache_path(cl_platform_id platform, 
+                                       cl_device_id device, 
+                                       const char *extension)
+{
+    //Figure out the cache directory.  An empty
+    //FEYNMAN_OPENCL_CACHE_DIR disables the cache.
+    string directory;
+    const char *cache_directory = getenv("FEYNMAN_OPENCL_CACHE_DIR");
+    if(cache_directory != NULL)
+    {
+        directory = cache_directory;
+    }
+    else
+    {
+        const char *home = getenv("HOME");
+        if(home == NULL || home[0] == '\0')
+        {
+            return string();
+        }
+        directory = string(home) + "/.feynman/opencl-cache";
+    }
+    if(directory.empty())
+    {
+        return string();
+    }
+
+    //Create the directory (and any parents)
+    for(size_t i = 1; i <= directory.size(); i++)
+    {
+        if(i == directory.size() || directory[i] == '/')
+        {
+            if(mkdir(directory.substr(0, i).c_str(), 0755) != 0 && errno != EEXIST)
+            {
+                return string();
+            }
+        }
+    }
+
+    //The binary depends on the sources (whose hash is
+    //computed when this code is generated), the platform,
+    //the device, the driver and the build options.
+    char buffer[1024];
+    unsigned long long key = _hash_string(0, $integrator.name::_build_options);
+    cl_platform_info platform_queries[] = {CL_PLATFORM_NAME, CL_PLATFORM_VERSION};
+    for(size_t i = 0; i < sizeof(platform_queries) / sizeof(cl_platform_info); i++)
+    {
+        buffer[0] = '\0';
+        clGetPlatformInfo(platform, platform_queries[i], sizeof(buffer), buffer, NULL);
+        buffer[sizeof(buffer) - 1] = '\0';
+        key = _hash_string(key, buffer);
+    }
+    cl_device_info device_queries[] = {CL_DEVICE_NAME, CL_DEVICE_VERSION, CL_DRIVER_VERSION};
+    for(size_t i = 0; i < sizeof(device_queries) / sizeof(cl_device_info); i++)
+    {
+        buffer[0] = '\0';
+        clGetDeviceInfo(device, device_queries[i], sizeof(buffer), buffer, NULL);
+        buffer[sizeof(buffer) - 1] = '\0';
+        key = _hash_string(key, buffer);
+    }
+    snprintf(buffer, 
+             sizeof(buffer), 
+             "/%s-%s-%016llx.%s", 
+             "$integrator.name", 
+             $integrator.name::_source_hash, 
+             key,
+             extension);
+
+    return directory + buffer;
+}
+
+cl_program ${integrator.name}::_load_program_binary(const string &path, 
+                                                  cl_context context, 
+                                                  cl_device_id device)
+{
+    //Read the file
+    FILE *f = fopen(path.c_str(), "rb");
+    if(f == NULL)
+    {
+        return NULL;
+    }
+    vector<unsigned char> binary;
+    unsigned char buffer[4096];
+    size_t count;
+    while((count = fread(buffer, 1, sizeof(buffer), f)) > 0)
+    {
+        binary.insert(binary.end(), buffer, buffer + count);
+    }
+    fclose(f);
+    if(binary.empty())
+    {
+        return NULL;
+    }
+
+    //Create and build the program, falling back to the
+    //sources if the binary is rejected for any reason
+    cl_int error;
+    cl_int binary_status;
+    size_t length = binary.size();
+    const unsigned char *binaries[] = {&binary[0]};
+    cl_program program = clCreateProgramWithBinary(context,
+                                                   1,
+                                                   &device,
+                                                   &length,
+                                                   binaries,
+                                                   &binary_status,
+                                                   &error);
+    if(error != CL_SUCCESS || binary_status != CL_SUCCESS)
+    {
+        RELEASE_CL_PROGRAM_SAFE(program);
+        return NULL;
+    }
+    error = clBuildProgram(program, 
+                           1,
+                           &device,
+                           $integrator.name::_build_options,
+                           NULL,
+                           NULL);
+    if(error != CL_SUCCESS)
+    {
+        RELEASE_CL_PROGRAM_SAFE(program);
+        return NULL;
+    }
+
+    return program;
+}
+
+void ${integrator.name}::_save_program_binary(const string &path, cl_program program)
+{
+    //Grab the binary
+    size_t length = 0;
+    if(clGetProgramInfo(program, 
+                        CL_PROGRAM_BINARY_SIZES, 
+                        sizeof(length), 
+                        &length, 
+                        NULL) != CL_SUCCESS
+       || length == 0)
+    {
+        return;
+    }
+    vector<unsigned char> binary(length);
+    unsigned char *binaries[] = {&binary[0]};
+    if(clGetProgramInfo(program, 
+                        CL_PROGRAM_BINARIES, 
+                        sizeof(binaries), 
+                        binaries, 
+                        NULL) != CL_SUCCESS)
+    {
+        return;
+    }
+
+    //Write it to a temporary file and then move it into
+    //place, so that concurrent processes never see a
+    //partially written binary
+    char suffix[32];
+    snprintf(suffix, sizeof(suffix), ".%ld.tmp", (long)getpid());
+    string temporary_path = path + suffix;
+    FILE *f = fopen(temporary_path.c_str(), "wb");
+    if(f == NULL)
+    {
+        return;
+    }
+    bool written = fwrite(&binary[0], 1, binary.size(), f) == binary.size();
+    written = (fclose(f) == 0) && written;
+    if(!written || rename(temporary_path.c_str(), path.c_str()) != 0)
+    {
+        remove(temporary_path.c_str());
+    }
+}
+
+void ${integrator.name}::_load_profile(ComputeDevice &device)
+{
+    string path = _cache_path(device.platform, device.device, "profile");
+    if(path.empty())
+    {
+        return;
+    }
+    FILE *f = fopen(path.c_str(), "r");
+    if(f == NULL)
+    {
+        return;
+    }
+    unsigned long work_group_size_limit = 0;
+    unsigned long concurrent_work_groups = 0;
+    int n_read = fscanf(f, 
+                        "work_group_size_limit %lu concurrent_work_groups %lu", 
+                        &work_group_size_limit, 
+                        &concurrent_work_groups);
+    fclose(f);
+    if(n_read == 2 && concurrent_work_groups > 0)
+    {
+        device.work_group_size_limit = work_group_size_limit;
+        device.concurrent_work_groups = concurrent_work_groups;
+    }
+}
+
+void ${integrator.name}::_save_profile(const ComputeDevice &device)
+{
+    string path = _cache_path(device.platform, device.device, "profile");
+    if(path.empty())
+    {
+        return;
+    }
+
+    //Write it to a temporary file and then move it into
+    //place, as for program binaries
+    char suffix[32];
+    snprintf(suffix, sizeof(suffix), ".%ld.tmp", (long)getpid());
+    string temporary_path = path + suffix;
+    FILE *f = fopen(temporary_path.c_str(), "w");
+    if(f == NULL)
+    {
+        return;
+    }
+    bool written = fprintf(f, 
+                           "work_group_size_limit %lu\nconcurrent_work_groups %lu\n", 
+                           (unsigned long)device.work_group_size_limit, 
+                           (unsigned long)device.concurrent_work_groups) > 0;
+    written = (fclose(f) == 0) && written;
+    if(!written || rename(temporary_path.c_str(), path.c_str()) != 0)
+    {
+        remove(temporary_path.c_str());
+    }
+}
+
+double ${integrator.name}::_time_plain_kernel(ComputeDevice &device, PendingRun &run)
+{
+    //Spread the calls over all of the work items, as for
+    //a large batch of one integral
+    cl_uint n_groups = device.plain_work_item_count / device.plain_work_group_size;
+    cl_uint n_calls = _n_calls > 0 ? _n_calls : 1;
+    _reserve_run_buffers(device, run, ${2 * $integrator.n_dimensions}, n_groups);
+
+    //Launch the kernel once to warm up, and then time a
+    //couple more launches
+    cl_uint n_integrals = 1;
+    double best_time = -1.0;
+    for(int launch = 0; launch < 3; launch++)
+    {
+        CHECK_CL_OPERATION(clSetKernelArg(device.plain, 0, sizeof(cl_uint), &n_calls), 
+                           "Unable to set number of integration points");
+        _set_random_argument(device.plain, device);
+        CHECK_CL_OPERATION(clSetKernelArg(device.plain, 2, sizeof(cl_mem), &run.output), 
+                           "Couldn't set output buffer");
+        CHECK_CL_OPERATION(clSetKernelArg(device.plain, 3, sizeof(cl_mem), &run.bounds), 
+                           "Couldn't set integration bound buffer");
+        CHECK_CL_OPERATION(clSetKernelArg(device.plain, 4, sizeof(cl_uint), &n_integrals), 
+                           "Couldn't set number of integrals");
+        CHECK_CL_OPERATION(clSetKernelArg(device.plain, 5, sizeof(cl_uint), &n_groups), 
+                           "Couldn't set number of work groups per integral");
+
+        struct timeval start, stop;
+        gettimeofday(&start, NULL);
+        CHECK_CL_OPERATION(clEnqueueNDRangeKernel(device.command_queue, 
+                                                  device.plain, 
+                                                  1, 
+                                                  NULL, 
+                                                  &device.plain_work_item_count,
+                                                  &device.plain_work_group_size,
+                                                  0, 
+                                                  NULL, 
+                                                  NULL),
+                           "Unable to queue plain integration kernel");
+        CHECK_CL_OPERATION(clFinish(device.command_queue), "Unable to execute plain integration");
+        gettimeofday(&stop, NULL);
+
+        double time = (stop.tv_sec - start.tv_sec) + 1e-6 * (stop.tv_usec - start.tv_usec);
+        if(launch > 0 && (best_time < 0.0 || time < best_time))
+        {
+            best_time = time;
+        }
+    }
+
+    return best_time / n_calls;
+}
+
+cl_event *${integrator.name}::_profile_event(const char *stage, double evaluations)
+{
+    if(!_profiling)
+    {
+        return NULL;
+    }
+    ProfileEvent profile_event;
+    profile_event.stage = stage;
+    profile_event.event = NULL;
+    profile_event.evaluations = evaluations;
+    _profile_events.push_back(profile_event);
+    return &_profile_events.back().event;
+}
+
+void ${integrator.name}::_collect_profile_events()
+{
+    size_t n_pending = 0;
+    for(size_t i = 0; i < _profile_events.size(); i++)
+    {
+        ProfileEvent &profile_event = _profile_events[i];
+        cl_int status = CL_COMPLETE;
+        if(profile_event.event != NULL)
+        {
+            clGetEventInfo(profile_event.event, 
+                           CL_EVENT_COMMAND_EXECUTION_STATUS, 
+                           sizeof(status), 
+                           &status, 
+                           NULL);
+        }
+
+        //Keep the commands which are still running, and
+        //drop the ones which failed
+        if(status > CL_COMPLETE)
+        {
+            _profile_events[n_pending++] = profile_event;
+            continue;
+        }
+        if(status == CL_COMPLETE && profile_event.event != NULL)
+        {
+            _add_profile_time(profile_event.stage, 
+                              _event_seconds(profile_event.event), 
+                              profile_event.evaluations);
+        }
+        if(profile_event.event != NULL)
+        {
+            clReleaseEvent(profile_event.event);
+        }
+    }
+    _profile_events.resize(n_pending);
+}
+
+void ${integrator.name}::_add_profile_time(const char *stage, double seconds, double evaluations)
+{
+    size_t i = 0;
+    while(i < _profile_stages.size() && _profile_stages[i].name != stage)
+    {
+        i++;
+    }
+    if(i == _profile_stages.size())
+    {
+        ProfileStage profile_stage;
+        profile_stage.name = stage;
+        profile_stage.count = 0;
+        profile_stage.seconds = 0.0;
+        profile_stage.evaluations = 0.0;
+        _profile_stages.push_back(profile_stage);
+    }
+    _profile_stages[i].count++;
+    _profile_stages[i].seconds += seconds;
+    _profile_stages[i].evaluations += evaluations;
+}
+
+double ${integrator.name}::_event_seconds(cl_event event)
+{
+    cl_ulong start = 0, end = 0;
+    if(clGetEventProfilingInfo(event, CL_PROFILING_COMMAND_START, sizeof(start), &start, NULL) != CL_SUCCESS
+       || clGetEventProfilingInfo(event, CL_PROFILING_COMMAND_END, sizeof(end), &end, NULL) != CL_SUCCESS
+       || end < start)
+    {
+        return 0.0;
+    }
+    return (end - start) * 1e-9;
+}
+
+void ${integrator.name}::_append_json_string(string &json, const string &s)
+{
+    json += '"';
+    for(size_t i = 0; i < s.size(); i++)
+    {
+        unsigned char c = s[i];
+        if(c == '"' || c == '\\')
+        {
+            json += '\\';
+            json += c;
+        }
+        else if(c < 0x20)
+        {
+            char escape[8];
+            snprintf(escape, sizeof(escape), "\\u%04x", c);
+            json += escape;
+        }
+        else
+        {
+            json += c;
+        }
+    }
+    json += '"';
+}
+
+unsigned long long ${integrator.name}::_hash_string(unsigned long long hash, const char *s)
+{
+    //64-bit FNV-1a, chained from a previous hash
+    //(or zero to start)
+    if(hash == 0)
+    {
+        hash = 14695981039346656037ULL;
+    }
+    for(; *s != '\0'; s++)
+    {
+        hash ^= (unsigned char)(*s);
+        hash *= 1099511628211ULL;
+    }
+
+    //Mark the end of the string, so that chained
+    //strings can't run together
+    hash ^= 0xff;
+    hash *= 1099511628211ULL;
+
+    return hash;
+}
+
+void ${integrator.name}::_prepare(MonteCarloType t)
+{
+    cl_int error;
+    if(t == MonteCarloPlain)
+    {
+        //Configure the devices which haven't been, and
+        //make sure their states cover the kernel
+        for(size_t i = 0; i < _devices.size(); i++)
+        {
+            ComputeDevice &device = _devices[i];
+            if(device.plain_work_item_count == 0)
+            {
+                _configure_kernel(device,
+                                  device.plain,
+                                  &device.plain_work_group_size,
+                                  &device.plain_work_item_count);
+                _reserve_rng_states(device, device.plain_work_item_count);
+            }
+        }
+    }
+    else if(t == MonteCarloMiser && _miser_work_item_count == 0)
+    {
+        if(_miser == NULL)
+        {
+            _miser = clCreateKernel(_program, "miser_integrate", &error);
+            CHECK_CL_OPERATION(error, "Unable to create miser Monte Carlo integration kernel");
+            _miser_regions = clCreateBuffer(_context, 
+                                            CL_MEM_READ_ONLY, 
+                                            MISER_MAX_REGIONS * 2 * $integrator.n_dimensions * sizeof(float), 
+                                            NULL, 
+                                            &error);
+            CHECK_CL_OPERATION(error, "Unable to create Miser region buffer");
+            _miser_region_calls = clCreateBuffer(_context, 
+                                                 CL_MEM_READ_ONLY, 
+                                                 MISER_MAX_REGIONS * sizeof(cl_uint), 
+                                                 NULL, 
+                                                 &error);
+            CHECK_CL_OPERATION(error, "Unable to create Miser region call buffer");
+            _miser_region_sums = clCreateBuffer(_context, 
+                                                CL_MEM_WRITE_ONLY, 
+                                                MISER_MAX_REGIONS * MISER_SUM_SIZE * sizeof(accumulator_t), 
+                                                NULL, 
+                                                &error);
+            CHECK_CL_OPERATION(error, "Unable to create Miser region sum buffer");
+            _miser_region_counts = clCreateBuffer(_context, 
+                                                  CL_MEM_WRITE_ONLY, 
+                                                  MISER_MAX_REGIONS * MISER_COUNT_SIZE * sizeof(cl_uint), 
+                                                  NULL, 
+                                                  &error);
+            CHECK_CL_OPERATION(error, "Unable to create Miser region count buffer");
+        }
+        _configure_kernel(_devices[0],
+                          _miser,
+                          &_miser_work_group_size,
+                          &_miser_work_item_count);
+        _reserve_rng_states(_devices[0], _miser_work_item_count);
+    }
+    else if(t == MonteCarloVegas && _vegas_work_item_count == 0)
+    {
+        if(_vegas == NULL)
+        {
+            _vegas = clCreateKernel(_program, "vegas_integrate", &error);
+            CHECK_CL_OPERATION(error, "Unable to create vegas Monte Carlo integration kernel");
+            _vegas_host_grid.resize($integrator.n_dimensions * (VEGAS_BINS + 1));
+            _vegas_grid = clCreateBuffer(_context, 
+                                         CL_MEM_READ_ONLY, 
+                                         _vegas_host_grid.size() * sizeof(float), 
+                                         NULL, 
+                                         &error);
+            CHECK_CL_OPERATION(error, "Unable to create Vegas grid buffer");
+        }
+        _configure_kernel(_devices[0],
+                          _vegas,
+                          &_vegas_work_group_size,
+                          &_vegas_work_item_count);
+        _reserve_rng_states(_devices[0], _vegas_work_item_count);
+
+        //Size the histograms and the output for the work 
+        //groups
+        _reserve_vegas_histograms();
+        _reserve_output(_vegas_work_item_count / _vegas_work_group_size);
+    }
+    else if(t == MonteCarloQuasi && _quasi_work_item_count == 0)
+    {
+        if(_quasi == NULL)
+        {
+            _quasi = clCreateKernel(_program, "quasi_integrate", &error);
+            CHECK_CL_OPERATION(error, "Unable to create quasi Monte Carlo integration kernel");
+        }
+        _configure_kernel(_devices[0],
+                          _quasi,
+                          &_quasi_work_group_size,
+                          &_quasi_work_item_count);
+    }
+}
+
+void ${integrator.name}::_add_device(FeynmanOpenClRuntime &runtime, 
+                                     cl_platform_id platform, 
+                                     cl_device_id device)
+{
+    cl_int error;
+    ComputeDevice compute_device;
+    compute_device.platform = platform;
+    compute_device.device = device;
+    compute_device.seed_offset = _devices.size();
+    compute_device.work_group_size_limit = 0;
+    compute_device.concurrent_work_groups = DEFAULT_CONCURRENT_WORK_GROUPS;
+    if(device == _device)
+    {
+        //Share the resources that have already been
+        //created for this device
+        compute_device.compute_units = _compute_units;
+        compute_device.context = _context;
+        compute_device.command_queue = _command_queue;
+        compute_device.program = _program;
+        compute_device.rng_init = _rng_init;
+        compute_device.rng_init_work_group_size = _rng_init_work_group_size;
+        clRetainContext(_context);
+        clRetainCommandQueue(_command_queue);
+        clRetainProgram(_program);
+#if $integrator.rng == "ranlux"
+        clRetainKernel(_rng_init);
+#end if
+    }
+    else
+    {
+        cl_uint compute_units = 0;
+        CHECK_CL_OPERATION(clGetDeviceInfo(device,
+                                           CL_DEVICE_MAX_COMPUTE_UNITS,
+                                           sizeof(compute_units),
+                                           &compute_units,
+                                           NULL),
+                           "Unable to query device compute unit count");
+        compute_device.compute_units = compute_units;
+        compute_device.context = runtime.context(device, &error);
+        CHECK_CL_OPERATION(error, "Unable to create a compute context");
+        compute_device.command_queue = runtime.command_queue(device, CL_QUEUE_PROFILING_ENABLE, &error);
+        CHECK_CL_OPERATION(error, "Unable to create a command queue");
+        compute_device.program = _runtime_program(runtime, platform, device, compute_device.context);
+#if $integrator.rng == "ranlux"
+        compute_device.rng_init = clCreateKernel(compute_device.program, "random_initialize", &error);
+        CHECK_CL_OPERATION(error, "Unable to create initialization kernel");
+        CHECK_CL_OPERATION(clGetKernelWorkGroupInfo(compute_device.rng_init,
+                                                    device,
+                                                    CL_KERNEL_PREFERRED_WORK_GROUP_SIZE_MULTIPLE,
+                                                    sizeof(size_t),
+                                                    &compute_device.rng_init_work_group_size,
+                                                    NULL),
+                           "Unable to determine preferred kernel work group size multiple for " \
+                           "random number generator initialization.");
+#else
+        compute_device.rng_init = NULL;
+        compute_device.rng_init_work_group_size = 0;
+#end if
+    }
+    compute_device.plain = clCreateKernel(compute_device.program, "plain_integrate", &error);
+    CHECK_CL_OPERATION(error, "Unable to create plain Monte Carlo integration kernel");
+    compute_device.plain_work_group_size = 0;
+    compute_device.plain_work_item_count = 0;
+    compute_device.rng_states = NULL;
+    compute_device.rng_state_count = 0;
+
+    //Estimate the throughput from the compute units and
+    //clock frequency until it has been measured
+    cl_uint clock_frequency = 0;
+    clGetDeviceInfo(device, CL_DEVICE_MAX_CLOCK_FREQUENCY, sizeof(clock_frequency), &clock_frequency, NULL);
+    compute_device.throughput = (double)compute_device.compute_units * (clock_frequency > 0 ? clock_frequency : 1);
+    compute_device.throughput_measured = false;
+
+    //Use the device's profile, if it has been autotuned
+    _load_profile(compute_device);
+
+    _devices.push_back(compute_device);
+}
+
+bool ${integrator.name}::_supports_accumulation(cl_device_id device)
+{
+#if $integrator.accumulation == "double"
+    cl_device_fp_config double_config = 0;
+    CHECK_CL_OPERATION(clGetDeviceInfo(device,
+                                       CL_DEVICE_DOUBLE_FP_CONFIG,
+                                       sizeof(double_config),
+                                       &double_config,
+                                       NULL),
+                       "Unable to query device double precision support");
+    return double_config != 0;
+#else
+    return true;
+#end if
+}
+
+void ${integrator.name}::_configure_kernel(const ComputeDevice &device,
+                                           cl_kernel kernel,
+                                           size_t *work_group_size,
+                                           size_t *work_item_count)
+{
+    //Calculate the maximum work group size
+    //and preferred work group size multiple
+    //for this device and kernel
+    size_t max_work_group_size;
+    CHECK_CL_OPERATION(clGetKernelWorkGroupInfo(kernel,
+                                                device.device,
+                                                CL_KERNEL_WORK_GROUP_SIZE,
+                                                sizeof(size_t),
+                                                &max_work_group_size,
+                                                NULL),
+                       "Unable to determine maximum kernel work group size");
+
+    size_t preferred_work_group_size_multiple;
+    CHECK_CL_OPERATION(clGetKernelWorkGroupInfo(kernel,
+                                                device.device,
+                                                CL_KERNEL_PREFERRED_WORK_GROUP_SIZE_MULTIPLE,
+                                                sizeof(size_t),
+                                                &preferred_work_group_size_multiple,
+                                                NULL),
+                       "Unable to determine preferred kernel work group size multiple");
+
+    //Run the work group size up until <= to the maximum
+    if(preferred_work_group_size_multiple == 0)
+    {
+        preferred_work_group_size_multiple = 1;
+    }
+    *work_group_size = preferred_work_group_size_multiple;
+    while(*work_group_size <= max_work_group_size)
+    {
+        *work_group_size += preferred_work_group_size_multiple;
+    }
+    *work_group_size -= preferred_work_group_size_multiple;
+    if(*work_group_size == 0)
+    {
+        //The preferred multiple is larger than the kernel
+        //allows, so just use the largest size it does
+        *work_group_size = max_work_group_size;
+    }
+
+    //Make sure the work group fits in the kernels'
+    //local reduction arrays, and in the device's limit
+    size_t work_group_size_limit = MAX_WORK_GROUP_SIZE;
+    if(device.work_group_size_limit > 0 && device.work_group_size_limit < work_group_size_limit)
+    {
+        work_group_size_limit = device.work_group_size_limit;
+    }
+    while(*work_group_size > work_group_size_limit
+          && *work_group_size > preferred_work_group_size_multiple)
+    {
+        *work_group_size -= preferred_work_group_size_multiple;
+    }
+    if(*work_group_size > work_group_size_limit)
+    {
+        *work_group_size = work_group_size_limit;
+    }
+
+    //Calculate the global work item count
+    *work_item_count = device.compute_units * (*work_group_size) * device.concurrent_work_groups;
+}
+
+void ${integrator.name}::_reserve_rng_states(ComputeDevice &device, size_t work_item_count)
+{
+#if $integrator.rng == "ranlux"
+    //The kernels index the states by work item, so any
+    //kernel can use states created for a larger one
+    if(device.rng_state_count >= work_item_count)
+    {
+        return;
+    }
+
+    //Create the random number buffer
+    RELEASE_CL_MEMORY_SAFE(device.rng_states);
+    device.rng_state_count = 0;
+    cl_int error;
+    device.rng_states = clCreateBuffer(device.context,
+                                       CL_MEM_READ_WRITE, 
+                                       work_item_count * RANLUXCL_STATE_SIZE, 
+                                       NULL, 
+                                       &error);
+    CHECK_CL_OPERATION(error, "Unable to create random number generator state buffer");
+
+    //Initialize the random number buffer
+    //Run the random number initialization kernel.  Each
+    //seeding takes the next seed after _random_seed, and
+    //RANLUXCL gives distinct seeds disjoint streams, so
+    //devices (and states regrown for larger kernels) never
+    //repeat each other's numbers.
+    cl_uint seed = _random_seed + _random_seeds_used;
+    _random_seeds_used++;
+    
+    CHECK_CL_OPERATION(clSetKernelArg(device.rng_init, 0, sizeof(seed), &seed), 
+                       "Unable to set random number seed");
+    CHECK_CL_OPERATION(clSetKernelArg(device.rng_init, 1, sizeof(cl_mem), &device.rng_states), 
+                       "Couldn't set random number state buffer");
+    //HACK: Technically the work item counts for the integration kernel
+    //might not jive with the random number generator initialization
+    //kernel work group size, but I'm not going to bother fixing this
+    //until it becomes a problem.
+    CHECK_CL_OPERATION(clEnqueueNDRangeKernel(device.command_queue, 
+                                              device.rng_init, 
+                                              1, 
+                                              NULL, 
+                                              &work_item_count,
+                                              &device.rng_init_work_group_size,
+                                              0, 
+                                              NULL, 
+                                              _profile_event("rng_init")),
+                       "Unable to queue random number initialization kernel");
+    CHECK_CL_OPERATION(clFinish(device.command_queue), 
+                       "Unable to execute random number initialization kernel");
+    device.rng_state_count = work_item_count;
+#end if
+}
+
+void ${integrator.name}::_set_random_argument(cl_kernel kernel, const ComputeDevice &device)
+{
+#if $integrator.rng == "philox"
+    //Key the generator by the seed and the device, and
+    //number the launch, so that no two launches (or devices)
+    //draw the same numbers.  The work items count their own
+    //draws.
+    cl_uint4 source;
+    source.s[0] = _random_seed;
+    source.s[1] = device.seed_offset;
+    source.s[2] = (cl_uint)(_random_launches & 0xffffffffUL);
+    source.s[3] = (cl_uint)(_random_launches >> 32);
+    _random_launches++;
+    CHECK_CL_OPERATION(clSetKernelArg(kernel, 1, sizeof(cl_uint4), &source), 
+                       "Couldn't set random number source");
+#else
+    CHECK_CL_OPERATION(clSetKernelArg(kernel, 1, sizeof(cl_mem), &device.rng_states), 
+                       "Couldn't set random number state buffer");
+#end if
+}
+
+cl_uint ${integrator.name}::_miser_sample_calls(cl_uint calls)
+{
+    if(calls < (cl_uint)_miser_min_calls_per_bisection)
+    {
+        return calls;
+    }
+    cl_uint estimate_calls = (cl_uint)(_miser_estimate_fraction * calls);
+    return estimate_calls > (cl_uint)_miser_min_calls ? estimate_calls : _miser_min_calls;
 }
 
-void ${integrator.name}::_enqueue_output_buffer_clear()
+void ${integrator.name}::_miser_sample_regions(const vector<MiserRegion> &regions,
+                                               vector<accumulator_t> &sums,
+                                               vector<cl_uint> &counts)
 {
-    float mem_value = 0;
-    size_t memory_count = 2;
-    CHECK_CL_OPERATION(clSetKernelArg(_mem_set, 0, sizeof(float), &mem_value), 
-                       "Unable to set memory set value");
-    CHECK_CL_OPERATION(clSetKernelArg(_mem_set, 1, sizeof(cl_mem), &_output), 
-                       "Couldn't set memory set buffer");
+    //Pack the regions
+    cl_uint n_regions = regions.size();
+    vector<float> bounds(n_regions * 2 * $integrator.n_dimensions);
+    vector<cl_uint> calls(n_regions);
+    double n_evaluations = 0.0;
+    for(cl_uint r = 0; r < n_regions; r++)
+    {
+        for(int d = 0; d < $integrator.n_dimensions; d++)
+        {
+            bounds[r * 2 * $integrator.n_dimensions + d] = regions[r].lower[d];
+            bounds[r * 2 * $integrator.n_dimensions + $integrator.n_dimensions + d] = regions[r].upper[d];
+        }
+        calls[r] = _miser_sample_calls(regions[r].calls);
+        n_evaluations += calls[r];
+    }
+    sums.resize(n_regions * MISER_SUM_SIZE);
+    counts.resize(n_regions * MISER_COUNT_SIZE);
+
+    //Upload them
+    CHECK_CL_OPERATION(clEnqueueWriteBuffer(_command_queue,
+                                            _miser_regions,
+                                            CL_FALSE,
+                                            0,
+                                            bounds.size() * sizeof(float),
+                                            &bounds[0],
+                                            0,
+                                            NULL,
+                                            _profile_event("upload")),
+                       "Unable to write Miser region buffer");
+    CHECK_CL_OPERATION(clEnqueueWriteBuffer(_command_queue,
+                                            _miser_region_calls,
+                                            CL_FALSE,
+                                            0,
+                                            calls.size() * sizeof(cl_uint),
+                                            &calls[0],
+                                            0,
+                                            NULL,
+                                            _profile_event("upload")),
+                       "Unable to write Miser region call buffer");
+
+    //Sample them
+    CHECK_CL_OPERATION(clSetKernelArg(_miser, 0, sizeof(cl_uint), &n_regions), 
+                       "Unable to set number of Miser regions");
+    _set_random_argument(_miser, _devices[0]);
+    CHECK_CL_OPERATION(clSetKernelArg(_miser, 2, sizeof(cl_mem), &_miser_regions), 
+                       "Couldn't set Miser region buffer");
+    CHECK_CL_OPERATION(clSetKernelArg(_miser, 3, sizeof(cl_mem), &_miser_region_calls), 
+                       "Couldn't set Miser region call buffer");
+    CHECK_CL_OPERATION(clSetKernelArg(_miser, 4, sizeof(cl_mem), &_miser_region_sums), 
+                       "Couldn't set Miser region sum buffer");
+    CHECK_CL_OPERATION(clSetKernelArg(_miser, 5, sizeof(cl_mem), &_miser_region_counts), 
+                       "Couldn't set Miser region count buffer");
     CHECK_CL_OPERATION(clEnqueueNDRangeKernel(_command_queue, 
-                                              _mem_set, 
+                                              _miser, 
                                               1, 
                                               NULL, 
-                                              &memory_count,
-                                              &memory_count,
+                                              &_miser_work_item_count,
+                                              &_miser_work_group_size,
                                               0, 
                                               NULL, 
-                                              NULL),
-                       "Unable to queue random number memory setting kernel");
+                                              _profile_event("miser_integrate", n_evaluations)),
+                       "Unable to queue Miser integration kernel");
+
+    //Read back the results
+    CHECK_CL_OPERATION(clEnqueueReadBuffer(_command_queue, 
+                                           _miser_region_sums, 
+                                           CL_FALSE, 
+                                           0, 
+                                           sums.size() * sizeof(accumulator_t), 
+                                           &sums[0], 
+                                           0, 
+                                           NULL, 
+                                           _profile_event("readback")), 
+                       "Unable to read Miser region sum buffer");
+    CHECK_CL_OPERATION(clEnqueueReadBuffer(_command_queue, 
+                                           _miser_region_counts, 
+                                           CL_FALSE, 
+                                           0, 
+                                           counts.size() * sizeof(cl_uint), 
+                                           &counts[0], 
+                                           0, 
+                                           NULL, 
+                                           _profile_event("readback")), 
+                       "Unable to read Miser region count buffer");
+    CHECK_CL_OPERATION(clFinish(_command_queue), "Unable to execute Miser sampling");
+    _collect_profile_events();
+}
+
+void ${integrator.name}::_vegas_reset_grid()
+{
+    for(int d = 0; d < $integrator.n_dimensions; d++)
+    {
+        for(int i = 0; i <= VEGAS_BINS; i++)
+        {
+            _vegas_host_grid[d * (VEGAS_BINS + 1) + i] = ((float)i) / VEGAS_BINS;
+        }
+    }
+}
+
+cl_uint ${integrator.name}::_vegas_iteration_calls(int total_calls)
+{
+    int calls = total_calls / _vegas_iterations;
+    return calls > VEGAS_MIN_ITERATION_CALLS ? calls : VEGAS_MIN_ITERATION_CALLS;
+}
+
+void ${integrator.name}::_vegas_iteration(cl_uint calls, double *mean, double *variance)
+{
+    //The kernel splits the calls between the work items,
+    //of which small iterations launch fewer
+    size_t launch_size = _launch_size(_vegas_work_item_count, _vegas_work_group_size, calls);
+    size_t n_groups = launch_size / _vegas_work_group_size;
+
+    //Upload the current grid
+    CHECK_CL_OPERATION(clEnqueueWriteBuffer(_command_queue,
+                                            _vegas_grid,
+                                            CL_FALSE,
+                                            0,
+                                            _vegas_host_grid.size() * sizeof(float),
+                                            &_vegas_host_grid[0],
+                                            0,
+                                            NULL,
+                                            _profile_event("upload")),
+                       "Unable to write Vegas grid buffer");
+
+    //Run the iteration
+    CHECK_CL_OPERATION(clSetKernelArg(_vegas, 0, sizeof(cl_uint), &calls), 
+                       "Unable to set number of integration points");
+    _set_random_argument(_vegas, _devices[0]);
+    CHECK_CL_OPERATION(clSetKernelArg(_vegas, 2, sizeof(cl_mem), &_output), 
+                       "Couldn't set output buffer");
+    CHECK_CL_OPERATION(clSetKernelArg(_vegas, 3, sizeof(cl_mem), &_vegas_grid), 
+                       "Couldn't set Vegas grid buffer");
+    CHECK_CL_OPERATION(clSetKernelArg(_vegas, 4, sizeof(cl_mem), &_vegas_histograms), 
+                       "Couldn't set Vegas histogram buffer");
+    CHECK_CL_OPERATION(clEnqueueNDRangeKernel(_command_queue, 
+                                              _vegas, 
+                                              1, 
+                                              NULL, 
+                                              &launch_size,
+                                              &_vegas_work_group_size,
+                                              0, 
+                                              NULL, 
+                                              _profile_event("vegas_integrate", calls)),
+                       "Unable to queue Vegas integration kernel");
+
+    //Read back the sums and the launched work groups'
+    //histograms
+    _enqueue_output_buffer_read(n_groups);
+    CHECK_CL_OPERATION(clEnqueueReadBuffer(_command_queue, 
+                                           _vegas_histograms, 
+                                           CL_FALSE, 
+                                           0, 
+                                           n_groups * $integrator.n_dimensions * VEGAS_BINS * sizeof(float), 
+                                           &_vegas_host_histograms[0], 
+                                           0, 
+                                           NULL, 
+                                           _profile_event("readback")), 
+                       "Unable to read Vegas histogram buffer");
+    CHECK_CL_OPERATION(clFinish(_command_queue), "Unable to execute Vegas iteration");
+    _collect_profile_events();
+
+    //Calculate the mean and the variance of the mean
+    double sum, square_sum;
+    _sum_output(&_host_output[0], n_groups, &sum, &square_sum);
+    double n = (double)calls;
+    *mean = sum / n;
+    *variance = (square_sum / n - (*mean) * (*mean)) / (n - 1.0);
+    if(*variance < 0.0)
+    {
+        *variance = 0.0;
+    }
+
+    //Adapt the grid to the histograms
+    _vegas_refine_grid(n_groups);
+}
+
+void ${integrator.name}::_vegas_refine_grid(size_t n_groups)
+{
+    //Grid refinement parameters
+    const double alpha = 1.5;
+
+    for(int d = 0; d < $integrator.n_dimensions; d++)
+    {
+        //Sum the histograms of all work groups
+        double histogram[VEGAS_BINS];
+        for(int i = 0; i < VEGAS_BINS; i++)
+        {
+            histogram[i] = 0.0;
+            for(size_t g = 0; g < n_groups; g++)
+            {
+                histogram[i] += _vegas_host_histograms[(g * $integrator.n_dimensions + d) * VEGAS_BINS + i];
+            }
+        }
+
+        //Smooth the histogram
+        double old_value = histogram[0];
+        double new_value = histogram[1];
+        double total = 0.0;
+        histogram[0] = (old_value + new_value) / 2.0;
+        total += histogram[0];
+        for(int i = 1; i < VEGAS_BINS - 1; i++)
+        {
+            double sum = old_value + new_value;
+            old_value = new_value;
+            new_value = histogram[i + 1];
+            histogram[i] = (sum + new_value) / 3.0;
+            total += histogram[i];
+        }
+        histogram[VEGAS_BINS - 1] = (new_value + old_value) / 2.0;
+        total += histogram[VEGAS_BINS - 1];
+
+        //Compute the damped bin weights
+        double weights[VEGAS_BINS];
+        double total_weight = 0.0;
+        for(int i = 0; i < VEGAS_BINS; i++)
+        {
+            weights[i] = 0.0;
+            if(histogram[i] > 0.0)
+            {
+                double ratio = total / histogram[i];
+                if(ratio > 1.0)
+                {
+                    weights[i] = pow(((ratio - 1.0) / ratio) / log(ratio), alpha);
+                }
+                else
+                {
+                    weights[i] = 1.0;
+                }
+            }
+            total_weight += weights[i];
+        }
+        if(total_weight <= 0.0)
+        {
+            //Nothing was sampled along this dimension,
+            //so leave the grid alone
+            continue;
+        }
+
+        //Redistribute the bin boundaries so that each
+        //bin has an equal share of the weight
+        float *grid = &_vegas_host_grid[d * (VEGAS_BINS + 1)];
+        double new_grid[VEGAS_BINS + 1];
+        double weight_per_bin = total_weight / VEGAS_BINS;
+        double x_old = 0.0;
+        double x_new = 0.0;
+        double accumulated_weight = 0.0;
+        int j = 1;
+        for(int i = 0; i < VEGAS_BINS; i++)
+        {
+            accumulated_weight += weights[i];
+            x_old = x_new;
+            x_new = grid[i + 1];
+            while(accumulated_weight > weight_per_bin && j < VEGAS_BINS)
+            {
+                accumulated_weight -= weight_per_bin;
+                new_grid[j++] = x_new - (x_new - x_old) * accumulated_weight / weights[i];
+            }
+        }
+        for(; j < VEGAS_BINS; j++)
+        {
+            //Round-off can leave the last boundaries unset
+            new_grid[j] = 1.0;
+        }
+        for(int i = 1; i < VEGAS_BINS; i++)
+        {
+            grid[i] = new_grid[i];
+        }
+        grid[0] = 0.0;
+        grid[VEGAS_BINS] = 1.0;
+    }
 }
 
-void ${integrator.name}::_enqueue_output_buffer_read(float *host_buffer, 
-                                                     size_t count)
+void ${integrator.name}::_enqueue_output_buffer_read(size_t n_groups)
 {
     CHECK_CL_OPERATION(clEnqueueReadBuffer(_command_queue, 
                                            _output, 
                                            CL_FALSE, 
                                            0, 
-                                           count * sizeof(float), 
-                                           host_buffer, 
+                                           2 * n_groups * sizeof(accumulator_t), 
+                                           &_host_output[0], 
                                            0, 
                                            NULL, 
-                                           NULL), 
+                                           _profile_event("readback")), 
                        "Unable to read output buffer");
 }
 
+void ${integrator.name}::_sum_output(const accumulator_t *output, 
+                                     size_t n_groups, 
+                                     double *sum, 
+                                     double *square_sum)
+{
+    *sum = _pairwise_sum(output, n_groups, 2);
+    *square_sum = _pairwise_sum(output + 1, n_groups, 2);
+}
+
+void ${integrator.name}::_reserve_output(size_t n_groups)
+{
+    if(_host_output.size() >= 2 * n_groups)
+    {
+        return;
+    }
+    RELEASE_CL_MEMORY_SAFE(_output);
+    _host_output.resize(2 * n_groups);
+    cl_int error;
+    _output = clCreateBuffer(_context, 
+                             CL_MEM_WRITE_ONLY, 
+                             _host_output.size() * sizeof(accumulator_t), 
+                             NULL, 
+                             &error);
+    CHECK_CL_OPERATION(error, "Unable to create output buffer");
+}
+
+size_t ${integrator.name}::_launch_size(size_t work_item_count, size_t work_group_size, size_t calls)
+{
+    if(calls >= work_item_count)
+    {
+        return work_item_count;
+    }
+    size_t n_groups = (calls + work_group_size - 1) / work_group_size;
+    return (n_groups > 0 ? n_groups : 1) * work_group_size;
+}
+
+void ${integrator.name}::_reserve_vegas_histograms()
+{
+    size_t size = (_vegas_work_item_count / _vegas_work_group_size) 
+                  * $integrator.n_dimensions 
+                  * VEGAS_BINS;
+    if(_vegas_histograms != NULL && _vegas_host_histograms.size() == size)
+    {
+        return;
+    }
+    RELEASE_CL_MEMORY_SAFE(_vegas_histograms);
+    _vegas_host_histograms.resize(size);
+    cl_int error;
+    _vegas_histograms = clCreateBuffer(_context, 
+                                       CL_MEM_WRITE_ONLY, 
+                                       _vegas_host_histograms.size() * sizeof(float), 
+                                       NULL, 
+                                       &error);
+    CHECK_CL_OPERATION(error, "Unable to create Vegas histogram buffer");
+}
+
+void ${integrator.name}::_reserve_run_buffers(const ComputeDevice &device, 
+                                               PendingRun &run, 
+                                               size_t n_bounds, 
+                                               size_t n_slots)
+{
+    cl_int error;
+    if(run.bounds_capacity < n_bounds)
+    {
+        RELEASE_CL_MEMORY_SAFE(run.bounds);
+        run.bounds_capacity = n_bounds;
+        run.bounds = clCreateBuffer(device.context, 
+                                    CL_MEM_READ_ONLY, 
+                                    run.bounds_capacity * sizeof(bound_t), 
+                                    NULL, 
+                                    &error);
+        CHECK_CL_OPERATION(error, "Unable to create integration bound buffer");
+    }
+    if(run.host_output.size() < 2 * n_slots)
+    {
+        RELEASE_CL_MEMORY_SAFE(run.output);
+        run.host_output.resize(2 * n_slots);
+        run.output = clCreateBuffer(device.context, 
+                                    CL_MEM_WRITE_ONLY, 
+                                    run.host_output.size() * sizeof(accumulator_t), 
+                                    NULL, 
+                                    &error);
+        CHECK_CL_OPERATION(error, "Unable to create output buffer");
+    }
+}
+
+double ${integrator.name}::_pairwise_sum(const accumulator_t *values, size_t count, size_t stride)
+{
+    if(count <= 8)
+    {
+        double sum = 0.0;
+        for(size_t i = 0; i < count; i++)
+        {
+            sum += values[i * stride];
+        }
+        return sum;
+    }
+    size_t half = count / 2;
+    return _pairwise_sum(values, half, stride) 
+           + _pairwise_sum(values + half * stride, count - half, stride);
+}
+
+const char * ${integrator.name}::_source_hash = "$source_hash";
+const char * ${integrator.name}::_build_options = "";
 const char * ${integrator.name}::_fixes_source = 
 $fixes_template;
+const char * ${integrator.name}::_accumulation_source = 
+$accumulation_template;
+#if $integrator.rng == "ranlux"
 const char * ${integrator.name}::_ranlux_source = 
 $ranlux_template;
 const char * ${integrator.name}::_initialization_source = 
 $initialization_template;
+#end if
+const char * ${integrator.name}::_random_source = 
+$random_template;
 const char * ${integrator.name}::_integrand_source = 
 $integrand_template;
 const char * ${integrator.name}::_plain_source = 
@@ -508,3 +2773,161 @@ const char * ${integrator.name}::_miser_source =
 $miser_template;
 const char * ${integrator.name}::_vegas_source = 
 $vegas_template;
+const char * ${integrator.name}::_quasi_source = 
+$quasi_template;
+
+void *${integrator.name}_create(int device_selection, int profiling, int shared_runtime)
+{
+    return new ${integrator.name}((${integrator.name}::DeviceSelection)device_selection, 
+                                  profiling != 0,
+                                  shared_runtime ? &FeynmanOpenClRuntime::shared() : NULL);
+}
+
+void ${integrator.name}_destroy(void *integrator)
+{
+    delete (${integrator.name} *)integrator;
+}
+
+void ${integrator.name}_set_monte_carlo_type(void *integrator, int t)
+{
+    ((${integrator.name} *)integrator)->set_monte_carlo_type((${integrator.name}::MonteCarloType)t);
+}
+
+int ${integrator.name}_monte_carlo_type(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->monte_carlo_type();
+}
+
+void ${integrator.name}_set_n_calls(void *integrator, int n)
+{
+    ((${integrator.name} *)integrator)->set_n_calls(n);
+}
+
+int ${integrator.name}_n_calls(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->n_calls();
+}
+
+double ${integrator.name}_chisq(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->chisq();
+}
+
+void ${integrator.name}_set_target_relative_error(void *integrator, double e)
+{
+    ((${integrator.name} *)integrator)->set_target_relative_error(e);
+}
+
+double ${integrator.name}_target_relative_error(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->target_relative_error();
+}
+
+void ${integrator.name}_set_max_calls(void *integrator, int n)
+{
+    ((${integrator.name} *)integrator)->set_max_calls(n);
+}
+
+int ${integrator.name}_max_calls(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->max_calls();
+}
+
+void ${integrator.name}_set_time_budget(void *integrator, double seconds)
+{
+    ((${integrator.name} *)integrator)->set_time_budget(seconds);
+}
+
+double ${integrator.name}_time_budget(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->time_budget();
+}
+
+void ${integrator.name}_autotune(void *integrator)
+{
+    ((${integrator.name} *)integrator)->autotune();
+}
+
+int ${integrator.name}_profile_json(void *integrator, char *buffer, int size)
+{
+    //Copy as much as fits, so that callers can ask again
+    //with a big enough buffer
+    string json = ((${integrator.name} *)integrator)->profile_json();
+    if(buffer != NULL && size > 0)
+    {
+        size_t n = json.size() < (size_t)(size - 1) ? json.size() : (size_t)(size - 1);
+        json.copy(buffer, n);
+        buffer[n] = '\0';
+    }
+    return json.size();
+}
+
+void ${integrator.name}_reset_profile(void *integrator)
+{
+    ((${integrator.name} *)integrator)->reset_profile();
+}
+
+void ${integrator.name}_set_progress_callback(void *integrator, 
+                                              ${integrator.name}::ProgressCallback callback, 
+                                              void *data)
+{
+    ((${integrator.name} *)integrator)->set_progress_callback(callback, data);
+}
+
+void ${integrator.name}_integrate_batch(void *integrator, 
+                                        int n_integrals, 
+                                        const double *bounds, 
+                                        double *results, 
+                                        double *errors)
+{
+    vector<$integrator.evaluation_function.return_type> batch_results(n_integrals > 0 ? n_integrals : 1);
+    vector<$integrator.evaluation_function.return_type> batch_errors(n_integrals > 0 ? n_integrals : 1);
+    ((${integrator.name} *)integrator)->integrate_batch(n_integrals, 
+                                                       bounds, 
+                                                       &batch_results[0], 
+                                                       &batch_errors[0]);
+    for(int i = 0; i < n_integrals; i++)
+    {
+        results[i] = batch_results[i];
+        if(errors != NULL)
+        {
+            errors[i] = batch_errors[i];
+        }
+    }
+}
+
+int ${integrator.name}_n_devices(void *integrator)
+{
+    return ((${integrator.name} *)integrator)->n_devices();
+}
+
+int ${integrator.name}_integrate_batch_async(void *integrator, 
+                                             int n_integrals, 
+                                             const double *bounds)
+{
+    return ((${integrator.name} *)integrator)->integrate_batch_async(n_integrals, bounds);
+}
+
+int ${integrator.name}_ready(void *integrator, int handle)
+{
+    return ((${integrator.name} *)integrator)->ready(handle);
+}
+
+void ${integrator.name}_wait_batch(void *integrator, 
+                                   int handle, 
+                                   int n_integrals, 
+                                   double *results, 
+                                   double *errors)
+{
+    vector<$integrator.evaluation_function.return_type> batch_results(n_integrals > 0 ? n_integrals : 1);
+    vector<$integrator.evaluation_function.return_type> batch_errors(n_integrals > 0 ? n_integrals : 1);
+    ((${integrator.name} *)integrator)->wait_batch(handle, &batch_results[0], &batch_errors[0]);
+    for(int i = 0; i < n_integrals; i++)
+    {
+        results[i] = batch_results[i];
+        if(errors != NULL)
+        {
+            errors[i] = batch_errors[i];
+        }
+    }
+}
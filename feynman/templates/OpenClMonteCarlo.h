@@ -1,6 +1,13 @@
 \#ifndef $include_guard
 \#define $include_guard
 
+//Standard includes
+\#include <vector>
+\#include <string>
+
+//POSIX includes (for timing integrations)
+\#include <sys/time.h>
+
 //OpenCL includes
 \#ifdef __APPLE__
 \#include <OpenCL/opencl.h>
@@ -8,6 +15,8 @@
 \#include <CL/opencl.h>
 \#endif
 
+$runtime_template
+
 class $integrator.name
 {
     public:
@@ -15,38 +24,208 @@ class $integrator.name
         {
             MonteCarloPlain,
             MonteCarloMiser,
-            MonteCarloVegas
+            MonteCarloVegas,
+            MonteCarloQuasi //Randomized quasi-Monte Carlo, with a scrambled 
+                            //Halton sequence in place of random points
+        };
+
+        //The devices to integrate on.  SingleDevice uses the
+        //best device found (preferring GPUs), while AllDevices
+        //also splits plain integrations across every other
+        //available device on every platform, in proportion to
+        //their measured throughput.  Other types always run on
+        //the best device.
+        enum DeviceSelection
+        {
+            SingleDevice,
+            AllDevices
         };
 
-        ${integrator.name}();
+        //The time spent in one stage of integration (program
+        //build, random number initialization, uploads, each
+        //kernel and readback), summed over its runs (see
+        //profile)
+        struct ProfileStage
+        {
+            std::string name; //The name of the stage
+            unsigned long count; //The number of runs of the stage
+            double seconds; //The total time of the runs, on the device
+            double evaluations; //The integrand evaluations made by the runs
+        };
+
+        //With profiling (which is also turned on by setting
+        //the FEYNMAN_OPENCL_PROFILE environment variable to
+        //anything but an empty string or 0), the command
+        //queues time each command, and the times are summed
+        //for each stage.  Integrators attached to a runtime
+        //(e.g. FeynmanOpenClRuntime::shared()) share its 
+        //contexts, command queues and programs, and otherwise
+        //create their own.
+        ${integrator.name}(DeviceSelection device_selection = SingleDevice, 
+                           bool profiling = false, 
+                           FeynmanOpenClRuntime *runtime = NULL);
         ~${integrator.name}();
 
         void set_monte_carlo_type(MonteCarloType t);
         MonteCarloType monte_carlo_type();
 
+        //The number of calls per integration (500000 by
+        //default), which must be positive (other values are
+        //rejected with an error message).  Vegas iterations
+        //make at least two calls each, so Vegas makes more
+        //than n_calls calls when n_calls is tiny.
         void set_n_calls(int n);
         int n_calls();
 
+        //Integrate to a target precision.  With a target
+        //relative error or a time budget (in seconds) set,
+        //integrations run batches of n_calls calls, pooled
+        //into a single estimate (as if all of their calls had
+        //been made at once, so batches without a variance,
+        //e.g. where every point missed the non-zero part of
+        //the integrand, still count), until the combined
+        //error is within the target, another batch would take
+        //the calls past max_calls (50000000 by default, with
+        //zero for no limit), or another batch would overrun
+        //the time budget.  At least one batch is always run
+        //(and if it is exact, it is the result), and zero 
+        //(the default) disables a target or budget.
+        void set_target_relative_error(double e);
+        double target_relative_error();
+        void set_max_calls(int n);
+        int max_calls();
+        void set_time_budget(double seconds);
+        double time_budget();
+
+        //The number of devices used for plain integrations
+        int n_devices();
+
+        //Reports the progress of integrations.  The callback
+        //gets data, the number of calls made so far (not 
+        //counting Vegas warm-up calls), the running estimate
+        //and its error, the chi-squared per degree of freedom 
+        //of the iterations (for Vegas) or batches combined so
+        //far (or zero) and the seconds since the integration
+        //started.  Returning non-zero stops the integration
+        //early, with the estimate so far.  It is called after
+        //each batch of n_calls calls (see
+        //set_target_relative_error) and each Vegas iteration.
+        //Plain integrations started with integrate_batch or 
+        //integrate_batch_async run as one launch, and are
+        //reported once per integral by wait_batch (by which
+        //point they have finished, so they can't be stopped).
+        //A NULL callback (the default) turns reporting off.
+        typedef int (*ProgressCallback)(void *data, 
+                                        long calls, 
+                                        double result, 
+                                        double error, 
+                                        double chisq, 
+                                        double elapsed);
+        void set_progress_callback(ProgressCallback callback, void *data);
+
+        //The chi-squared per degree of freedom of the
+        //iterations of the last integration, if it was a
+        //Vegas integration (or zero)
+        double chisq();
+
+        //Benchmarks the plain integration kernel on each device
+        //with a range of work group sizes and numbers of work
+        //groups per compute unit (and so of points per work
+        //item, for the current number of calls), and switches
+        //to the fastest.  The winning configuration is stored
+        //in the device's profile in the program cache (see
+        //_build_program), and integrators constructed later for
+        //the same code and device start with it.
+        void autotune();
+
+        //Whether profiling is on
+        bool profiling();
+
+        //The stages profiled so far, in the order they were
+        //first run (empty without profiling)
+        std::vector<ProfileStage> profile();
+
+        //The profile as a JSON object, with the device names,
+        //the work sizes of the kernels and the time and 
+        //evaluations per second of each stage
+        std::string profile_json();
+
+        //Discards the stages profiled so far
+        void reset_profile();
+
         $integrator.evaluation_function.return_type operator()($integrator.evaluation_function.argument_signature, $integrator.evaluation_function.return_type *error);
 
+        //Integrates a batch of n_integrals integrals.  The bounds
+        //hold 2 * $integrator.n_dimensions values for each integral, in the
+        //same order as the arguments of operator(), and results
+        //and errors (which may be NULL) receive n_integrals values.
+        //Plain integrations run in a single kernel launch for the
+        //whole batch (unless there is a target precision), other 
+        //types are run one integral at a time.
+        void integrate_batch(int n_integrals, 
+                             const double *bounds, 
+                             $integrator.evaluation_function.return_type *results, 
+                             $integrator.evaluation_function.return_type *errors);
+
+        //A handle to an integration started by integrate_async or
+        //integrate_batch_async, valid until it is waited on
+        typedef int IntegrationHandle;
+
+        //Start an integration (or a batch of integrations, with
+        //bounds as for integrate_batch) without waiting for it to
+        //finish, so that the host can do other work meanwhile.
+        //Plain integrations are enqueued on the device, other
+        //types (and integrations to a target precision) are run
+        //immediately.  The bounds may be reused as soon as these
+        //return.
+        IntegrationHandle integrate_async($integrator.evaluation_function.argument_signature);
+        IntegrationHandle integrate_batch_async(int n_integrals, const double *bounds);
+
+        //Checks whether a started integration has finished
+        bool ready(IntegrationHandle handle);
+
+        //Waits for a started integration to finish and returns
+        //its results, releasing the handle
+        $integrator.evaluation_function.return_type wait(IntegrationHandle handle, $integrator.evaluation_function.return_type *error);
+        void wait_batch(IntegrationHandle handle, 
+                        $integrator.evaluation_function.return_type *results, 
+                        $integrator.evaluation_function.return_type *errors);
+
     private:
         //Don't allow copying due to buffer resources
         ${integrator.name}( const ${integrator.name}& );
         const ${integrator.name}& operator=( const ${integrator.name}& );
 
+        //The type used for integration sums (this must match
+        //accumulator_t in the OpenCL kernels)
+        typedef cl_${integrator.accumulator_type} accumulator_t;
+
+        //The type used for integration bounds (this must match
+        //the bounds of the plain OpenCL kernel)
+        typedef cl_${integrator.bound_type} bound_t;
+
         //OpenCL resources
         MonteCarloType _monte_carlo_type; //The type of Monte Carlo integration
         int _n_calls; //The number of calls for the integration to perform
+        double _target_relative_error; //The target relative error, or 0 for none
+        int _max_calls; //The limit on the calls made to reach a target
+        double _time_budget; //The time allowed to reach a target, or 0 for no limit
+        ProgressCallback _progress_callback; //The progress callback, or NULL
+        void *_progress_data; //The data passed to the progress callback
+        struct timeval _progress_start; //The start of the current integration
+        long _progress_calls; //The calls made by the finished batches of the integration
+        long _batch_calls; //The calls made by the last batch (fewer than n_calls if
+                           //the progress callback stopped its Vegas iterations)
+        bool _stop_requested; //Whether the callback asked for the integration to stop
 	cl_platform_id _platform; //The platform to use
         cl_device_id _device; //The device to run on
         size_t _compute_units; //The number of compute units on the device (CL_DEVICE_MAX_COMPUTE_UNITS)
-        size_t _max_concurrent_work_groups; //The maximum number of concurrent blocks allowed per multiprocessor
         cl_context _context; //The context in which to execute
         cl_command_queue _command_queue; //The command queue on which to execute commands
         cl_program _program; //The compiled source code
+        bool _profiling; //Whether commands are profiled
         
         //Utility kernels
-        cl_kernel _mem_set; //The memset kernel
         cl_kernel _rng_init; //The random initialization kernel
         size_t _rng_init_work_group_size; //The size to use for random number 
                                           //generation initialization (not a performance
@@ -57,73 +236,447 @@ class $integrator.name
                                           //size multiple for this.  If you use the maximum
                                           //kernel work group size, OpenCL sometimes throws
                                           //a fit, even though technically, that should work.
+        cl_uint _random_seed; //The base seed, read from the clock once at construction
+#if $integrator.rng == "philox"
+
+        //Philox random number generation, which needs no
+        //states or initialization kernel.  The key is
+        //_random_seed (each device adds its seed_offset).
+        cl_ulong _random_launches; //The number of kernel launches so far, which numbers
+                                   //the random numbers of each launch
+#else
+        cl_uint _random_seeds_used; //The number of RANLUXCL seeds drawn so far, which 
+                                    //are _random_seed plus a count, so that every 
+                                    //(re)seeding of every device draws an independent 
+                                    //stream
+#end if
         
+        //A device used for plain integrations, with its own
+        //context (since devices may be on different platforms)
+        struct ComputeDevice
+        {
+            cl_platform_id platform; //The platform of the device
+            cl_device_id device; //The device
+            size_t compute_units; //The number of compute units on the device
+            cl_context context; //The context in which to execute
+            cl_command_queue command_queue; //The command queue on which to execute commands
+            cl_program program; //The compiled source code
+            cl_kernel rng_init; //The random initialization kernel
+            size_t rng_init_work_group_size; //The size to use for random number initialization
+            cl_mem rng_states; //Random number generator states, shared by the kernels 
+                               //run on the device (one per work item of the largest)
+            size_t rng_state_count; //The number of states in rng_states
+            cl_uint seed_offset; //Added to the Philox key, so that each device
+                                 //draws an independent stream
+            size_t work_group_size_limit; //The largest work group size to use, or 0 for 
+                                          //the largest each kernel allows (from the 
+                                          //device's profile, see autotune)
+            size_t concurrent_work_groups; //The number of work groups launched per compute 
+                                           //unit (from the device's profile, see autotune)
+            cl_kernel plain; //The plain MC integration kernel
+            size_t plain_work_group_size; //Size of an individual thread block
+            size_t plain_work_item_count; //Global number of work items (0 until the
+                                          //first plain integration)
+            double throughput; //The measured (or, before the first integration, 
+                               //estimated) relative speed of the device
+            bool throughput_measured; //Whether throughput has been measured
+        };
+
         //Plain integration resources
-        cl_kernel _plain; //The plain MC integration kernel
-        size_t _plain_work_group_size; //Size of an individual thread block
-                                       //Filled by _calculate_kernel_execution_parameters
-        size_t _plain_work_item_count; //Global number of work items
-        cl_mem _plain_rng_states; //Random number generator states
+        std::vector<ComputeDevice> _devices; //The devices for plain integration.  The first 
+                                             //is _device, and holds its own references to 
+                                             //the resources above.
                                        
         //Miser integration resources
         cl_kernel _miser; //The miser MC integration kernel
         size_t _miser_work_group_size; //Size of an individual thread block
                                        //Filled by _calculate_kernel_execution_parameters
-        size_t _miser_work_item_count; //Global number of work items
-        cl_mem _miser_rng_states; //Random number generator states
+        size_t _miser_work_item_count; //Global number of work items (0 until the
+                                       //first Miser integration)
+        cl_mem _miser_regions; //The bounds of the regions sampled by a launch, in the 
+                               //unit hypercube, MISER_MAX_REGIONS * 2 * n_dimensions floats
+        cl_mem _miser_region_calls; //The number of points to sample in each region, 
+                                    //MISER_MAX_REGIONS cl_uints
+        cl_mem _miser_region_sums; //The sums for each region, 
+                                   //MISER_MAX_REGIONS * MISER_SUM_SIZE accumulator_ts
+        cl_mem _miser_region_counts; //The point counts for each region, 
+                                     //MISER_MAX_REGIONS * MISER_COUNT_SIZE cl_uints
+        double _miser_estimate_fraction; //The fraction of a region's calls used to
+                                         //choose its bisection
+        int _miser_min_calls; //The minimum number of calls used to estimate variances
+        int _miser_min_calls_per_bisection; //The minimum number of calls for a region 
+                                            //to be bisected
+        double _miser_alpha; //The call allocation exponent (see the GSL documentation)
+
+        //A sub-region waiting in the Miser work queue
+        struct MiserRegion
+        {
+            float lower[$integrator.n_dimensions]; //Lower bounds in the unit hypercube
+            float upper[$integrator.n_dimensions]; //Upper bounds in the unit hypercube
+            cl_uint calls; //The number of calls allocated to the region
+        };
 
         //Vegas integration resources
         cl_kernel _vegas; //The vegas MC integration kernel
         size_t _vegas_work_group_size; //Size of an individual thread block
                                        //Filled by _calculate_kernel_execution_parameters
-        size_t _vegas_work_item_count; //Global number of work items
-        cl_mem _vegas_rng_states; //Random number generator states
+        size_t _vegas_work_item_count; //Global number of work items (0 until the
+                                       //first Vegas integration)
+        cl_mem _vegas_grid; //The grid bin boundaries, n_dimensions * (VEGAS_BINS + 1) floats
+        cl_mem _vegas_histograms; //The per-work-group histograms of squared function 
+                                  //values, n_work_groups * n_dimensions * VEGAS_BINS floats
+        std::vector<float> _vegas_host_grid; //Host copy of _vegas_grid
+        std::vector<float> _vegas_host_histograms; //Host copy of _vegas_histograms
+        int _vegas_iterations; //The number of iterations per integration
+        int _vegas_warmup_calls; //The number of calls used to adapt the grid before
+                                 //results are accumulated
+        double _vegas_chisq; //The chi-squared per degree of freedom of the last integration
+
+        //Quasi integration resources
+        cl_kernel _quasi; //The quasi MC integration kernel
+        size_t _quasi_work_group_size; //Size of an individual thread block
+        size_t _quasi_work_item_count; //Global number of work items (0 until the
+                                       //first quasi integration)
+        int _quasi_randomizations; //The number of independent scramblings of the sequence
+                                   //to split the calls between, whose spread gives the error
+        cl_uint _quasi_seed; //The state of the (xorshift) generator of scrambling seeds
 
         //Output resources
-        cl_mem _output; //The global result output, 2 * sizeof(float)
-                        //Format:
-                        //  float sum_of_all_points; //For mean calculation
-                        //  float sum_of_all_squares_of_points; //For variance calculation
+        cl_mem _output; //The per-work-group result output, 2 * n_work_groups accumulator_ts
+                        //Format (for each work group):
+                        //  accumulator_t sum_of_all_points; //For mean calculation
+                        //  accumulator_t sum_of_all_squares_of_points; //For variance calculation
+        std::vector<accumulator_t> _host_output; //Host copy of _output
+
+        //The share of a started plain integration on one device
+        struct PendingRun
+        {
+            PendingRun() :
+            kernel_event(NULL),
+            read_event(NULL),
+            output(NULL),
+            bounds(NULL),
+            bounds_capacity(0),
+            groups_per_integral(0),
+            total_n_calls(0)
+            {
+            }
+
+            cl_event kernel_event; //The integration kernel, when timing devices
+            cl_event read_event; //The output read which ends the run (NULL 
+                                 //once waited on, or if the device has no share)
+            cl_mem output; //The per-slot result output, in the format of _output
+            cl_mem bounds; //The bounds of the integrals, n_integrals * 2 * n_dimensions bound_ts
+            size_t bounds_capacity; //The number of bound_ts bounds can hold
+            std::vector<accumulator_t> host_output; //Host copy of output
+            cl_uint groups_per_integral; //The number of output slots per integral
+            cl_uint total_n_calls; //The number of calls made for each integral on the device
+        };
+
+        //A started integration (see integrate_batch_async).
+        //The buffers are kept when the handle is released, to
+        //be reused by the next integration in the slot.
+        struct PendingIntegration
+        {
+            PendingIntegration() :
+            in_use(false),
+            synchronous(false),
+            report_progress(false),
+            n_integrals(0)
+            {
+            }
 
-        //Runs the following method for all kernels
-        void _configure_kernels();
+            bool in_use; //Whether the handle is still to be waited on
+            bool synchronous; //Whether the integration was run immediately
+            bool report_progress; //Whether wait_batch reports the integrals' progress
+            int n_integrals; //The number of integrals in the batch
+            std::vector<bound_t> host_bounds; //The bounds of the integrals, uploaded to each device
+            std::vector<double> volumes; //The volume of each integral
+            std::vector<PendingRun> runs; //The run on each of _devices
+            struct timeval start; //When the integration was started (for progress reports)
+            std::vector<$integrator.evaluation_function.return_type> results; //Results of synchronous integrations
+            std::vector<$integrator.evaluation_function.return_type> errors; //Errors of synchronous integrations
+        };
+        std::vector<PendingIntegration *> _pending; //Indexed by IntegrationHandle
+
+        //A profiled command which may not have finished yet
+        struct ProfileEvent
+        {
+            const char *stage; //The stage of the command
+            cl_event event; //The command's event
+            double evaluations; //The integrand evaluations made by the command
+        };
+        std::vector<ProfileEvent> _profile_events; //Commands waiting to be timed
+        std::vector<ProfileStage> _profile_stages; //Times of the stages so far
+
+        //Runs an integration once, with _n_calls calls
+        $integrator.evaluation_function.return_type _integrate($integrator.evaluation_function.argument_signature, $integrator.evaluation_function.return_type *error);
+
+        //Calls the progress callback, if there is one,
+        //returning whether the integration should stop
+        bool _report_progress(long calls, double result, double error, double chisq);
+
+        //Starts a batch of integrations (see integrate_batch_async),
+        //running them immediately if synchronous is set
+        IntegrationHandle _start_batch(int n_integrals, const double *bounds, bool synchronous);
+
+        //Grabs the program for a device from a runtime, or
+        //builds it (see _build_program) and adds it to the
+        //runtime
+        cl_program _runtime_program(FeynmanOpenClRuntime &runtime,
+                                    cl_platform_id platform, 
+                                    cl_device_id device, 
+                                    cl_context context);
+
+        //Creates and builds the program for a device, loading
+        //the binary from the program cache if possible, and
+        //otherwise building it from source and storing the
+        //binary in the cache.  The cache directory is
+        //FEYNMAN_OPENCL_CACHE_DIR (if set, with an empty value
+        //disabling the cache), or else ~/.feynman/opencl-cache.
+        cl_program _build_program(cl_platform_id platform, 
+                                  cl_device_id device, 
+                                  cl_context context);
+
+        //Computes the path of a file in the program cache for
+        //a device (the program binary or the device's profile,
+        //told apart by the extension), creating the cache
+        //directory if necessary.  Returns an empty string if
+        //there is no usable cache.
+        std::string _cache_path(cl_platform_id platform, 
+                                cl_device_id device, 
+                                const char *extension);
+
+        //Tries to create and build a program from a cached
+        //binary, returning NULL if the binary is missing or
+        //invalid
+        cl_program _load_program_binary(const std::string &path, 
+                                        cl_context context, 
+                                        cl_device_id device);
+
+        //Stores the binary of a program in the cache (failures
+        //are ignored, since the cache is only an optimization)
+        void _save_program_binary(const std::string &path, cl_program program);
+
+        //Loads the work group configuration of a device from
+        //its profile, leaving the device alone if there is no
+        //(valid) profile
+        void _load_profile(ComputeDevice &device);
+
+        //Stores the work group configuration of a device in
+        //its profile (failures are ignored, as for binaries)
+        void _save_profile(const ComputeDevice &device);
+
+        //Times the plain kernel on a device, as configured,
+        //integrating the unit hypercube with _n_calls calls
+        //(the bounds of which must already be in run), and
+        //returns the best time per call over a few launches
+        double _time_plain_kernel(ComputeDevice &device, PendingRun &run);
+
+        //Returns an event for a command of a profiled stage to
+        //fill, which is timed once the command has finished,
+        //or NULL without profiling
+        cl_event *_profile_event(const char *stage, double evaluations = 0.0);
+
+        //Adds the times of the finished profiled commands to
+        //their stages, and releases their events
+        void _collect_profile_events();
+
+        //Adds a run to a profiled stage
+        void _add_profile_time(const char *stage, double seconds, double evaluations);
+
+        //The run time of a finished command on a profiling
+        //command queue, in seconds
+        static double _event_seconds(cl_event event);
+
+        //Appends a string to a JSON document as a quoted,
+        //escaped string
+        static void _append_json_string(std::string &json, const std::string &s);
+
+        //Chains the 64-bit FNV-1a hash of a string onto hash
+        static unsigned long long _hash_string(unsigned long long hash, const char *s);
+
+        //Adds a device to _devices, grabbing its resources
+        //from a runtime (or sharing them, for _device)
+        void _add_device(FeynmanOpenClRuntime &runtime, 
+                         cl_platform_id platform, 
+                         cl_device_id device);
+
+        //Checks whether a device supports the accumulation mode
+        bool _supports_accumulation(cl_device_id device);
+
+        //Sets up an integration type the first time it is
+        //used: creates its kernel and buffers, configures the
+        //kernel (on each device, for plain integrations) and
+        //makes sure the devices' random number generator
+        //states cover its work items
+        void _prepare(MonteCarloType t);
 
         //Calculates the work group size for a particular kernel
-        //assuming that the following members have already been
-        //set:
-        //
-        //  _n_calls
-        //  _device
-        //  _max_device_work_size
+        //on a device.
         //
         //It uses the following information
         //
-        //   CL_DEVICE_MAX_WORK_ITEM_SIZES (max N-dimensional work group sizes, from _max_device_work_size)
         //   CL_KERNEL_WORK_GROUP_SIZE (max work group size for this kernel)
         //   CL_KERNEL_PREFERRED_WORK_GROUP_SIZE_MULTIPLE (recommended work 
         //   group size for this kernel)
+        //   The device's work group size limit and number of
+        //   concurrent work groups (see autotune)
         //
-        //to find the optimial execution size
-        void _configure_kernel(cl_kernel kernel,
+        //to find the execution size
+        void _configure_kernel(const ComputeDevice &device,
+                               cl_kernel kernel,
                                size_t *work_group_size,
-                               size_t *work_item_count,
-                               cl_mem *rng_buffer);
+                               size_t *work_item_count);
+
+        //Grows the random number generator states of a device
+        //to cover at least work_item_count work items, 
+        //creating and seeding a new set of states if it has
+        //too few (with Philox, which has no states, this does
+        //nothing)
+        void _reserve_rng_states(ComputeDevice &device, size_t work_item_count);
+
+        //Sets the random number argument of a plain, Miser or
+        //Vegas kernel on a device for its next launch, which
+        //is either the device's random number generator states
+        //or, with Philox, the key and launch number
+        void _set_random_argument(cl_kernel kernel, const ComputeDevice &device);
+
+        //Calculates the number of points sampled in a Miser
+        //region with the specified number of calls.  Regions
+        //with fewer than _miser_min_calls_per_bisection calls
+        //are integrated with all of their calls, the rest are
+        //sampled with a fraction of their calls to choose a
+        //bisection.
+        cl_uint _miser_sample_calls(cl_uint calls);
+
+        //Samples up to MISER_MAX_REGIONS regions with the
+        //Miser kernel, filling sums with MISER_SUM_SIZE sums
+        //and counts with MISER_COUNT_SIZE point counts per
+        //region.  The integration bounds must already be set
+        //on the Miser kernel.
+        void _miser_sample_regions(const std::vector<MiserRegion> &regions,
+                                   std::vector<accumulator_t> &sums,
+                                   std::vector<cl_uint> &counts);
+
+        //Resets the Vegas grid to uniformly spaced bins
+        void _vegas_reset_grid();
 
-        //Enqueues an output buffer clear
-        void _enqueue_output_buffer_clear();
+        //The number of calls for each of _vegas_iterations
+        //iterations of total_calls calls, which is at least
+        //the two needed to estimate the iteration's variance
+        cl_uint _vegas_iteration_calls(int total_calls);
 
-        //Enqueues an output buffer copy back to the host
-        void _enqueue_output_buffer_read(float *host_buffer, 
-                                         size_t count);
+        //Runs a single Vegas iteration with the current grid,
+        //returning the unscaled mean and the variance of the
+        //mean for the iteration, and then refines the grid.
+        //The integration bounds must already be set on the
+        //Vegas kernel.
+        void _vegas_iteration(cl_uint calls, double *mean, double *variance);
 
-        //Static source code for the OpenCL program
+        //Refines the Vegas grid using the histograms of the
+        //n_groups work groups of the last iteration (this is
+        //the grid refinement algorithm used by GSL)
+        void _vegas_refine_grid(size_t n_groups);
+
+        //Enqueues a copy of the results of the first n_groups
+        //work groups from the output buffer to _host_output
+        void _enqueue_output_buffer_read(size_t n_groups);
+
+        //Sums the results of n_groups work groups in a host
+        //copy of an output buffer (after the read has finished)
+        void _sum_output(const accumulator_t *output, 
+                         size_t n_groups, 
+                         double *sum, 
+                         double *square_sum);
+
+        //Grows the output buffer (and its host copy) to hold
+        //the results of at least n_groups work groups
+        void _reserve_output(size_t n_groups);
+
+        //The number of work items to launch a kernel with to
+        //evaluate calls points: all of its work items, or, if
+        //there are fewer calls than work items, just enough
+        //work groups to give every work item a point
+        static size_t _launch_size(size_t work_item_count, size_t work_group_size, size_t calls);
+
+        //Sizes the Vegas histogram buffer (and its host copy)
+        //for the work groups of the Vegas kernel
+        void _reserve_vegas_histograms();
+
+        //Grows the buffers of a pending run (and their host
+        //copies) to hold at least n_bounds bounds and n_slots
+        //output slots
+        void _reserve_run_buffers(const ComputeDevice &device, 
+                                  PendingRun &run, 
+                                  size_t n_bounds, 
+                                  size_t n_slots);
+
+        //Sums count values, stride apart, pairwise (which
+        //keeps the round-off error growing logarithmically
+        //rather than linearly in count)
+        static double _pairwise_sum(const accumulator_t *values, size_t count, size_t stride);
+
+        //Static source code for the OpenCL program, the hash
+        //of the source code (computed at generation time) and
+        //the program build options
+        static const char * _source_hash;
+        static const char * _build_options;
         static const char * _fixes_source;
+        static const char * _accumulation_source;
+#if $integrator.rng == "ranlux"
         static const char * _ranlux_source;
         static const char * _initialization_source;
+#end if
+        static const char * _random_source;
         static const char * _integrand_source;
         static const char * _plain_source;
         static const char * _miser_source;
         static const char * _vegas_source;
+        static const char * _quasi_source;
 };
 
+//C interface, used to load the integrator from a shared
+//library (see feynman.compilation).  Integrators are passed
+//as opaque pointers, and results and errors are returned in
+//double precision.
+extern "C"
+{
+    void *${integrator.name}_create(int device_selection, int profiling, int shared_runtime);
+    void ${integrator.name}_destroy(void *integrator);
+    void ${integrator.name}_set_monte_carlo_type(void *integrator, int t);
+    int ${integrator.name}_monte_carlo_type(void *integrator);
+    void ${integrator.name}_set_n_calls(void *integrator, int n);
+    int ${integrator.name}_n_calls(void *integrator);
+    double ${integrator.name}_chisq(void *integrator);
+    void ${integrator.name}_set_target_relative_error(void *integrator, double e);
+    double ${integrator.name}_target_relative_error(void *integrator);
+    void ${integrator.name}_set_max_calls(void *integrator, int n);
+    int ${integrator.name}_max_calls(void *integrator);
+    void ${integrator.name}_set_time_budget(void *integrator, double seconds);
+    double ${integrator.name}_time_budget(void *integrator);
+    void ${integrator.name}_autotune(void *integrator);
+    int ${integrator.name}_profile_json(void *integrator, char *buffer, int size); //Returns the 
+                                                                                  //full length
+    void ${integrator.name}_reset_profile(void *integrator);
+    void ${integrator.name}_set_progress_callback(void *integrator, 
+                                                  ${integrator.name}::ProgressCallback callback, 
+                                                  void *data);
+    void ${integrator.name}_integrate_batch(void *integrator, 
+                                            int n_integrals, 
+                                            const double *bounds, 
+                                            double *results, 
+                                            double *errors);
+    int ${integrator.name}_n_devices(void *integrator);
+    int ${integrator.name}_integrate_batch_async(void *integrator, 
+                                                 int n_integrals, 
+                                                 const double *bounds);
+    int ${integrator.name}_ready(void *integrator, int handle);
+    void ${integrator.name}_wait_batch(void *integrator, 
+                                       int handle, 
+                                       int n_integrals, 
+                                       double *results, 
+                                       double *errors);
+}
+
 \#endif //$include_guard
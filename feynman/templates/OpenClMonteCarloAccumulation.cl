@@ -0,0 +1,64 @@
+#if $integrator.accumulation == "double"
+//Accumulate integration sums in double precision
+typedef double accumulator_t;
+#else
+//Accumulate integration sums in single precision
+typedef float accumulator_t;
+#end if
+
+//Forward declarations to make Apple's compiler happy
+inline void accumulate(accumulator_t *sum, accumulator_t *compensation, const accumulator_t value);
+inline void reduce_local_sums(__local accumulator_t *sums, __local accumulator_t *square_sums);
+
+/*
+ * Adds value to sum.  The compensation must start out at
+ * zero and be passed along with the same sum every time, 
+ * but it is only used when accumulating with Kahan 
+ * summation (where it holds the low-order bits lost from
+ * the sum).
+ */
+inline void accumulate(accumulator_t *sum, accumulator_t *compensation, const accumulator_t value)
+{
+#if $integrator.accumulation == "kahan"
+    accumulator_t y = value - *compensation;
+    accumulator_t t = *sum + y;
+    *compensation = (t - *sum) - y;
+    *sum = t;
+#else
+    *sum += value;
+#end if
+}
+
+/*
+ * Sums the first get_local_size(0) entries of each of the
+ * local arrays with a tree reduction, leaving the totals in
+ * the first entries.  This must be reached by every work
+ * item in the work group, and the arrays must already be
+ * filled and visible (i.e. after a barrier).  This is a
+ * stand-in for OpenCL 2.0's work_group_reduce_add.
+ */
+inline void reduce_local_sums(__local accumulator_t *sums, __local accumulator_t *square_sums)
+{
+    unsigned int local_id = get_local_id(0);
+    unsigned int local_size = get_local_size(0);
+
+    //Start at half of the smallest power of two which
+    //covers the work group, so that work groups of any
+    //size can be reduced
+    unsigned int stride = 1;
+    while(stride < local_size)
+    {
+        stride <<= 1;
+    }
+    stride >>= 1;
+
+    for(; stride > 0; stride >>= 1)
+    {
+        if(local_id < stride && (local_id + stride) < local_size)
+        {
+            sums[local_id] += sums[local_id + stride];
+            square_sums[local_id] += square_sums[local_id + stride];
+        }
+        barrier(CLK_LOCAL_MEM_FENCE);
+    }
+}
@@ -14,10 +14,10 @@
 #define M_PI M_PI_F
 #endif //M_PI
 
-//Forward declaration to make Apple's compiler happy
-inline void atomic_add_float(volatile __global float *source, const float operand);
+//Forward declarations to make Apple's compiler happy
+inline void atomic_add_local_float(volatile __local float *source, const float operand);
 
-inline void atomic_add_float(volatile __global float *source, const float operand)
+inline void atomic_add_local_float(volatile __local float *source, const float operand)
 {
     union
     {
@@ -34,7 +34,7 @@ inline void atomic_add_float(volatile __global float *source, const float operan
         prev_value.float_value = *source;
         new_value.float_value = prev_value.float_value + operand;
     }
-    while(atomic_cmpxchg((volatile __global unsigned int *)source, prev_value.int_value, new_value.int_value) != prev_value.int_value);
+    while(atomic_cmpxchg((volatile __local unsigned int *)source, prev_value.int_value, new_value.int_value) != prev_value.int_value);
 }
 
 __kernel void mem_set(float value, __global float *mem)
@@ -0,0 +1,99 @@
+#if $integrator.rng == "philox"
+/*
+ * Random numbers from Philox4x32-10 (Salmon et al., "Parallel
+ * Random Numbers: As Easy as 1, 2, 3"), a counter-based
+ * generator.  Each draw is a function of a key and a counter
+ * alone, so there is no state to keep between launches: the
+ * host passes the key and the number of the launch as the
+ * random source, and each work item counts its own draws.
+ */
+#define RANDOM_SOURCE_ARGUMENT uint4 random_source
+
+typedef struct
+{
+    uint4 counter; //The draw, work item and launch (low and high words)
+    uint2 key; //The seed and device
+} random_state_t;
+#else
+/*
+ * Random numbers from RANLUXCL, whose states are stored in
+ * global memory (one per work item) between launches.
+ */
+#define RANDOM_SOURCE_ARGUMENT __global ranluxcl_state_t *random_source
+
+typedef ranluxcl_state_t random_state_t;
+#end if
+
+//Forward declarations to make Apple's compiler happy
+inline void random_start(random_state_t *state, RANDOM_SOURCE_ARGUMENT);
+inline float4 random_float4(random_state_t *state);
+inline void random_finish(random_state_t *state, RANDOM_SOURCE_ARGUMENT);
+#if $integrator.rng == "philox"
+inline uint4 philox4x32_10(uint4 counter, uint2 key);
+
+/*
+ * Computes the Philox4x32 block for a counter and key, with
+ * 10 rounds.
+ */
+inline uint4 philox4x32_10(uint4 counter, uint2 key)
+{
+    for(unsigned int i = 0; i < 10; i++)
+    {
+        if(i > 0)
+        {
+            key.x += 0x9E3779B9U;
+            key.y += 0xBB67AE85U;
+        }
+        uint high_0 = mul_hi(0xD2511F53U, counter.x);
+        uint low_0 = 0xD2511F53U * counter.x;
+        uint high_1 = mul_hi(0xCD9E8D57U, counter.z);
+        uint low_1 = 0xCD9E8D57U * counter.z;
+        counter = (uint4)(high_1 ^ counter.y ^ key.x,
+                          low_1,
+                          high_0 ^ counter.w ^ key.y,
+                          low_0);
+    }
+    return counter;
+}
+#end if
+
+/*
+ * Prepares a work item's random number generator at the
+ * start of a kernel.
+ */
+inline void random_start(random_state_t *state, RANDOM_SOURCE_ARGUMENT)
+{
+#if $integrator.rng == "philox"
+    state->key = random_source.xy;
+    state->counter = (uint4)(0, get_global_id(0), random_source.z, random_source.w);
+#else
+    ranluxcl_download_seed(state, random_source);
+#end if
+}
+
+/*
+ * Draws four uniform random numbers in [0, 1).
+ */
+inline float4 random_float4(random_state_t *state)
+{
+#if $integrator.rng == "philox"
+    uint4 bits = philox4x32_10(state->counter, state->key);
+    state->counter.x++;
+
+    //Keep the top 24 bits, which a float holds exactly
+    return convert_float4(bits >> 8) * (1.0f / 16777216.0f);
+#else
+    return ranluxcl32(state);
+#end if
+}
+
+/*
+ * Stores a work item's random number generator at the end of
+ * a kernel, so that the next launch continues its stream.
+ */
+inline void random_finish(random_state_t *state, RANDOM_SOURCE_ARGUMENT)
+{
+#if $integrator.rng == "ranlux"
+    ranluxcl_upload_seed(state, random_source);
+#end if
+}
@@ -1,73 +1,97 @@
 #define MAX_PLAIN_MONTE_CARLO_WORK_GROUP_SIZE 1024
 
 __kernel void plain_integrate(
-    unsigned int points_per_worker,
-    __global ranluxcl_state_t *ranluxcl_states,
-    __global float *result,
-    $integrator.evaluation_function.argument_signature
+    unsigned int calls_per_integral,
+    RANDOM_SOURCE_ARGUMENT,
+    __global accumulator_t *result,
+    __global const $integrator.bound_type *bounds,
+    unsigned int n_integrals,
+    unsigned int groups_per_integral
     )
 {
     //The local (workgroup-shared) array where final results
     //will be stored and summed.
-    __local float local_sums[MAX_PLAIN_MONTE_CARLO_WORK_GROUP_SIZE];
-    __local float local_square_sums[MAX_PLAIN_MONTE_CARLO_WORK_GROUP_SIZE];
+    __local accumulator_t local_sums[MAX_PLAIN_MONTE_CARLO_WORK_GROUP_SIZE];
+    __local accumulator_t local_square_sums[MAX_PLAIN_MONTE_CARLO_WORK_GROUP_SIZE];
 
     //Thread-local variables
     unsigned int local_id = get_local_id(0);
-    float private_sum = 0.0;
-    float private_square_sum = 0.0;
+    unsigned int work_items_per_integral = groups_per_integral * get_local_size(0);
 
-    //Download the random number generator
-    ranluxcl_state_t ranluxcl_state;
-    ranluxcl_download_seed(&ranluxcl_state, ranluxcl_states);
+    //Start the random number generator
+    random_state_t random_state;
+    random_start(&random_state, random_source);
 
-    //Loop over and evaluate random phase-space points.
-    for(unsigned int i = 0; i < points_per_worker; i++)
+    //Each integral is split into groups_per_integral slots,
+    //and each work group takes every n_groups'th slot, so
+    //that a batch of integrals runs in a single launch.  The
+    //loop bounds are the same for every work item in the
+    //group, so the barriers below are safe.
+    unsigned int n_slots = n_integrals * groups_per_integral;
+    for(unsigned int slot = get_group_id(0); slot < n_slots; slot += get_num_groups(0))
     {
-        //Generate a random phase-space point
-        #set $n_blocks = len($integrator.integrand.argument_types) / 4
-        #set $n_blocks = $n_blocks + 1 if len($integrator.integrand.argument_types) % 4 else 0
-        float4 phase_space[$n_blocks];
-        for(unsigned int p = 0; p < $n_blocks; p++)
-        {
-            phase_space[p] = ranluxcl32(&ranluxcl_state);
-        }
-
-        //Evaluate the phase space point and add it to the sum
-        #set $struct_accessors = ["s%i" % i for i in xrange(0, 4)]
+        //Grab the bounds of this slot's integral, which are
+        //stored in the same order as the arguments of the
+        //integrator
         #set $n_args = len($integrator.integrand.argument_types)
-        #set $variable_specs = ["phase_space[%i].%s * (%s - %s) + %s" % (i/4, $struct_accessors[i % 4], $integrator.evaluation_function.argument_names[2*i + 1], $integrator.evaluation_function.argument_names[2*i], $integrator.evaluation_function.argument_names[2*i]) for i in xrange(0, $n_args)]
-        float value = ${integrator.integrand.name}(
-            ${",\n".join($variable_specs)}
-        );
-        private_sum += value;
-        private_square_sum += (value * value);
-    }
+        __global const $integrator.bound_type *integral_bounds = bounds + (slot / groups_per_integral) * ${2 * $n_args};
 
-    //Store the local result
-    local_sums[local_id] = private_sum;
-    local_square_sums[local_id] = private_square_sum;
+        accumulator_t private_sum = 0.0;
+        accumulator_t private_square_sum = 0.0;
+        accumulator_t private_sum_compensation = 0.0;
+        accumulator_t private_square_sum_compensation = 0.0;
 
-    //Make sure everyone stores their results
-    barrier(CLK_LOCAL_MEM_FENCE);
+        //Split the integral's calls between its work items,
+        //giving the first calls_per_integral % 
+        //work_items_per_integral of them an extra point, so
+        //that exactly calls_per_integral points are evaluated
+        unsigned int integral_work_item = (slot % groups_per_integral) * get_local_size(0) + local_id;
+        unsigned int n_points = calls_per_integral / work_items_per_integral
+                                + (integral_work_item < calls_per_integral % work_items_per_integral ? 1 : 0);
 
-    //Upload the random number generator
-    ranluxcl_upload_seed(&ranluxcl_state, ranluxcl_states);
+        //Loop over and evaluate random phase-space points.
+        for(unsigned int i = 0; i < n_points; i++)
+        {
+            //Generate a random phase-space point
+            #set $n_blocks = ($n_args + 3) / 4
+            float4 phase_space[$n_blocks];
+            for(unsigned int p = 0; p < $n_blocks; p++)
+            {
+                phase_space[p] = random_float4(&random_state);
+            }
 
-    //If this is the first thread, go through and sum
-    //the results, storing the answer to global memory
-    if(local_id == 0)
-    {
-        float local_sum = 0.0;
-        float local_square_sum = 0.0;
-        unsigned int local_size = get_local_size(0);
-        for(unsigned int i = 0; i < local_size; i++)
+            //Evaluate the phase space point and add it to the sum
+            #set $struct_accessors = ["s%i" % i for i in xrange(0, 4)]
+            #set $variable_specs = ["phase_space[%i].%s * (integral_bounds[%i] - integral_bounds[%i]) + integral_bounds[%i]" % (i/4, $struct_accessors[i % 4], 2*i + 1, 2*i, 2*i) for i in xrange(0, $n_args)]
+            accumulator_t value = ${integrator.integrand.name}(
+                ${",\n".join($variable_specs)}
+            );
+            accumulate(&private_sum, &private_sum_compensation, value);
+            accumulate(&private_square_sum, &private_square_sum_compensation, value * value);
+        }
+
+        //Store the local result
+        local_sums[local_id] = private_sum;
+        local_square_sums[local_id] = private_square_sum;
+
+        //Make sure everyone stores their results
+        barrier(CLK_LOCAL_MEM_FENCE);
+
+        //Sum the work group's results and store them in
+        //the slot of the output.  The host sums the slots
+        //of each integral.
+        reduce_local_sums(local_sums, local_square_sums);
+        if(local_id == 0)
         {
-            local_sum += local_sums[i];
-            local_square_sum += local_square_sums[i];
+            result[2 * slot] = local_sums[0];
+            result[2 * slot + 1] = local_square_sums[0];
         }
 
-        atomic_add_float(result, local_sum);
-        atomic_add_float(result + 1, local_square_sum);
+        //Make sure the sums are stored before they are
+        //overwritten by the next slot
+        barrier(CLK_LOCAL_MEM_FENCE);
     }
+
+    //Finish with the random number generator
+    random_finish(&random_state, random_source);
 }
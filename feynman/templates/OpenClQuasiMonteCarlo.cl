@@ -0,0 +1,111 @@
+#define MAX_QUASI_MONTE_CARLO_WORK_GROUP_SIZE 1024
+
+#set $n_args = len($integrator.integrand.argument_types)
+//Forward declarations to make Apple's compiler happy
+inline unsigned int quasi_hash(unsigned int x);
+inline float quasi_coordinate(unsigned int index,
+                              unsigned int base,
+                              unsigned int seed,
+                              unsigned int dimension);
+
+/*
+ * Mixes the bits of a 32-bit integer, so that nearby inputs
+ * give unrelated outputs.
+ */
+inline unsigned int quasi_hash(unsigned int x)
+{
+    x ^= x >> 16;
+    x *= 0x7feb352dU;
+    x ^= x >> 15;
+    x *= 0x846ca68bU;
+    x ^= x >> 16;
+    return x;
+}
+
+/*
+ * Computes a coordinate of point index of the scrambled
+ * Halton sequence, which is the radical inverse of index in
+ * a prime base with each digit passed through the random
+ * permutation (multiplier * digit + shift) mod base.  The
+ * permutation is drawn from the seed, the dimension and the
+ * digit position, and digits are generated (including the
+ * scrambled zeros past the end of the index) down to single
+ * precision, so each coordinate is uniform in [0, 1].
+ */
+inline float quasi_coordinate(unsigned int index,
+                              unsigned int base,
+                              unsigned int seed,
+                              unsigned int dimension)
+{
+    float inverse_base = 1.0f / base;
+    float scale = inverse_base;
+    float coordinate = 0.0f;
+    for(unsigned int k = 0; scale > 3.0e-8f; k++)
+    {
+        unsigned int h = quasi_hash(seed ^ quasi_hash((dimension << 8) | k));
+        unsigned int multiplier = 1 + h % (base - 1);
+        unsigned int shift = (h / base) % base;
+        unsigned int digit = index % base;
+        index /= base;
+        coordinate += ((multiplier * digit + shift) % base) * scale;
+        scale *= inverse_base;
+    }
+    return coordinate;
+}
+
+__kernel void quasi_integrate(
+    unsigned int calls,
+    unsigned int seed,
+    unsigned int randomization,
+    __global accumulator_t *result,
+    $integrator.evaluation_function.argument_signature
+    )
+{
+    //The local (workgroup-shared) array where final results
+    //will be stored and summed.
+    __local accumulator_t local_sums[MAX_QUASI_MONTE_CARLO_WORK_GROUP_SIZE];
+    __local accumulator_t local_square_sums[MAX_QUASI_MONTE_CARLO_WORK_GROUP_SIZE];
+
+    //Thread-local variables
+    unsigned int local_id = get_local_id(0);
+    accumulator_t private_sum = 0.0;
+    accumulator_t private_square_sum = 0.0;
+    accumulator_t private_sum_compensation = 0.0;
+    accumulator_t private_square_sum_compensation = 0.0;
+
+    //Each work item evaluates its own block of consecutive
+    //points of the sequence, so that together the work
+    //items cover exactly its first calls points
+    unsigned int points_per_worker = (calls + get_global_size(0) - 1) / get_global_size(0);
+    unsigned int first_index = get_global_id(0) * points_per_worker;
+    for(unsigned int i = 0; i < points_per_worker && first_index + i < calls; i++)
+    {
+        unsigned int index = first_index + i;
+
+        //Evaluate the phase space point and add it to the sum
+        #set $variable_specs = ["quasi_coordinate(index, %i, seed, %i) * (%s - %s) + %s" % ($quasi_bases[i], i, $integrator.evaluation_function.argument_names[2*i + 1], $integrator.evaluation_function.argument_names[2*i], $integrator.evaluation_function.argument_names[2*i]) for i in xrange(0, $n_args)]
+        accumulator_t value = ${integrator.integrand.name}(
+            ${",\n".join($variable_specs)}
+        );
+        accumulate(&private_sum, &private_sum_compensation, value);
+        accumulate(&private_square_sum, &private_square_sum_compensation, value * value);
+    }
+
+    //Store the local result
+    local_sums[local_id] = private_sum;
+    local_square_sums[local_id] = private_square_sum;
+
+    //Make sure everyone stores their results
+    barrier(CLK_LOCAL_MEM_FENCE);
+
+    //Sum the work group's results and store them in the
+    //work group's slot of this randomization's part of the
+    //output.  The host sums the slots.
+    reduce_local_sums(local_sums, local_square_sums);
+    if(local_id == 0)
+    {
+        unsigned int slot = randomization * get_num_groups(0) + get_group_id(0);
+        result[2 * slot] = local_sums[0];
+        result[2 * slot + 1] = local_square_sums[0];
+    }
+}
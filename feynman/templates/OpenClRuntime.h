@@ -0,0 +1,265 @@
+//The OpenCL runtime shared by the generated integrators.  It
+//is defined (inline) by every generated OpenCL header, so it
+//is guarded separately from the integrators.
+#ifndef FEYNMAN_OPENCL_RUNTIME
+#define FEYNMAN_OPENCL_RUNTIME
+
+//POSIX includes (for locking the pools)
+#include <pthread.h>
+
+//Pools the OpenCL resources which integrators can share:
+//the platform and device lists, a context for each device,
+//command queues (by device and properties) and built
+//programs (by context and a key which identifies the
+//program's code and build options).  Integrators attached
+//to the same runtime share these rather than creating their
+//own, and share (and serialize on) the command queues, so
+//only the first integrator for a device and program pays
+//for their creation.  The runtime is thread-safe, and must
+//outlive the integrators attached to it.
+//
+//Resources are returned with a reference retained for the
+//caller, which the caller releases.  Errors are returned as
+//OpenCL error codes, for the caller to report.
+class FeynmanOpenClRuntime
+{
+    public:
+        FeynmanOpenClRuntime() :
+        _platforms_listed(false),
+        _platforms(),
+        _contexts(),
+        _command_queues(),
+        _programs()
+        {
+            pthread_mutex_init(&_mutex, NULL);
+        }
+
+        ~FeynmanOpenClRuntime()
+        {
+            for(size_t i = 0; i < _programs.size(); i++)
+            {
+                clReleaseProgram(_programs[i].program);
+            }
+            for(size_t i = 0; i < _command_queues.size(); i++)
+            {
+                clReleaseCommandQueue(_command_queues[i].command_queue);
+            }
+            for(size_t i = 0; i < _contexts.size(); i++)
+            {
+                clReleaseContext(_contexts[i].context);
+            }
+            pthread_mutex_destroy(&_mutex);
+        }
+
+        //The runtime shared by the whole process (or, since
+        //each shared library has its own copy, by the whole
+        //library)
+        static FeynmanOpenClRuntime &shared()
+        {
+            static FeynmanOpenClRuntime runtime;
+            return runtime;
+        }
+
+        //Lists the platforms (which are only queried once)
+        cl_int platforms(std::vector<cl_platform_id> &platforms)
+        {
+            pthread_mutex_lock(&_mutex);
+            cl_int error = CL_SUCCESS;
+            if(!_platforms_listed)
+            {
+                cl_uint n_platforms = 0;
+                error = clGetPlatformIDs(0, NULL, &n_platforms);
+                if(error == CL_SUCCESS && n_platforms > 0)
+                {
+                    _platforms.resize(n_platforms);
+                    error = clGetPlatformIDs(n_platforms, &_platforms[0], NULL);
+                }
+                if(error == CL_SUCCESS)
+                {
+                    _platforms_listed = true;
+                }
+                else
+                {
+                    _platforms.clear();
+                }
+            }
+            platforms = _platforms;
+            pthread_mutex_unlock(&_mutex);
+            return error;
+        }
+
+        //Finds the best device, preferring GPUs, then CPUs,
+        //then accelerators and then anything else
+        cl_int best_device(cl_platform_id *platform, cl_device_id *device)
+        {
+            std::vector<cl_platform_id> platform_list;
+            cl_int error = platforms(platform_list);
+            if(error != CL_SUCCESS)
+            {
+                return error;
+            }
+            cl_device_type preferred_device_types[] = {
+                CL_DEVICE_TYPE_GPU,
+                CL_DEVICE_TYPE_CPU,
+                CL_DEVICE_TYPE_ACCELERATOR,
+                CL_DEVICE_TYPE_DEFAULT,
+                CL_DEVICE_TYPE_ALL
+            };
+            int n_device_types = sizeof(preferred_device_types)/sizeof(cl_device_type);
+            error = CL_DEVICE_NOT_FOUND;
+            for(int i = 0; i < n_device_types && error == CL_DEVICE_NOT_FOUND; i++)
+            {
+                for(size_t p = 0; p < platform_list.size(); p++)
+                {
+                    error = clGetDeviceIDs(platform_list[p], preferred_device_types[i], 1, device, NULL);
+                    if(error != CL_DEVICE_NOT_FOUND)
+                    {
+                        *platform = platform_list[p];
+                        break;
+                    }
+                }
+            }
+            return error;
+        }
+
+        //Grabs the context of a device, creating it the
+        //first time around
+        cl_context context(cl_device_id device, cl_int *error)
+        {
+            pthread_mutex_lock(&_mutex);
+            *error = CL_SUCCESS;
+            cl_context context = NULL;
+            for(size_t i = 0; i < _contexts.size() && context == NULL; i++)
+            {
+                if(_contexts[i].device == device)
+                {
+                    context = _contexts[i].context;
+                }
+            }
+            if(context == NULL)
+            {
+                context = clCreateContext(0, 1, &device, NULL, NULL, error);
+                if(*error == CL_SUCCESS)
+                {
+                    PooledContext pooled = {device, context};
+                    _contexts.push_back(pooled);
+                }
+            }
+            if(*error == CL_SUCCESS)
+            {
+                clRetainContext(context);
+            }
+            pthread_mutex_unlock(&_mutex);
+            return *error == CL_SUCCESS ? context : NULL;
+        }
+
+        //Grabs a command queue with the given properties on a
+        //device (in the device's pooled context), creating it
+        //the first time around
+        cl_command_queue command_queue(cl_device_id device,
+                                       cl_command_queue_properties properties,
+                                       cl_int *error)
+        {
+            cl_context device_context = context(device, error);
+            if(*error != CL_SUCCESS)
+            {
+                return NULL;
+            }
+            pthread_mutex_lock(&_mutex);
+            cl_command_queue command_queue = NULL;
+            for(size_t i = 0; i < _command_queues.size() && command_queue == NULL; i++)
+            {
+                if(_command_queues[i].device == device && _command_queues[i].properties == properties)
+                {
+                    command_queue = _command_queues[i].command_queue;
+                }
+            }
+            if(command_queue == NULL)
+            {
+                command_queue = clCreateCommandQueue(device_context, device, properties, error);
+                if(*error == CL_SUCCESS)
+                {
+                    PooledCommandQueue pooled = {device, properties, command_queue};
+                    _command_queues.push_back(pooled);
+                }
+            }
+            if(*error == CL_SUCCESS)
+            {
+                clRetainCommandQueue(command_queue);
+            }
+            pthread_mutex_unlock(&_mutex);
+            clReleaseContext(device_context);
+            return *error == CL_SUCCESS ? command_queue : NULL;
+        }
+
+        //Grabs the program built for a key in a context, or
+        //returns NULL if there is none yet
+        cl_program program(cl_context context, const std::string &key)
+        {
+            pthread_mutex_lock(&_mutex);
+            cl_program program = NULL;
+            for(size_t i = 0; i < _programs.size() && program == NULL; i++)
+            {
+                if(_programs[i].context == context && _programs[i].key == key)
+                {
+                    program = _programs[i].program;
+                    clRetainProgram(program);
+                }
+            }
+            pthread_mutex_unlock(&_mutex);
+            return program;
+        }
+
+        //Adds a built program to the pool (retaining it),
+        //unless another was added for the key meanwhile
+        void add_program(cl_context context, const std::string &key, cl_program program)
+        {
+            pthread_mutex_lock(&_mutex);
+            bool pooled = false;
+            for(size_t i = 0; i < _programs.size() && !pooled; i++)
+            {
+                pooled = _programs[i].context == context && _programs[i].key == key;
+            }
+            if(!pooled)
+            {
+                PooledProgram pooled_program = {context, key, program};
+                clRetainProgram(program);
+                _programs.push_back(pooled_program);
+            }
+            pthread_mutex_unlock(&_mutex);
+        }
+
+    private:
+        //Don't allow copying due to the pooled resources
+        FeynmanOpenClRuntime( const FeynmanOpenClRuntime& );
+        const FeynmanOpenClRuntime& operator=( const FeynmanOpenClRuntime& );
+
+        struct PooledContext
+        {
+            cl_device_id device;
+            cl_context context;
+        };
+
+        struct PooledCommandQueue
+        {
+            cl_device_id device;
+            cl_command_queue_properties properties;
+            cl_command_queue command_queue;
+        };
+
+        struct PooledProgram
+        {
+            cl_context context;
+            std::string key; //Identifies the code and build options of the program
+            cl_program program;
+        };
+
+        pthread_mutex_t _mutex; //Guards everything below
+        bool _platforms_listed; //Whether _platforms has been filled
+        std::vector<cl_platform_id> _platforms;
+        std::vector<PooledContext> _contexts;
+        std::vector<PooledCommandQueue> _command_queues;
+        std::vector<PooledProgram> _programs;
+};
+
+#endif //FEYNMAN_OPENCL_RUNTIME
@@ -1,9 +1,131 @@
+#define MAX_VEGAS_MONTE_CARLO_WORK_GROUP_SIZE 1024
+#define VEGAS_BINS 50
+
+#set $n_args = len($integrator.integrand.argument_types)
+#set $n_blocks = ($n_args + 3) / 4
+#set $struct_accessors = ["s%i" % i for i in xrange(0, 4)]
 __kernel void vegas_integrate(
-    unsigned int points_per_worker,
-    __global ranluxcl_state_t *ranluxcl_states,
-    __global float *result,
+    unsigned int calls,
+    RANDOM_SOURCE_ARGUMENT,
+    __global accumulator_t *result,
+    __global const float *grid,
+    __global float *histograms,
     $integrator.evaluation_function.argument_signature
     )
 {
-    
+    //The local (workgroup-shared) arrays where final results
+    //will be stored and summed.
+    __local accumulator_t local_sums[MAX_VEGAS_MONTE_CARLO_WORK_GROUP_SIZE];
+    __local accumulator_t local_square_sums[MAX_VEGAS_MONTE_CARLO_WORK_GROUP_SIZE];
+
+    //The local (workgroup-shared) copy of the grid and the
+    //histogram of squared function values which will be
+    //used by the host to refine the grid.  The grid is
+    //stored as $n_args rows of VEGAS_BINS + 1 bin
+    //boundaries in [0, 1], and the histogram as $n_args
+    //rows of VEGAS_BINS bins.
+    __local float local_grid[$n_args * (VEGAS_BINS + 1)];
+    __local float local_histogram[$n_args * VEGAS_BINS];
+
+    //Thread-local variables
+    unsigned int local_id = get_local_id(0);
+    unsigned int local_size = get_local_size(0);
+    accumulator_t private_sum = 0.0;
+    accumulator_t private_square_sum = 0.0;
+    accumulator_t private_sum_compensation = 0.0;
+    accumulator_t private_square_sum_compensation = 0.0;
+
+    //Load the grid and clear the histogram
+    for(unsigned int i = local_id; i < $n_args * (VEGAS_BINS + 1); i += local_size)
+    {
+        local_grid[i] = grid[i];
+    }
+    for(unsigned int i = local_id; i < $n_args * VEGAS_BINS; i += local_size)
+    {
+        local_histogram[i] = 0.0;
+    }
+    barrier(CLK_LOCAL_MEM_FENCE);
+
+    //Start the random number generator
+    random_state_t random_state;
+    random_start(&random_state, random_source);
+
+    //Split the calls between the work items, giving the
+    //first calls % n_work_items of them an extra point, so
+    //that exactly calls points are evaluated
+    unsigned int n_work_items = get_global_size(0);
+    unsigned int n_points = calls / n_work_items + (get_global_id(0) < calls % n_work_items ? 1 : 0);
+
+    //Loop over and evaluate random phase-space points.
+    for(unsigned int i = 0; i < n_points; i++)
+    {
+        //Generate a random point in the unit hypercube
+        float4 phase_space[$n_blocks];
+        for(unsigned int p = 0; p < $n_blocks; p++)
+        {
+            phase_space[p] = random_float4(&random_state);
+        }
+
+        //Map the point through the grid, recording which
+        //bin it fell in along each dimension and the
+        //Jacobian of the transformation.
+        unsigned int bins[$n_args];
+        float x[$n_args];
+        float jacobian = 1.0;
+        #for $d in xrange(0, $n_args)
+        {
+            float z = phase_space[${$d / 4}].${struct_accessors[$d % 4]} * VEGAS_BINS;
+            unsigned int bin = min((unsigned int)z, (unsigned int)(VEGAS_BINS - 1));
+            float lower = local_grid[${$d} * (VEGAS_BINS + 1) + bin];
+            float width = local_grid[${$d} * (VEGAS_BINS + 1) + bin + 1] - lower;
+            x[$d] = lower + (z - bin) * width;
+            jacobian *= VEGAS_BINS * width;
+            bins[$d] = bin;
+        }
+        #end for
+
+        //Evaluate the phase space point and add it to the sum
+        #set $variable_specs = ["x[%i] * (%s - %s) + %s" % (i, $integrator.evaluation_function.argument_names[2*i + 1], $integrator.evaluation_function.argument_names[2*i], $integrator.evaluation_function.argument_names[2*i]) for i in xrange(0, $n_args)]
+        accumulator_t value = jacobian * ${integrator.integrand.name}(
+            ${",\n".join($variable_specs)}
+        );
+        accumulator_t square_value = value * value;
+        accumulate(&private_sum, &private_sum_compensation, value);
+        accumulate(&private_square_sum, &private_square_sum_compensation, square_value);
+
+        //Record the squared value in the histogram of each
+        //dimension for importance sampling
+        for(unsigned int d = 0; d < $n_args; d++)
+        {
+            atomic_add_local_float(local_histogram + d * VEGAS_BINS + bins[d], square_value);
+        }
+    }
+
+    //Store the local result
+    local_sums[local_id] = private_sum;
+    local_square_sums[local_id] = private_square_sum;
+
+    //Make sure everyone stores their results
+    barrier(CLK_LOCAL_MEM_FENCE);
+
+    //Finish with the random number generator
+    random_finish(&random_state, random_source);
+
+    //Copy out this work group's histogram
+    __global float *group_histogram = histograms + get_group_id(0) * ($n_args * VEGAS_BINS);
+    for(unsigned int i = local_id; i < $n_args * VEGAS_BINS; i += local_size)
+    {
+        group_histogram[i] = local_histogram[i];
+    }
+
+    //Sum the work group's results and store them in
+    //the work group's slot of the output.  The host
+    //sums the slots.
+    reduce_local_sums(local_sums, local_square_sums);
+    if(local_id == 0)
+    {
+        unsigned int group_id = get_group_id(0);
+        result[2 * group_id] = local_sums[0];
+        result[2 * group_id + 1] = local_square_sums[0];
+    }
 }
@@ -3,14 +3,20 @@
 #System modules
 import sys
 import os
+import copy
+import json
+import time
+import multiprocessing
 
 #Argument parsing modules
 import argparse
 
 #Feynman modules
 from feynman.parsing import CFile
+from feynman.common import write_depfile
 from feynman.integration import GslMonteCarloFunctionIntegrator, \
-                                OpenClMonteCarloFunctionIntegrator
+                                OpenClMonteCarloFunctionIntegrator, \
+                                precompile_templates
 
 #Helper functions
 def parse_arguments():
@@ -21,10 +27,38 @@ def parse_arguments():
                         dest = "verbose", 
                         action = "store_true", 
                         help = "Show verbose output.")
+    parser.add_argument("-m",
+                        "--manifest",
+                        dest = "manifest",
+                        required = False,
+                        default = None,
+                        metavar = "MANIFEST",
+                        help = "Generate a batch of integrators in one process, as " \
+                               "described by a JSON manifest.  The manifest is a list " \
+                               "of objects, one per integrator, whose keys are the " \
+                               "long names of the other options with underscores in " \
+                               "place of dashes (e.g. \"integrand_file\", " \
+                               "\"integrand_name\", \"backend\", \"integrator_name\", " \
+                               "\"dependencies\", \"header_output_path\", " \
+                               "\"source_output_path\" and \"depfile\").  Relative " \
+                               "paths are taken relative to the manifest.  Each " \
+                               "integrand file is only parsed once, and the code is " \
+                               "generated in parallel.  The other options are ignored, " \
+                               "except for --jobs, --depfile (which then covers every " \
+                               "integrator) and --verbose.")
+    parser.add_argument("-j",
+                        "--jobs",
+                        dest = "jobs",
+                        required = False,
+                        default = None,
+                        type = int,
+                        metavar = "JOBS",
+                        help = "The number of processes to generate a manifest's " \
+                               "integrators with.  Defaults to the number of CPUs.")
     parser.add_argument("-i", 
                         "--integrand-file", 
                         dest = "integrand_file", 
-                        required = True, 
+                        required = False, 
                         metavar = "FILE", 
                         help = "The input file containing the integrand.  If using " \
                                "the OpenCL backend, the file must contain the body " \
@@ -32,7 +66,7 @@ def parse_arguments():
     parser.add_argument("-I",
                         "--integrand-name",
                         dest = "integrand_name",
-                        required = True,
+                        required = False,
                         metavar = "FUNCTION",
                         help = "The function contained in the input file to be integrated.")
     parser.add_argument("-d",
@@ -99,11 +133,23 @@ def parse_arguments():
                                "#include \"integrals/integral1.h\".  To do this, simply " \
                                "specify what should appear in the quotation marks of " \
                                "the include directive.")
+    parser.add_argument("-M",
+                        "--depfile",
+                        dest = "depfile",
+                        required = False,
+                        default = None,
+                        metavar = "DEPFILE",
+                        help = "Write a Makefile-style dependency file, as used by " \
+                               "Make and Ninja, listing the files the generated code " \
+                               "depends on: the integrand file, the files it includes " \
+                               "and the templates used.  Generated files are only " \
+                               "written when their content changes, so build systems " \
+                               "only rebuild integrators whose inputs have changed.")
     parser.add_argument("-b",
                         "--backend",
                         dest = "backend",
                         required = False,
-                        default = "gsl-plain",
+                        default = "gsl",
                         metavar = "BACKEND",
                         help = "The integrator backend to use.  Available options are " \
                                "\"gsl\" and \"opencl\".  Note that while you are not " \
@@ -111,9 +157,214 @@ def parse_arguments():
                                "to generate integration code, you will need the " \
                                "respective package available to compile and execute " \
                                "the code.")
+    parser.add_argument("-a",
+                        "--accumulation",
+                        dest = "accumulation",
+                        required = False,
+                        default = "float",
+                        choices = ["float", "double", "kahan"],
+                        help = "The precision used for the integration sums by the " \
+                               "OpenCL backend.  \"float\" accumulates in single " \
+                               "precision, \"double\" in double precision (which " \
+                               "requires a device supporting cl_khr_fp64), and " \
+                               "\"kahan\" in single precision with compensated " \
+                               "summation.  This option is ignored by the GSL backend, " \
+                               "which always accumulates in double precision.")
+    parser.add_argument("-r",
+                        "--rng",
+                        dest = "rng",
+                        required = False,
+                        default = "ranlux",
+                        choices = ["ranlux", "philox"],
+                        help = "The random number generator used by the OpenCL " \
+                               "backend.  \"ranlux\" keeps RANLUXCL states in device " \
+                               "memory, and \"philox\" uses the stateless, " \
+                               "counter-based Philox4x32-10 generator, which needs no " \
+                               "seeding kernel or state buffers.  This option is " \
+                               "ignored by the GSL backend.")
+
+    #Run the parser, making sure there is something to do
+    args = parser.parse_args()
+    if args.manifest == None and (args.integrand_file == None 
+                                  or args.integrand_name == None):
+        parser.error("Either a manifest, or an integrand file and " \
+                     "name, must be specified.")
+    return args
+
+def create_integrator(integrand, backend, integrator_name, accumulation, rng = "ranlux"):
+    #Create the correct code generator
+    if backend not in ["gsl",  
+                       "opencl"]:
+        raise ValueError("Invalid backend specified: %s" % backend)
+    if backend == "gsl":
+        return GslMonteCarloFunctionIntegrator(integrand, 
+                                               integrator_name)
+    return OpenClMonteCarloFunctionIntegrator(integrand,
+                                              integrator_name,
+                                              accumulation,
+                                              rng)
+
+def create_output_directories(output_header, output_source):
+    #Create intermediate directories
+    for output_dir in (os.path.dirname(output_header), 
+                       os.path.dirname(output_source)):
+        if output_dir and not os.path.isdir(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except OSError:
+                #Another generator may have just created it
+                if not os.path.isdir(output_dir):
+                    raise
 
-    #Run the parser
-    return parser.parse_args()
+def integrator_dependencies(integrand_file, integrand_includes, integrator):
+    #Find the files generated code depends on.  libclang may
+    #report headers which don't exist under the paths it
+    #gives (e.g. system headers, when its installation has
+    #been moved), and build systems can't make those, so
+    #they are left out.
+    dependencies = [os.path.abspath(integrand_file)]
+    dependencies.extend(integrand_includes)
+    dependencies.extend(integrator.template_paths)
+    return [d for d in dependencies if os.path.isfile(d)]
+
+def _output_paths(entry):
+    #Compute output paths, as for the command line options
+    output_header = entry.get("header_output_path", None)
+    output_source = entry.get("source_output_path", None)
+    output_file_base = entry.get("output_file_base", None)
+    if output_header == None and output_file_base != None:
+        output_header = output_file_base + ".h"
+    if output_source == None and output_file_base != None:
+        output_source = output_file_base + ".cpp"
+    if output_header == None or output_source == None:
+        raise ValueError("Unable to compute output paths.  You must " \
+                         "specify either header_output_path and " \
+                         "source_output_path or output_file_base.")
+    return output_header, output_source
+
+def _generate_manifest_entry(job):
+    #Generate the code for a manifest entry, returning an
+    #error message on failure (this runs in a worker
+    #process, so exceptions are reported rather than raised)
+    #along with the generated files and their dependencies
+    integrand, integrand_includes, entry = job
+    try:
+        for dependency in entry.get("dependencies", []):
+            integrand.add_include_dependency(dependency)
+        integrator = create_integrator(integrand,
+                                       entry.get("backend", "gsl"),
+                                       entry.get("integrator_name", None),
+                                       entry.get("accumulation", "float"),
+                                       entry.get("rng", "ranlux"))
+        output_header, output_source = _output_paths(entry)
+        create_output_directories(output_header, output_source)
+        integrator.generate_code(output_header, 
+                                 output_source,
+                                 primary_header_include = entry.get("primary_header_include", None))
+        dependencies = integrator_dependencies(entry["integrand_file"],
+                                               integrand_includes,
+                                               integrator)
+        if entry.get("depfile", None) != None:
+            write_depfile(entry["depfile"], 
+                          [output_header, output_source], 
+                          dependencies)
+    except Exception as e:
+        return ("%s (%s): %s" % (entry.get("integrand_name", "?"), 
+                                 entry.get("integrand_file", "?"),
+                                 e),
+                [],
+                [])
+    return None, [output_header, output_source], dependencies
+
+def generate_manifest(manifest_path, jobs = None, depfile = None, verbose = False):
+    #Load the manifest, making paths relative to it absolute
+    start_time = time.time()
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, list):
+        raise ValueError("The manifest must be a list of integrators.")
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    for entry in manifest:
+        if not isinstance(entry, dict):
+            continue
+        for key in ("integrand_file", 
+                    "header_output_path", 
+                    "source_output_path", 
+                    "output_file_base",
+                    "depfile"):
+            if entry.get(key, None) != None:
+                entry[key] = os.path.join(manifest_dir, entry[key])
+
+    #Parse each integrand file once, and grab the integrands.
+    #Each entry gets its own copy of its integrand, since
+    #entries add their own dependencies.
+    integrand_files = {}
+    work = []
+    errors = []
+    for entry in manifest:
+        if not isinstance(entry, dict):
+            errors.append("%s: Manifest entries must be objects." % json.dumps(entry))
+            continue
+        integrand_file = entry.get("integrand_file", None)
+        integrand_name = entry.get("integrand_name", None)
+        try:
+            if integrand_file not in integrand_files:
+                if verbose:
+                    print("Loading code from: %s" % integrand_file)
+                integrand_files[integrand_file] = CFile(integrand_file)
+            integrand = integrand_files[integrand_file][integrand_name]
+            if not integrand:
+                raise ValueError("Unable to find integrand")
+        except Exception as e:
+            errors.append("%s (%s): %s" % (integrand_name, integrand_file, e))
+            continue
+
+        #Read the integrand text now, so that workers don't
+        #each read it from the source file
+        integrand.text
+        work.append((copy.deepcopy(integrand), 
+                     integrand_files[integrand_file].includes, 
+                     entry))
+
+    #Generate the code, in parallel if there's enough to do
+    if jobs == None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(work)))
+    if jobs > 1:
+        #Compile the templates before forking, so that the
+        #workers share them rather than each compiling them
+        precompile_templates()
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(_generate_manifest_entry, work)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_generate_manifest_entry(job) for job in work]
+    errors.extend([error for error, targets, dependencies in results if error != None])
+
+    #Write a dependency file covering everything, which also
+    #depends on the manifest
+    if depfile != None:
+        all_targets = []
+        all_dependencies = [os.path.abspath(manifest_path)]
+        for error, targets, dependencies in results:
+            all_targets.extend(targets)
+            all_dependencies.extend([d for d in dependencies if d not in all_dependencies])
+        write_depfile(depfile, all_targets, all_dependencies)
+
+    #Summarize
+    for error in errors:
+        sys.stderr.write("Unable to generate integrator for %s\n" % error)
+    print("Generated %i of %i integrators from %i files with %i processes in %.2fs" % \
+          (len(manifest) - len(errors),
+           len(manifest),
+           len(integrand_files),
+           jobs,
+           time.time() - start_time))
+
+    return len(errors) == 0
 
 if __name__ == "__main__":
     args = parse_arguments()
@@ -122,6 +373,12 @@ if __name__ == "__main__":
     if args.verbose:
         print("Feynman Integration Code Generator")
 
+    #Handle batches separately
+    if args.manifest != None:
+        if not generate_manifest(args.manifest, args.jobs, args.depfile, args.verbose):
+            sys.exit(1)
+        sys.exit(0)
+
     #Open the input file
     if args.verbose:
         print("Loading code from: %s" % args.integrand_file)
@@ -151,12 +408,11 @@ if __name__ == "__main__":
         sys.exit(1)
     if args.verbose:
         print("Using backend: %s" % args.backend)
-    if args.backend == "gsl":
-        integrator = GslMonteCarloFunctionIntegrator(integrand, 
-                                                     args.integrator_name)
-    else:
-        integrator = OpenClMonteCarloFunctionIntegrator(integrand,
-                                                        args.integrator_name)
+    integrator = create_integrator(integrand,
+                                   args.backend,
+                                   args.integrator_name,
+                                   args.accumulation,
+                                   args.rng)
     if args.verbose:
         print("Integral signature:")
         print("\t%s" % integrator.evaluation_function.signature)
@@ -183,16 +439,21 @@ if __name__ == "__main__":
         print("Source output path: %s" % output_source)
 
     #Create intermediate directories
-    header_dir = os.path.dirname(output_header)
-    source_dir = os.path.dirname(output_source)
-    if not os.path.isdir(header_dir):
-        os.makedirs(header_dir)
-    if not os.path.isdir(source_dir):
-        os.makedirs(source_dir)
+    create_output_directories(output_header, output_source)
 
     #Generate the code!
     integrator.generate_code(output_header, 
                              output_source,
                              primary_header_include = args.primary_header_include)
+
+    #Write the dependency file
+    if args.depfile != None:
+        if args.verbose:
+            print("Dependency file path: %s" % args.depfile)
+        write_depfile(args.depfile, 
+                      [output_header, output_source],
+                      integrator_dependencies(args.integrand_file,
+                                              input_file.includes,
+                                              integrator))
     if args.verbose:
         print("Code successfully generated!")
@@ -0,0 +1,27 @@
+#include "benchmark_integrands.h"
+
+//Standard includes
+#include <math.h>
+
+float gaussian_peak(float x, float y)
+{
+    float dx = x - 0.5f;
+    float dy = y - 0.5f;
+    return exp(-100.0f * (dx * dx + dy * dy));
+}
+
+float oscillatory(float x, float y, float z)
+{
+    return cos(1.0f + 2.0f * x + 3.0f * y + 5.0f * z);
+}
+
+float sine_product(float x1, float x2, float x3, float x4,
+                   float x5, float x6, float x7, float x8)
+{
+    //(pi / 2) * sin(pi * x) integrates to 1 over [0, 1]
+    const float pi = 3.14159265f;
+    return (0.5f * pi * sin(pi * x1)) * (0.5f * pi * sin(pi * x2))
+           * (0.5f * pi * sin(pi * x3)) * (0.5f * pi * sin(pi * x4))
+           * (0.5f * pi * sin(pi * x5)) * (0.5f * pi * sin(pi * x6))
+           * (0.5f * pi * sin(pi * x7)) * (0.5f * pi * sin(pi * x8));
+}
@@ -0,0 +1,36 @@
+#ifndef BENCHMARK_INTEGRANDS_H
+#define BENCHMARK_INTEGRANDS_H
+
+/*
+ * A narrow Gaussian peak,
+ *
+ *  exp(-100 * ((x - 0.5)^2 + (y - 0.5)^2))
+ *
+ * which, integrated over the unit square, is
+ *
+ *  (pi / 100) * erf(5)^2
+ */
+float gaussian_peak(float x, float y);
+
+/*
+ * Genz's oscillatory function,
+ *
+ *  cos(1 + 2 * x + 3 * y + 5 * z)
+ *
+ * which, integrated over the unit cube, is the real part of
+ *
+ *  e^i * (e^2i - 1) * (e^3i - 1) * (e^5i - 1) / (30 * i^3)
+ */
+float oscillatory(float x, float y, float z);
+
+/*
+ * A product of sines in eight dimensions,
+ *
+ *  ((pi / 2) * sin(pi * x1)) * ... * ((pi / 2) * sin(pi * x8))
+ *
+ * whose integral over the unit hypercube is 1.
+ */
+float sine_product(float x1, float x2, float x3, float x4,
+                   float x5, float x6, float x7, float x8);
+
+#endif //BENCHMARK_INTEGRANDS_H
@@ -0,0 +1,28 @@
+//System headers, whose declarations should be ignored
+#include <math.h>
+
+//A prototype, which should lose out to the definition below
+double included_function_2(double y);
+
+namespace test_namespace
+{
+    extern "C"
+    {
+        float included_function_1(float x) /* { isn't a body */
+        {
+            //Braces in literals and comments { shouldn't count
+            const char *s = "}}{";
+            char c = '}';
+            if(x > 0.0)
+            {
+                return sqrt(x);
+            }
+            return 0.0;
+        }
+    }
+}
+
+double included_function_2(double y)
+{
+    /* } */ return y;
+}
@@ -0,0 +1,91 @@
+#Common testing modules
+from common import _distribution_path
+
+#System modules
+import sys
+import imp
+import json
+import math
+import shutil
+import tempfile
+import subprocess
+from os.path import join
+
+#Feynman modules
+from feynman import parsing
+
+def _load_benchmark_module():
+    return imp.load_source("benchmark", join(_distribution_path, "benchmark.py"))
+
+def test_benchmark_integrands():
+    benchmark = _load_benchmark_module()
+
+    #Make sure each integrand exists, with bounds for each
+    #of its dimensions
+    for benchmark_integrand in benchmark.BENCHMARK_INTEGRANDS:
+        integrand = parsing.CFile(benchmark_integrand.file_path)[benchmark_integrand.name]
+        assert(integrand.has_body)
+        assert(len(integrand.argument_types) == len(benchmark_integrand.bounds))
+
+    #Check the analytic results of the new low-dimensional
+    #integrands against the midpoint rule
+    exact = dict((i.name, i.exact) for i in benchmark.BENCHMARK_INTEGRANDS)
+    n = 200
+    points = [(i + 0.5) / n for i in xrange(n)]
+    peak = sum(math.exp(-100.0 * ((x - 0.5) ** 2 + (y - 0.5) ** 2)) 
+               for x in points for y in points) / n ** 2
+    assert(abs(peak - exact["gaussian_peak"]) < 1e-3 * exact["gaussian_peak"])
+    n = 60
+    points = [(i + 0.5) / n for i in xrange(n)]
+    oscillatory = sum(math.cos(1.0 + 2.0 * x + 3.0 * y + 5.0 * z) 
+                      for x in points for y in points for z in points) / n ** 3
+    assert(abs(oscillatory - exact["oscillatory"]) < 1e-3)
+
+def test_benchmark_comparison():
+    #Create a set of results and a regressed copy of them
+    def run(monte_carlo_type, wall_time, error_ratio):
+        return {"backend": "gsl",
+                "integrand": "unit_cylinder",
+                "monte_carlo_type": monte_carlo_type,
+                "wall_time": wall_time,
+                "error_ratio": error_ratio}
+    old = {"runs": [run("plain", 1.0, 1.0), 
+                    run("miser", 1.0, 1.0), 
+                    run("vegas", 1.0, 1.0),
+                    run("quasi", 1.0, 1.0)]}
+    new = {"runs": [run("plain", 1.05, 1.2), 
+                    run("miser", 2.0, 1.0), 
+                    run("vegas", 1.0, 20.0)]}
+    scratch_dir = tempfile.mkdtemp()
+    try:
+        old_path = join(scratch_dir, "old.json")
+        new_path = join(scratch_dir, "new.json")
+        with open(old_path, "w") as f:
+            json.dump(old, f)
+        with open(new_path, "w") as f:
+            json.dump(new, f)
+
+        def compare(a, b):
+            process = subprocess.Popen([sys.executable,
+                                        join(_distribution_path, "benchmark.py"),
+                                        "--compare", a, b],
+                                       stdout = subprocess.PIPE,
+                                       stderr = subprocess.PIPE)
+            output = process.communicate()[0]
+            return process.returncode, output
+
+        #Make sure identical results pass
+        returncode, output = compare(old_path, old_path)
+        assert(returncode == 0)
+        assert("No regressions" in output)
+
+        #Make sure the slowdown, the inaccurate run and the
+        #missing run are reported, but not the small changes
+        returncode, output = compare(old_path, new_path)
+        assert(returncode == 1)
+        assert("plain" not in output)
+        assert("gsl unit_cylinder miser: slower" in output)
+        assert("gsl unit_cylinder vegas: error" in output)
+        assert("gsl unit_cylinder quasi: no longer runs" in output)
+    finally:
+        shutil.rmtree(scratch_dir)
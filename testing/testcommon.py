@@ -1,10 +1,19 @@
 #Common testing modules
 import common
 
+#System modules
+import os
+import shutil
+import tempfile
+from os.path import join
+
 #Feynman modules
 from feynman.common import validate_code_string, \
                            underscore_to_camel_case, \
-                           c_string_literal_with_c_code
+                           c_string_literal_with_c_code, \
+                           write_if_changed, \
+                           write_depfile, \
+                           first_primes
 
 def test_code_string_validation():
     string_exception_pairs = (
@@ -58,3 +67,31 @@ def test_c_string_literal_with_c_code():
 
     for test, value in test_value_pairs:
         assert(c_string_literal_with_c_code(test) == value)
+
+def test_first_primes():
+    assert(first_primes(0) == [])
+    assert(first_primes(1) == [2])
+    assert(first_primes(10) == [2, 3, 5, 7, 11, 13, 17, 19, 23, 29])
+
+def test_write_if_changed():
+    scratch_dir = tempfile.mkdtemp()
+    try:
+        #Make sure files are only written when their content
+        #changes
+        path = join(scratch_dir, "output.txt")
+        assert(write_if_changed(path, "content"))
+        os.utime(path, (0, 0))
+        assert(not write_if_changed(path, "content"))
+        assert(os.path.getmtime(path) == 0)
+        assert(write_if_changed(path, "changed"))
+        assert(write_if_changed(path, "CHANGED"))
+        with open(path, "r") as f:
+            assert(f.read() == "CHANGED")
+
+        #Make sure dependency files escape paths
+        path = join(scratch_dir, "output.d")
+        assert(write_depfile(path, ["a.h", "a.cpp"], ["b c.cpp", "$d#.h"]))
+        with open(path, "r") as f:
+            assert(f.read() == "a.h a.cpp: \\\n b\\ c.cpp \\\n $$d\\#.h\n")
+    finally:
+        shutil.rmtree(scratch_dir)
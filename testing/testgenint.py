@@ -0,0 +1,85 @@
+#Common testing modules
+from common import testing_resource_path, _distribution_path
+
+#System modules
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from os.path import join, exists
+
+def test_manifest_generation():
+    #Create a manifest in a scratch directory, with relative
+    #output paths, one integrand which doesn't exist and one
+    #entry which isn't an object
+    scratch_dir = tempfile.mkdtemp()
+    input_code_path = join(testing_resource_path, "parsing_test_code.cl")
+    manifest = [
+        {"integrand_file": input_code_path,
+         "integrand_name": "test_function_1",
+         "backend": "gsl",
+         "integrator_name": "test_gsl_integrator",
+         "output_file_base": join("gsl", "test_gsl_integrator"),
+         "depfile": join("gsl", "test_gsl_integrator.d")},
+        {"integrand_file": input_code_path,
+         "integrand_name": "test_function_1",
+         "backend": "opencl",
+         "integrator_name": "test_opencl_integrator",
+         "header_output_path": join("include", "test_opencl_integrator.h"),
+         "source_output_path": join("src", "test_opencl_integrator.cpp")},
+        {"integrand_file": input_code_path,
+         "integrand_name": "missing_function",
+         "backend": "gsl",
+         "output_file_base": "missing"},
+        "not_an_entry"
+    ]
+    manifest_path = join(scratch_dir, "manifest.json")
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+
+    def generate():
+        #Run the generator with a couple of processes
+        process = subprocess.Popen([sys.executable,
+                                    join(_distribution_path, "genint.py"),
+                                    "--manifest", manifest_path,
+                                    "--jobs", "2"],
+                                   stdout = subprocess.PIPE,
+                                   stderr = subprocess.PIPE)
+        output, errors = process.communicate()
+        return process, output, errors
+
+    try:
+        process, output, errors = generate()
+
+        #Make sure the missing integrand and the bad entry
+        #fail the run, but don't stop the others
+        assert(process.returncode == 1)
+        assert("missing_function" in errors)
+        assert("not_an_entry" in errors)
+        assert("Generated 2 of 4 integrators from 1 files" in output)
+        assert(exists(join(scratch_dir, "gsl", "test_gsl_integrator.h")))
+        assert(exists(join(scratch_dir, "gsl", "test_gsl_integrator.cpp")))
+        assert(exists(join(scratch_dir, "include", "test_opencl_integrator.h")))
+        assert(exists(join(scratch_dir, "src", "test_opencl_integrator.cpp")))
+        assert(not exists(join(scratch_dir, "missing.h")))
+        with open(join(scratch_dir, "src", "test_opencl_integrator.cpp"), "r") as f:
+            assert("test_opencl_integrator::test_opencl_integrator" in f.read())
+
+        #Make sure the dependency file lists the integrand and
+        #templates
+        with open(join(scratch_dir, "gsl", "test_gsl_integrator.d"), "r") as f:
+            depfile = f.read()
+        assert(depfile.startswith(join(scratch_dir, "gsl", "test_gsl_integrator.h")))
+        assert(input_code_path in depfile)
+        assert("GslMonteCarlo.cpp" in depfile)
+
+        #Make sure regenerating the same code leaves the files
+        #alone
+        source_path = join(scratch_dir, "src", "test_opencl_integrator.cpp")
+        os.utime(source_path, (0, 0))
+        generate()
+        assert(os.path.getmtime(source_path) == 0)
+    finally:
+        shutil.rmtree(scratch_dir)
@@ -2,10 +2,17 @@
 from common import testing_resource_path
 
 #Feynman modules
-from feynman import parsing, integration
+from feynman import parsing, integration, compilation
 
 #System modules
+import os
+import tempfile
+import shutil
+import subprocess
 from os.path import join
+from math import asin
+from StringIO import StringIO
+from nose.plugins.skip import SkipTest
 
 def test_integrator_generation():
     #Grab the input code path
@@ -46,3 +53,333 @@ def test_integrator_generation():
 
         #Make sure the argument names make sense.
         assert(len(integrand.argument_names) == len(integrand.argument_types))
+
+def test_code_generation():
+    #Grab the input code path
+    input_code_path = join(testing_resource_path, "parsing_test_code.cl")
+
+    #Parse the input code
+    input_code = parsing.CFile(input_code_path)
+    integrand = input_code["test_function_1"]
+
+    #Generate code with each backend and make sure the
+    #integrator class and the integration kernels show up
+    for integrator_type in (integration.GslMonteCarloFunctionIntegrator,
+                            integration.OpenClMonteCarloFunctionIntegrator):
+        integrator = integrator_type(integrand)
+        header = StringIO()
+        source = StringIO()
+        integrator.generate_code(header, source, "test_integrator.h")
+        assert(("class %s" % integrator.name) in header.getvalue())
+        assert("#include \"test_integrator.h\"" in source.getvalue())
+        assert("chisq()" in source.getvalue())
+        assert("integrate_batch(" in header.getvalue())
+        assert("integrate_batch(" in source.getvalue())
+        assert("extern \"C\"" in header.getvalue())
+        assert(("%s_integrate_batch(" % integrator.name) in source.getvalue())
+        assert("MonteCarloQuasi" in header.getvalue())
+        assert("set_target_relative_error(" in header.getvalue())
+        assert(("%s_set_time_budget(" % integrator.name) in source.getvalue())
+        assert("typedef int (*ProgressCallback)(" in header.getvalue())
+        assert(("%s_set_progress_callback(" % integrator.name) in source.getvalue())
+
+        if integrator_type == integration.GslMonteCarloFunctionIntegrator:
+            assert("set_n_threads(" in header.getvalue())
+            assert("_copy_vegas_grid(" in source.getvalue())
+
+        if integrator_type == integration.OpenClMonteCarloFunctionIntegrator:
+            assert("plain_integrate" in source.getvalue())
+            assert("miser_integrate" in source.getvalue())
+            assert("vegas_integrate" in source.getvalue())
+            assert("quasi_integrate" in source.getvalue())
+            assert("integrate_async(" in header.getvalue())
+            assert("wait_batch(" in header.getvalue())
+            assert("AllDevices" in header.getvalue())
+            assert("void autotune();" in header.getvalue())
+            assert(("%s_autotune(" % integrator.name) in source.getvalue())
+            assert("std::string profile_json();" in header.getvalue())
+            assert(("%s_profile_json(" % integrator.name) in source.getvalue())
+            assert("FEYNMAN_OPENCL_PROFILE" in source.getvalue())
+            assert("class FeynmanOpenClRuntime" in header.getvalue())
+            assert("calls_per_integral" in source.getvalue())
+            assert("FeynmanOpenClRuntime::shared()" in source.getvalue())
+            assert("pending.report_progress" in source.getvalue())
+
+            #Make sure the program cache key is stable
+            #across generations
+            repeated_source = StringIO()
+            integrator.generate_code(StringIO(), repeated_source, "test_integrator.h")
+            assert("_source_hash = \"" in source.getvalue())
+            assert(repeated_source.getvalue() == source.getvalue())
+
+def test_opencl_accumulation_modes():
+    #Grab the input code path
+    input_code_path = join(testing_resource_path, "parsing_test_code.cl")
+
+    #Parse the input code
+    input_code = parsing.CFile(input_code_path)
+    integrand = input_code["test_function_1"]
+
+    #Make sure each valid mode generates the matching
+    #accumulator type
+    for accumulation, accumulator_type in (("float", "float"),
+                                           ("double", "double"),
+                                           ("kahan", "float")):
+        integrator = integration.OpenClMonteCarloFunctionIntegrator(integrand,
+                                                                    accumulation = accumulation)
+        assert(integrator.accumulation == accumulation)
+        assert(integrator.accumulator_type == accumulator_type)
+        header = StringIO()
+        source = StringIO()
+        integrator.generate_code(header, source)
+        assert(("typedef cl_%s accumulator_t;" % accumulator_type) in header.getvalue())
+        assert(("typedef %s accumulator_t;" % accumulator_type) in source.getvalue())
+        assert("__global accumulator_t *region_sums" in source.getvalue())
+        assert("__global unsigned int *region_counts" in source.getvalue())
+
+    #Make sure invalid modes are rejected
+    thrown = False
+    try:
+        integration.OpenClMonteCarloFunctionIntegrator(integrand, 
+                                                       accumulation = "half")
+    except ValueError:
+        thrown = True
+    assert(thrown)
+
+def test_opencl_bound_types():
+    #Grab the input code path
+    input_code_path = join(testing_resource_path, "parsing_test_code.cl")
+
+    #Parse the input code
+    input_code = parsing.CFile(input_code_path)
+
+    #Make sure the bounds are only sent in double precision
+    #when an argument needs it
+    for name, bound_type in (("test_function_1", "float"),
+                             ("test_function_2", "double")):
+        integrator = integration.OpenClMonteCarloFunctionIntegrator(input_code[name])
+        assert(integrator.bound_type == bound_type)
+        header = StringIO()
+        source = StringIO()
+        integrator.generate_code(header, source)
+        assert(("typedef cl_%s bound_t;" % bound_type) in header.getvalue())
+        assert(("__global const %s *bounds" % bound_type) in source.getvalue())
+
+def test_opencl_rngs():
+    #Grab the input code path
+    input_code_path = join(testing_resource_path, "parsing_test_code.cl")
+
+    #Parse the input code
+    input_code = parsing.CFile(input_code_path)
+    integrand = input_code["test_function_1"]
+
+    #Make sure RANLUXCL is the default, and that Philox
+    #leaves out RANLUXCL and its seeding kernel
+    integrator = integration.OpenClMonteCarloFunctionIntegrator(integrand)
+    assert(integrator.rng == "ranlux")
+    source = StringIO()
+    integrator.generate_code(StringIO(), source)
+    assert("random_initialize" in source.getvalue())
+    integrator = integration.OpenClMonteCarloFunctionIntegrator(integrand, 
+                                                                rng = "philox")
+    assert(integrator.rng == "philox")
+    source = StringIO()
+    integrator.generate_code(StringIO(), source)
+    assert("philox4x32_10" in source.getvalue())
+    assert("random_initialize" not in source.getvalue())
+    assert("ranluxcl32" not in source.getvalue())
+
+    #Make sure invalid generators are rejected
+    thrown = False
+    try:
+        integration.OpenClMonteCarloFunctionIntegrator(integrand, 
+                                                       rng = "mt19937")
+    except ValueError:
+        thrown = True
+    assert(thrown)
+
+def test_compilation_failure():
+    #Grab the input code path
+    input_code_path = join(testing_resource_path, "parsing_test_code.cl")
+
+    #Parse the input code
+    input_code = parsing.CFile(input_code_path)
+    integrand = input_code["test_function_1"]
+
+    #Make sure compiler failures are reported, using a
+    #scratch cache directory and a compiler which always
+    #fails
+    cache_dir = tempfile.mkdtemp()
+    old_cache_dir = os.environ.get("FEYNMAN_COMPILE_CACHE_DIR", None)
+    os.environ["FEYNMAN_COMPILE_CACHE_DIR"] = cache_dir
+    try:
+        integrator = integration.GslMonteCarloFunctionIntegrator(integrand)
+        for compiler in ("false", join(cache_dir, "missing-compiler")):
+            thrown = False
+            try:
+                integrator.compile(sources = [], compiler = compiler)
+            except RuntimeError:
+                thrown = True
+            assert(thrown)
+        assert(os.listdir(cache_dir) == [])
+    finally:
+        if old_cache_dir is None:
+            del os.environ["FEYNMAN_COMPILE_CACHE_DIR"]
+        else:
+            os.environ["FEYNMAN_COMPILE_CACHE_DIR"] = old_cache_dir
+        shutil.rmtree(cache_dir)
+
+def test_compile_cache_includes():
+    #Write an integrand which includes a header, and a
+    #"compiler" which just creates its output file
+    scratch_dir = tempfile.mkdtemp()
+    with open(join(scratch_dir, "scale.h"), "w") as f:
+        f.write("#define SCALE 2.0f\n")
+    integrand_path = join(scratch_dir, "scaled.cpp")
+    with open(integrand_path, "w") as f:
+        f.write("#include \"scale.h\"\n"
+                "float scaled(float x)\n"
+                "{\n"
+                "    return SCALE * x;\n"
+                "}\n")
+    compiler = join(scratch_dir, "fake-compiler")
+    with open(compiler, "w") as f:
+        f.write("#!/bin/sh\n"
+                "while [ \"$1\" != \"-o\" ]; do shift; done\n"
+                "touch \"$2\"\n")
+    os.chmod(compiler, 0755)
+
+    old_cache_dir = os.environ.get("FEYNMAN_COMPILE_CACHE_DIR", None)
+    old_tempdir = tempfile.tempdir
+    try:
+        #Make sure changing the header gives a new library
+        os.environ["FEYNMAN_COMPILE_CACHE_DIR"] = join(scratch_dir, "cache")
+        integrand = parsing.CFile(integrand_path)["scaled"]
+        integrator = integration.GslMonteCarloFunctionIntegrator(integrand)
+        library_path = compilation.compile_integrator(integrator, compiler = compiler)
+        assert(compilation.compile_integrator(integrator, compiler = compiler) == library_path)
+        with open(join(scratch_dir, "scale.h"), "w") as f:
+            f.write("#define SCALE 3.0f\n")
+        assert(compilation.compile_integrator(integrator, compiler = compiler) != library_path)
+
+        #Make sure the temporary directory used without a
+        #cache is removed once the library is loaded (which
+        #fails here, since the library is empty)
+        os.environ["FEYNMAN_COMPILE_CACHE_DIR"] = ""
+        tempfile.tempdir = join(scratch_dir, "temporary")
+        os.mkdir(tempfile.tempdir)
+        thrown = False
+        try:
+            integrator.compile(compiler = compiler)
+        except OSError:
+            thrown = True
+        assert(thrown)
+        assert(os.listdir(tempfile.tempdir) == [])
+    finally:
+        tempfile.tempdir = old_tempdir
+        if old_cache_dir is None:
+            del os.environ["FEYNMAN_COMPILE_CACHE_DIR"]
+        else:
+            os.environ["FEYNMAN_COMPILE_CACHE_DIR"] = old_cache_dir
+        shutil.rmtree(scratch_dir)
+
+def _gsl_available(scratch_dir):
+    #Check that GSL programs can be compiled here, by
+    #building a library which uses it
+    probe_path = join(scratch_dir, "probe.cpp")
+    with open(probe_path, "w") as f:
+        f.write("#include <gsl/gsl_monte_plain.h>\n"
+                "void *probe() { return gsl_monte_plain_alloc(1); }\n")
+    command = [os.environ.get("CXX", "c++"), "-shared", "-fPIC", 
+               "-o", join(scratch_dir, "libprobe.so"), probe_path,
+               "-lgsl", "-lgslcblas"]
+    try:
+        process = subprocess.Popen(command, 
+                                   stdout = subprocess.PIPE, 
+                                   stderr = subprocess.STDOUT)
+    except OSError:
+        return False
+    process.communicate()
+    return process.returncode == 0
+
+def test_target_with_exact_batches():
+    #Integrate a disc over a region which it only partly
+    #covers, in batches small enough that some see only one
+    #side of its edge (and so have no variance), making sure
+    #those batches are pooled with the rest rather than
+    #ending the integration
+    scratch_dir = tempfile.mkdtemp()
+    old_cache_dir = os.environ.get("FEYNMAN_COMPILE_CACHE_DIR", None)
+    try:
+        if not _gsl_available(scratch_dir):
+            raise SkipTest("GSL programs can't be compiled here.")
+        with open(join(scratch_dir, "disc.h"), "w") as f:
+            f.write("float disc(float x, float y);\n")
+        integrand_path = join(scratch_dir, "disc.cpp")
+        with open(integrand_path, "w") as f:
+            f.write("#include \"disc.h\"\n"
+                    "float disc(float x, float y)\n"
+                    "{\n"
+                    "    return x * x + y * y < 1.0f ? 1.0f : 0.0f;\n"
+                    "}\n")
+        os.environ["FEYNMAN_COMPILE_CACHE_DIR"] = join(scratch_dir, "cache")
+        integrand = parsing.CFile(integrand_path)["disc"]
+        integrand.add_include_dependency("disc.h")
+        compiled = integration.GslMonteCarloFunctionIntegrator(integrand).compile()
+        compiled.target_relative_error = 0.01
+
+        #The area of the disc over [0.6, 1] x [0, 1].  A run 
+        #can still return an exact result if its first batch
+        #is exact (about one run in a hundred), so allow for
+        #one of those.
+        exact = 0.5 * (asin(1.0) - asin(0.6) - 0.6 * 0.8)
+        results = [compiled.integrate([(0.6, 1.0), (0.0, 1.0)], 8)
+                   for i in xrange(0, 5)]
+        close = [result for result, error in results 
+                 if abs(result - exact) < 0.05 * exact]
+        assert(len(close) >= 4)
+    finally:
+        if old_cache_dir is None:
+            os.environ.pop("FEYNMAN_COMPILE_CACHE_DIR", None)
+        else:
+            os.environ["FEYNMAN_COMPILE_CACHE_DIR"] = old_cache_dir
+        shutil.rmtree(scratch_dir)
+
+def test_template_cache():
+    #Grab the input code path
+    input_code_path = join(testing_resource_path, "parsing_test_code.cl")
+
+    #Parse the input code
+    input_code = parsing.CFile(input_code_path)
+    integrand = input_code["test_function_1"]
+
+    #Generate code with templates compiled from scratch into
+    #a scratch cache, and then with templates loaded from the
+    #cache, making sure the code is the same
+    cache_dir = tempfile.mkdtemp()
+    old_cache_dir = os.environ.get("FEYNMAN_TEMPLATE_CACHE_DIR", None)
+    os.environ["FEYNMAN_TEMPLATE_CACHE_DIR"] = cache_dir
+    old_template_classes = dict(integration._template_classes)
+    try:
+        outputs = []
+        for i in xrange(0, 2):
+            integration._template_classes.clear()
+            output = []
+            for integrator in (integration.GslMonteCarloFunctionIntegrator(integrand),
+                               integration.OpenClMonteCarloFunctionIntegrator(integrand)):
+                header = StringIO()
+                source = StringIO()
+                integrator.generate_code(header, source)
+                output.append((header.getvalue(), source.getvalue()))
+            outputs.append(output)
+            assert(len(os.listdir(cache_dir)) == len(integration._template_classes))
+        assert(outputs[0] == outputs[1])
+        assert("test_function_1" in outputs[0][1][1])
+    finally:
+        integration._template_classes.clear()
+        integration._template_classes.update(old_template_classes)
+        if old_cache_dir is None:
+            del os.environ["FEYNMAN_TEMPLATE_CACHE_DIR"]
+        else:
+            os.environ["FEYNMAN_TEMPLATE_CACHE_DIR"] = old_cache_dir
+        shutil.rmtree(cache_dir)
@@ -5,8 +5,11 @@ from common import testing_resource_path
 from feynman import parsing
 
 #System modules
-from os.path import join
+import os
 import json
+import shutil
+import tempfile
+from os.path import join
 
 def _compare_parsing(file_name):
     #Grab the input code path
@@ -95,3 +98,89 @@ def test_include_dependencies():
 
         #Make sure it is correct
         assert(decl.include_dependencies[0] == "parsing_test_code.h")
+
+def test_included_declarations():
+    #Grab the input code path
+    source_path = join(testing_resource_path, "parsing_test_includes.cpp")
+
+    #Parse the input code
+    source_file = parsing.CFile(source_path)
+
+    #Make sure only the file's own functions are found (and
+    #not those from math.h), including those in namespaces
+    #and extern "C" blocks
+    names = set([decl.name for decl in source_file.function_declarations])
+    assert(names == set(["included_function_1", "included_function_2"]))
+
+    #Make sure the bodies are found, despite the misleading
+    #braces in comments and literals
+    function_1 = source_file["included_function_1"]
+    assert(function_1.has_body)
+    assert(function_1.text.startswith("float included_function_1"))
+    assert(function_1.text.endswith("return 0.0;\n        }"))
+
+    #Make sure the definition wins over the prototype
+    function_2 = source_file["included_function_2"]
+    assert(function_2.has_body)
+    assert(function_2.text.endswith("return y;\n}"))
+    assert(source_file["sqrt"] == None)
+
+def test_parse_cache():
+    #Set up a scratch cache and a source file which includes
+    #a header, both of which we can change
+    scratch_dir = tempfile.mkdtemp()
+    cache_dir = join(scratch_dir, "cache")
+    header_path = join(scratch_dir, "cached.h")
+    source_path = join(scratch_dir, "cached.cpp")
+    with open(header_path, "w") as f:
+        f.write("typedef float real;\n")
+    with open(source_path, "w") as f:
+        f.write("#include \"cached.h\"\nreal cached_function(real x)\n{\n    return x;\n}\n")
+
+    #Count the parses which actually run clang
+    parses = []
+    find_c_function_declarations = parsing._find_c_function_declarations
+    def counting_find_c_function_declarations(source_file_path):
+        parses.append(source_file_path)
+        return find_c_function_declarations(source_file_path)
+
+    old_cache_dir = os.environ.get("FEYNMAN_PARSE_CACHE_DIR", None)
+    os.environ["FEYNMAN_PARSE_CACHE_DIR"] = cache_dir
+    parsing._find_c_function_declarations = counting_find_c_function_declarations
+    try:
+        #Make sure the first parse fills the cache, and the
+        #second is loaded from it with the same results
+        first = parsing.CFile(source_path)["cached_function"]
+        second = parsing.CFile(source_path)["cached_function"]
+        assert(len(parses) == 1)
+        assert(len(os.listdir(cache_dir)) == 1)
+        assert(second.signature == first.signature)
+        assert(second.signature == "float cached_function(float x)")
+        assert(second.extent == first.extent)
+        assert(second.text == first.text)
+        assert(second.has_body)
+        assert(isinstance(second.name, str))
+
+        #Make sure the includes are loaded from the cache
+        assert(parsing.CFile(source_path).includes == (header_path,))
+
+        #Make sure changing an included file invalidates the
+        #cache
+        with open(header_path, "w") as f:
+            f.write("typedef double real;\n")
+        third = parsing.CFile(source_path)["cached_function"]
+        assert(len(parses) == 2)
+        assert(third.signature == "double cached_function(double x)")
+
+        #Make sure an empty cache directory disables the cache
+        os.environ["FEYNMAN_PARSE_CACHE_DIR"] = ""
+        parsing.CFile(source_path)
+        assert(parsing.CFile(source_path).includes == (header_path,))
+        assert(len(parses) == 4)
+    finally:
+        parsing._find_c_function_declarations = find_c_function_declarations
+        if old_cache_dir is None:
+            del os.environ["FEYNMAN_PARSE_CACHE_DIR"]
+        else:
+            os.environ["FEYNMAN_PARSE_CACHE_DIR"] = old_cache_dir
+        shutil.rmtree(scratch_dir)